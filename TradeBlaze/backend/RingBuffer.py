@@ -0,0 +1,47 @@
+import numpy as np
+
+
+# Fixed-capacity ring buffer of prices backed by a NumPy array, so memory stays flat however long we run.
+# Every value is written twice, at i and i + capacity, which keeps the most recent n values contiguous:
+# `window(n)` is then a zero-copy view instead of a slice copy of a Python list.
+class RingBuffer:
+    def __init__(self, capacity, dtype='float64'):
+        if capacity < 1:
+            raise ValueError(f'Invalid RingBuffer capacity: {capacity}')
+
+        self._capacity = capacity
+        self._buffer = np.zeros(2 * capacity, dtype=dtype)
+        self._index = 0  # next write position, always in [0, capacity)
+        self._count = 0  # total number of values ever appended
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def count(self):
+        return self._count
+
+    def append(self, value):
+        i = self._index
+        self._buffer[i] = value
+        self._buffer[i + self._capacity] = value
+        self._index = i + 1 if i + 1 < self._capacity else 0
+        self._count += 1
+
+    def latest(self):
+        if self._count == 0:
+            raise IndexError('RingBuffer is empty')
+        return self._buffer[self._index + self._capacity - 1]
+
+    # Returns a read-only view of the last n values (oldest first).
+    # The view is only valid until the next append, copy it if it has to be kept.
+    def window(self, n=None):
+        n = len(self) if n is None else min(n, len(self))
+        end = self._index + self._capacity
+        view = self._buffer[end - n:end]
+        view.flags.writeable = False
+        return view
@@ -74,23 +74,19 @@ def plot_strategy_results(ticker, strategy_data, strategy_name,
 
 
 def calculate_performance_metrics(strategy_data, strategy_name):
-    performance = {}
-
-    for ticker, df in strategy_data.items():
-        annual_return = df['strategy_return'].mean() * 252
-        annual_volatility = df['strategy_return'].std() * np.sqrt(252)
+    # one column per ticker, so that every metric is computed for all tickers in one vectorized call
+    strategy_returns = pd.DataFrame({ticker: df['strategy_return'] for ticker, df in strategy_data.items()})
+    drawdowns = pd.DataFrame({ticker: df['drawdown'] for ticker, df in strategy_data.items()})
+
+    annual_return = strategy_returns.mean() * 252
+    annual_volatility = strategy_returns.std() * np.sqrt(252)
+    performance_df = pd.DataFrame({
+        'Annual Return': annual_return,
+        'Annual Volatility': annual_volatility,
         # risk-free = 0
-        sharpe_ratio = annual_return / annual_volatility
-        max_drawdown = df['drawdown'].max()
-
-        performance[ticker] = {
-            'Annual Return': annual_return,
-            'Annual Volatility': annual_volatility,
-            'Sharpe Ratio': sharpe_ratio,
-            'Max Drawdown': max_drawdown
-        }
-
-    performance_df = pd.DataFrame(performance).T
+        'Sharpe Ratio': annual_return / annual_volatility,
+        'Max Drawdown': drawdowns.max()
+    })
     performance_df.index.name = 'Ticker'
     performance_df.columns.name = strategy_name
     return performance_df
\ No newline at end of file
@@ -7,14 +7,18 @@ import zmq
 import zmq.asyncio
 
 import Config
+from RingBuffer import RingBuffer
 
 
 class TradingStrategy:
-    def __init__(self, name="Unnamed Strategy"):
+    def __init__(self, name="Unnamed Strategy", history_size=1):
         self._logger = logging.getLogger(self.__class__.__name__)
 
         self._name = name
-        self._prices = []
+
+        # per-ticker price history, bounded to what the strategy needs to compute its signal
+        self._history_size = history_size
+        self._prices = {}
 
         # ZeroMQ subscriber for market data
         ctx = zmq.asyncio.Context()
@@ -40,9 +44,11 @@ class TradingStrategy:
             timestamp = market_data_tick['Timestamp']
             ticker = market_data_tick['Ticker']
             price = market_data_tick["Price"]
-            self._prices.append(price)
+            if ticker not in self._prices:
+                self._prices[ticker] = RingBuffer(self._history_size)
+            self._prices[ticker].append(price)
 
-            signal, reason_dict = self._generate_signal()
+            signal, reason_dict = self._generate_signal(ticker)
             if signal:
                 self._logger.debug(f"[{timestamp}] {self._name} Signal: {signal} @ {price}, {reason_dict}")
 
@@ -58,28 +64,30 @@ class TradingStrategy:
             # Unlike await asyncio.sleep(0.01), this yields without a time cost.
             await asyncio.sleep(0)
 
-    def _generate_signal(self):
+    def _generate_signal(self, ticker):
         raise NotImplementedError("Subclasses must implement generate_signal")
 
 
 class MACDStrategy(TradingStrategy):
     def __init__(self, short_window=12, long_window=26, signal_window=9):
-        super().__init__(name="MACD Strategy")
+        super().__init__(name="MACD Strategy", history_size=long_window)
         self._short_window = short_window
         self._long_window = long_window
         self._signal_window = signal_window
 
-    def _generate_signal(self):
+    def _generate_signal(self, ticker):
         """
         Computes MACD, signal line, and histogram using pandas.
         Returns a DataFrame containing all values.
         """
-        if len(self._prices) < self._long_window:
+        prices = self._prices[ticker]
+        if len(prices) < self._long_window:
             self._logger.info(
-                f"Not enough data to compute MACD, available: {len(self._prices)}, required: {self._long_window}")
+                f"Not enough data to compute MACD, available: {len(prices)}, required: {self._long_window}")
             return None, None
 
-        prices = pd.Series(self._prices[-self._long_window:], dtype='float64')
+        # zero-copy view over the ring buffer
+        prices = pd.Series(prices.window(self._long_window), dtype='float64', copy=False)
 
         ema_short = prices.ewm(span=self._short_window, adjust=False).mean()
         ema_long = prices.ewm(span=self._long_window, adjust=False).mean()
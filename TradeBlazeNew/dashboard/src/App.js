@@ -15,7 +15,9 @@ import AdminPanel from "./components/AdminPanel";
 import {WS_API_BASE_URL} from './Config';
 
 function App() {
-    const [isLoggedIn, setIsLoggedIn] = useState(false);
+    // session token from /api/login, sent with the admin requests
+    const [authToken, setAuthToken] = useState(null);
+    const isLoggedIn = authToken !== null;
     const [isTradingEnginePaused, setIsTradingEnginePaused] = useState(false);
 
     const liveData = useWebSocket(`${WS_API_BASE_URL}/ws/livefeed`);
@@ -24,7 +26,7 @@ function App() {
     // positions: [], pnl: ..., drawdown: ..., var: ...}
     return (
         <Container maxWidth="xl" sx={{mt: 2}}>
-            <DashboardHeader isLoggedIn={isLoggedIn} setIsLoggedIn={setIsLoggedIn}
+            <DashboardHeader isLoggedIn={isLoggedIn} authToken={authToken} setAuthToken={setAuthToken}
                              setIsTradingEnginePaused={setIsTradingEnginePaused}/>
             <Grid container spacing={2}>
                 <Grid item xs={12} md={8}>
@@ -57,7 +59,8 @@ function App() {
                         cagr={liveData?.cagr}
                         var_value={liveData?.var_value}
                     />
-                    <AdminPanel isLoggedIn={isLoggedIn} isTradingEnginePaused={isTradingEnginePaused}
+                    <AdminPanel isLoggedIn={isLoggedIn} authToken={authToken} setAuthToken={setAuthToken}
+                                isTradingEnginePaused={isTradingEnginePaused}
                                 setIsTradingEnginePaused={setIsTradingEnginePaused}/>
                 </Grid>
             </Grid>
@@ -14,18 +14,36 @@ import {
 import {COLORS} from "../theme/TableStyles";
 import {REST_API_BASE_URL} from '../Config';
 
-export default function AdminPanel({isLoggedIn, isTradingEnginePaused, setIsTradingEnginePaused}) {
+export default function AdminPanel({isLoggedIn, authToken, setAuthToken, isTradingEnginePaused,
+                                       setIsTradingEnginePaused}) {
     const [dialogOpen, setDialogOpen] = useState(false);
     const [dialogContent, setDialogContent] = useState("");
     const [dialogTitle, setDialogTitle] = useState("Info");
 
+    const authHeaders = {"Content-Type": "application/json", "Authorization": `Bearer ${authToken}`};
+
+    // the session token expired or the server was restarted, the user has to login again
+    const isSessionExpired = (response, title) => {
+        if (response.status !== 401) {
+            return false;
+        }
+        setAuthToken(null);
+        setDialogContent("Session expired, please login again");
+        setDialogTitle(title)
+        setDialogOpen(true);
+        return true;
+    };
+
     const handleDashboardReset = async () => {
         try {
             const response = await fetch(`${REST_API_BASE_URL}/api/reset-dashboard`, {
                 method: "POST",
-                headers: {"Content-Type": "application/json",},
+                headers: authHeaders,
                 // body: JSON.stringify({ key: "value" }), // for sending data
             });
+            if (isSessionExpired(response, "Dashboard Reset")) {
+                return;
+            }
             const data = await response.json();
             console.log("API Response:", data);
             // Show MUI dialog
@@ -43,8 +61,11 @@ export default function AdminPanel({isLoggedIn, isTradingEnginePaused, setIsTrad
     const handleTradingEnginePause = async () => {
         try {
             const response = await fetch(`${REST_API_BASE_URL}/api/pause-trading-engine`, {
-                method: "POST", headers: {"Content-Type": "application/json",},
+                method: "POST", headers: authHeaders,
             });
+            if (isSessionExpired(response, "Pause Trading Engine")) {
+                return;
+            }
             const data = await response.json();
             setIsTradingEnginePaused(true);
             console.log("API Response:", data);
@@ -62,8 +83,11 @@ export default function AdminPanel({isLoggedIn, isTradingEnginePaused, setIsTrad
     const handleTradingEngineResume = async () => {
         try {
             const response = await fetch(`${REST_API_BASE_URL}/api/resume-trading-engine`, {
-                method: "POST", headers: {"Content-Type": "application/json",},
+                method: "POST", headers: authHeaders,
             });
+            if (isSessionExpired(response, "Resume Trading Engine")) {
+                return;
+            }
             const data = await response.json();
             setIsTradingEnginePaused(false);
             console.log("API Response:", data);
@@ -28,7 +28,7 @@ const format_options = {
     timeZoneName: 'short'
 };
 
-export default function DashboardHeader({isLoggedIn, setIsLoggedIn, setIsTradingEnginePaused}) {
+export default function DashboardHeader({isLoggedIn, authToken, setAuthToken, setIsTradingEnginePaused}) {
     // State to hold current date/time string
     const [now, setNow] = useState(() => new Date().toLocaleString('en-SG', format_options));
 
@@ -45,11 +45,19 @@ export default function DashboardHeader({isLoggedIn, setIsLoggedIn, setIsTrading
         return () => clearInterval(timer);  // Clean up on unmount
     }, []);
 
-    const login_logout = () => {
+    const login_logout = async () => {
         if (!isLoggedIn) {
             setLoginDialogOpen(true);
         } else {
-            setIsLoggedIn(false);
+            setAuthToken(null);
+            try {
+                await fetch(`${REST_API_BASE_URL}/api/logout`, {
+                    method: "POST",
+                    headers: {"Authorization": `Bearer ${authToken}`},
+                });
+            } catch (error) {
+                console.error("Logout error:", error);
+            }
             console.log("Logged out");
         }
     };
@@ -69,7 +77,7 @@ export default function DashboardHeader({isLoggedIn, setIsLoggedIn, setIsTrading
             if (response.ok) {
                 const login_response = await response.json();
                 console.log("Login success:", login_response);
-                setIsLoggedIn(true);
+                setAuthToken(login_response.token);
                 setIsTradingEnginePaused(login_response.is_trading_engine_paused)
                 setLoginDialogOpen(false);
                 setLoginError(""); // Clear errors
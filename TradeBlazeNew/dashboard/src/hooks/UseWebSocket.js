@@ -1,13 +1,46 @@
 import {useEffect, useRef, useState} from "react";
 
+// Dashboard protocol, see server/Dashboard.py: a snapshot on connect, then deltas tagged with sequence numbers.
+// A gap in the sequence numbers asks the server for a new snapshot.
+function applyDelta(data, delta, maxRows) {
+    const next = {...data};
+    for (const [table, rows] of Object.entries(delta.prepend)) {
+        next[table] = [...rows, ...(data[table] || [])].slice(0, maxRows);
+    }
+    for (const [table, rowsByTicker] of Object.entries(delta.upsert)) {
+        const rows = new Map((data[table] || []).map((row) => [row.ticker, row]));
+        for (const [ticker, row] of Object.entries(rowsByTicker)) {
+            rows.set(ticker, row);
+        }
+        next[table] = Array.from(rows.values());
+    }
+    return Object.assign(next, delta.fields);
+}
+
 export default function useWebSocket(url) {
     const [data, setData] = useState(null);
     const ws = useRef(null);
+    const seq = useRef(null);
+    const maxRows = useRef(5);
 
     useEffect(() => {
         ws.current = new WebSocket(url);
         ws.current.onmessage = (evt) => {
-            setData(JSON.parse(evt.data));
+            const message = JSON.parse(evt.data);
+            if (message.type === "snapshot") {
+                seq.current = message.seq;
+                maxRows.current = message.max_rows;
+                setData(message.data);
+            } else if (message.type === "delta" && seq.current !== null) {
+                if (message.from_seq !== seq.current + 1) {
+                    // missed updates, ignore deltas until the new snapshot arrives
+                    seq.current = null;
+                    ws.current.send(JSON.stringify({type: "resync"}));
+                    return;
+                }
+                seq.current = message.seq;
+                setData((prev) => applyDelta(prev, message, maxRows.current));
+            }
         };
         return () => {
             if (ws.current) {
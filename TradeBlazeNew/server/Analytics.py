@@ -1,10 +1,26 @@
+import bisect
+import math
+from collections import deque
+from statistics import NormalDist
+
 import numpy as np
+import pandas as pd
+
+from DataModels import *
+
+# Trading seconds per year and per day, the returns Analytics is given are second-level data
+SECONDS_PER_YEAR = 3600 * 6.5 * 252
+SECONDS_PER_DAY = 3600 * 6.5
+
+# Largest log(1 + CAGR) reported, e^700 - 1 is still a finite float (e^710 overflows), so a huge gain over a short
+# span gives a huge CAGR instead of an OverflowError or an inf the dashboard's JSON can't carry
+MAX_LOG_GROWTH = 700.0
 
 
 class Analytics:
     @staticmethod
     def sharpe_ratio(returns, risk_free_rate=5.0):  # second-level data
-        freq_per_year = 3600 * 6.5 * 252
+        freq_per_year = SECONDS_PER_YEAR
 
         returns = np.array(returns)
         if len(returns) == 0:
@@ -18,7 +34,7 @@ class Analytics:
     @staticmethod
     def historical_var(returns, portfolio_value=10000, confidence_level=0.95):
         # 6.5×3600 = 23,400 (Number of Seconds in a Typical U.S. Trading Day)
-        scale_to_seconds = 23400
+        scale_to_seconds = SECONDS_PER_DAY
 
         # Use last 250 return values only
         last_returns = returns[-250:] if len(returns) >= 250 else returns
@@ -29,3 +45,276 @@ class Analytics:
         var_pct = np.percentile(last_returns, (1 - confidence_level) * 100)
         var_pct_scaled = var_pct * np.sqrt(scale_to_seconds)  # scale up to 1 day
         return -var_pct_scaled * portfolio_value
+
+    @staticmethod
+    def max_drawdown(equity):
+        # largest peak-to-trough fall of the equity curve, as a fraction of the peak
+        equity = np.asarray(equity, dtype='float64')
+        if len(equity) == 0:
+            return 0.0
+
+        peaks = np.maximum.accumulate(equity)
+        return float(np.max((peaks - equity) / peaks))
+
+
+# Analytics of many return series at once: `returns` is a (time x series) matrix, e.g. one column per symbol,
+# strategy or sweep result (a DataFrame keeps its column labels), and every metric is computed for all columns
+# in one vectorized NumPy pass. NaNs mark missing periods, e.g. of a symbol with a shorter history.
+# periods_per_year defaults to second-level data like Analytics, use 252 for daily returns.
+# The same conventions as Analytics: population std, and risk_free_rate is spread evenly over periods_per_year.
+class BatchAnalytics:
+    @staticmethod
+    def _as_matrix(returns):
+        returns = np.asarray(returns, dtype='float64')
+        return returns[:, None] if returns.ndim == 1 else returns
+
+    @staticmethod
+    def _safe_divide(numerator, denominator):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(denominator != 0, numerator / np.where(denominator != 0, denominator, 1), 0.0)
+
+    @staticmethod
+    def volatility(returns, periods_per_year=SECONDS_PER_YEAR):
+        return np.nanstd(BatchAnalytics._as_matrix(returns), axis=0) * np.sqrt(periods_per_year)
+
+    @staticmethod
+    def sharpe_ratio(returns, risk_free_rate=5.0, periods_per_year=SECONDS_PER_YEAR):
+        excess_returns = BatchAnalytics._as_matrix(returns) - risk_free_rate / periods_per_year
+        return BatchAnalytics._safe_divide(np.nanmean(excess_returns, axis=0),
+                                           np.nanstd(excess_returns, axis=0)) * np.sqrt(periods_per_year)
+
+    @staticmethod
+    def sortino_ratio(returns, risk_free_rate=5.0, periods_per_year=SECONDS_PER_YEAR):
+        excess_returns = BatchAnalytics._as_matrix(returns) - risk_free_rate / periods_per_year
+        # downside deviation: root mean square of the negative excess returns, over all periods
+        downside_deviation = np.sqrt(np.nanmean(np.minimum(excess_returns, 0.0) ** 2, axis=0))
+        return BatchAnalytics._safe_divide(np.nanmean(excess_returns, axis=0),
+                                           downside_deviation) * np.sqrt(periods_per_year)
+
+    # growth of 1 unit invested at the start, missing periods don't move it
+    @staticmethod
+    def wealth(returns):
+        return np.cumprod(1.0 + np.nan_to_num(BatchAnalytics._as_matrix(returns)), axis=0)
+
+    @staticmethod
+    def max_drawdown(returns):
+        wealth = BatchAnalytics.wealth(returns)
+        peaks = np.maximum(np.maximum.accumulate(wealth, axis=0), 1.0)
+        return np.max((peaks - wealth) / peaks, axis=0)
+
+    @staticmethod
+    def cagr(returns, periods_per_year=SECONDS_PER_YEAR):
+        returns = BatchAnalytics._as_matrix(returns)
+        years = np.count_nonzero(~np.isnan(returns), axis=0) / periods_per_year
+        final_wealth = BatchAnalytics.wealth(returns)[-1]
+        with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+            growth = np.where((years > 0) & (final_wealth > 0), final_wealth ** (1 / np.where(years > 0, years, 1)), 1.0)
+        return growth - 1.0
+
+    # beta of every series against one market return series of the same length
+    @staticmethod
+    def beta(returns, market_returns):
+        returns = BatchAnalytics._as_matrix(returns)
+        market_returns = np.asarray(market_returns, dtype='float64')[:, None]
+        valid = ~np.isnan(returns) & ~np.isnan(market_returns)
+        counts = valid.sum(axis=0)
+        r = np.where(valid, returns, 0.0)
+        m = np.where(valid, market_returns, 0.0)
+        mean_r = BatchAnalytics._safe_divide(r.sum(axis=0), counts)
+        mean_m = BatchAnalytics._safe_divide(m.sum(axis=0), counts)
+        covariance = BatchAnalytics._safe_divide((r * m).sum(axis=0), counts) - mean_r * mean_m
+        market_variance = BatchAnalytics._safe_divide((m * m).sum(axis=0), counts) - mean_m ** 2
+        return BatchAnalytics._safe_divide(covariance, market_variance)
+
+    @staticmethod
+    def treynor_ratio(returns, market_returns, risk_free_rate=5.0, periods_per_year=SECONDS_PER_YEAR):
+        excess_returns = BatchAnalytics._as_matrix(returns) - risk_free_rate / periods_per_year
+        return BatchAnalytics._safe_divide(np.nanmean(excess_returns, axis=0) * periods_per_year,
+                                           BatchAnalytics.beta(returns, market_returns))
+
+    @staticmethod
+    def information_ratio(returns, benchmark_returns, periods_per_year=SECONDS_PER_YEAR):
+        active_returns = BatchAnalytics._as_matrix(returns) - np.asarray(benchmark_returns, dtype='float64')[:, None]
+        return BatchAnalytics._safe_divide(np.nanmean(active_returns, axis=0),
+                                           np.nanstd(active_returns, axis=0)) * np.sqrt(periods_per_year)
+
+    # VaRs are positive losses on portfolio_value over horizon_periods (sqrt-of-time scaled),
+    # estimated from the last `window` periods; the defaults match Analytics.historical_var
+    @staticmethod
+    def historical_var(returns, portfolio_value=10000, confidence_level=0.95, window=250,
+                       horizon_periods=SECONDS_PER_DAY):
+        returns = BatchAnalytics._as_matrix(returns)[-window:]
+        var_pct = np.nan_to_num(np.nanpercentile(returns, (1 - confidence_level) * 100, axis=0))
+        return -var_pct * np.sqrt(horizon_periods) * portfolio_value
+
+    @staticmethod
+    def parametric_var(returns, portfolio_value=10000, confidence_level=0.95, window=250,
+                       horizon_periods=SECONDS_PER_DAY):
+        returns = BatchAnalytics._as_matrix(returns)[-window:]
+        z = NormalDist().inv_cdf(1 - confidence_level)
+        var_pct = np.nan_to_num(np.nanmean(returns, axis=0) + z * np.nanstd(returns, axis=0))
+        return -var_pct * np.sqrt(horizon_periods) * portfolio_value
+
+    # expected shortfall: the mean of the worst (1 - confidence_level) share of returns
+    @staticmethod
+    def cvar(returns, portfolio_value=10000, confidence_level=0.95, window=250, horizon_periods=SECONDS_PER_DAY):
+        returns = BatchAnalytics._as_matrix(returns)[-window:]
+        counts = np.count_nonzero(~np.isnan(returns), axis=0)
+        tail_sizes = np.maximum(np.ceil(counts * (1 - confidence_level)).astype('int64'), 1)
+        # NaNs sort last, so the tail of every column starts at row 0
+        tail_sums = np.cumsum(np.nan_to_num(np.sort(returns, axis=0)), axis=0)
+        tail_means = tail_sums[tail_sizes - 1, np.arange(returns.shape[1])] / tail_sizes
+        return -np.where(counts > 0, tail_means, 0.0) * np.sqrt(horizon_periods) * portfolio_value
+
+    # All metrics, one row per series. Treynor and information ratio need the market and benchmark returns.
+    @staticmethod
+    def performance_report(returns, market_returns=None, benchmark_returns=None, risk_free_rate=5.0,
+                           periods_per_year=SECONDS_PER_YEAR, portfolio_value=10000, confidence_level=0.95):
+        index = returns.columns if isinstance(returns, pd.DataFrame) else None
+        var_args = dict(portfolio_value=portfolio_value, confidence_level=confidence_level)
+        report = {
+            'volatility': BatchAnalytics.volatility(returns, periods_per_year),
+            'sharpe_ratio': BatchAnalytics.sharpe_ratio(returns, risk_free_rate, periods_per_year),
+            'sortino_ratio': BatchAnalytics.sortino_ratio(returns, risk_free_rate, periods_per_year),
+            'max_drawdown': BatchAnalytics.max_drawdown(returns),
+            'cagr': BatchAnalytics.cagr(returns, periods_per_year),
+            'historical_var': BatchAnalytics.historical_var(returns, **var_args),
+            'parametric_var': BatchAnalytics.parametric_var(returns, **var_args),
+            'cvar': BatchAnalytics.cvar(returns, **var_args),
+        }
+        if market_returns is not None:
+            report['treynor_ratio'] = BatchAnalytics.treynor_ratio(returns, market_returns, risk_free_rate,
+                                                                   periods_per_year)
+        if benchmark_returns is not None:
+            report['information_ratio'] = BatchAnalytics.information_ratio(returns, benchmark_returns,
+                                                                           periods_per_year)
+        return pd.DataFrame(report, index=index)
+
+
+# Welford's online mean and variance, O(1) per value and numerically stable
+class RunningStats:
+    def __init__(self):
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        return self._mean
+
+    # population variance, like np.std/np.var
+    @property
+    def variance(self):
+        return self._m2 / self._count if self._count else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+# The last `size` values kept sorted, for O(log n) search + O(n) memmove per update instead of a full sort
+class RollingQuantile:
+    def __init__(self, size=250):
+        self._values = deque(maxlen=size)
+        self._sorted = []
+
+    def add(self, value):
+        if len(self._values) == self._values.maxlen:
+            del self._sorted[bisect.bisect_left(self._sorted, self._values[0])]
+        self._values.append(value)
+        bisect.insort(self._sorted, value)
+
+    def __len__(self):
+        return len(self._sorted)
+
+    # same linear interpolation as np.percentile(values, q * 100)
+    def quantile(self, q):
+        if not self._sorted:
+            return 0.0
+        rank = q * (len(self._sorted) - 1)
+        lower = math.floor(rank)
+        upper = min(lower + 1, len(self._sorted) - 1)
+        return self._sorted[lower] + (self._sorted[upper] - self._sorted[lower]) * (rank - lower)
+
+
+# Performance stats updated incrementally on every fill, instead of recomputed from all trades:
+# round trip returns (a LONG opens, a SHORT closes, per ticker) feed the Sharpe ratio and a rolling VaR window,
+# the realized pnl feeds the equity curve for drawdown and CAGR.
+# Matches Analytics.sharpe_ratio and Analytics.historical_var over the same returns.
+class StreamingAnalytics:
+    def __init__(self, portfolio_value=10000, confidence_level=0.95, var_window=250, risk_free_rate=5.0):
+        self._portfolio_value = portfolio_value
+        self._confidence_level = confidence_level
+        self._risk_free_rate = risk_free_rate
+
+        self._entry_prices = {}  # ticker -> unit price of the open LONG
+        self._returns = RunningStats()
+        self._pnl = RunningStats()
+        self._var_returns = RollingQuantile(var_window)
+
+        self._equity = portfolio_value
+        self._peak_equity = portfolio_value
+        self._drawdown = 0.0
+        self._max_drawdown = 0.0
+        self._first_timestamp = None
+        self._last_timestamp = None
+
+    def on_trade(self, trade_data):
+        if self._first_timestamp is None:
+            self._first_timestamp = trade_data.timestamp
+        self._last_timestamp = trade_data.timestamp
+
+        price = float(trade_data.unit_price)
+        if trade_data.direction == 'LONG':
+            self._entry_prices[trade_data.ticker] = price
+        elif trade_data.direction == 'SHORT' and trade_data.ticker in self._entry_prices:
+            entry_price = self._entry_prices.pop(trade_data.ticker)
+            self._returns.add((price - entry_price) / entry_price)
+            self._var_returns.add((price - entry_price) / entry_price)
+
+            pnl = (price - entry_price) * trade_data.units
+            self._pnl.add(pnl)
+            self._equity += pnl
+            self._peak_equity = max(self._peak_equity, self._equity)
+            self._drawdown = (self._peak_equity - self._equity) / self._peak_equity
+            self._max_drawdown = max(self._max_drawdown, self._drawdown)
+
+        return self.get_analytics_data()
+
+    def sharpe_ratio(self):
+        std = self._returns.std
+        if self._returns.count == 0 or std == 0:
+            return 0.0
+        return (self._returns.mean - self._risk_free_rate / SECONDS_PER_YEAR) / std * math.sqrt(SECONDS_PER_YEAR)
+
+    def historical_var(self):
+        var_pct = self._var_returns.quantile(1 - self._confidence_level)
+        return -var_pct * math.sqrt(SECONDS_PER_DAY) * self._portfolio_value
+
+    def cagr(self):
+        # annualizing less than a trading day of history is meaningless (and overflows), report 0 until then
+        elapsed_seconds = (self._last_timestamp - self._first_timestamp) / 1e9 if self._first_timestamp else 0.0
+        if elapsed_seconds < SECONDS_PER_DAY or self._equity <= 0:
+            return 0.0
+        # in log space, the plain power overflows for a large gain over a short span
+        log_growth = SECONDS_PER_YEAR / elapsed_seconds * math.log(self._equity / self._portfolio_value)
+        return math.expm1(min(log_growth, MAX_LOG_GROWTH))
+
+    def get_analytics_data(self):
+        return AnalyticsData(timestamp=self._last_timestamp or now_ns(),
+                             pnl_std_dev=round(self._pnl.std, 2),
+                             sharpe_ratio=round(self.sharpe_ratio(), 2),
+                             drawdown=round(self._drawdown, 4),
+                             max_drawdown=round(self._max_drawdown, 4),
+                             cagr=round(self.cagr(), 4),
+                             var_value=round(self.historical_var(), 2))
@@ -0,0 +1,194 @@
+import asyncio
+import heapq
+import sys
+import time
+from dataclasses import dataclass
+
+import pandas as pd
+
+from MarketDataSource import *
+from OrderManager import *
+from TradingStrategy import *
+
+
+# Fills orders at the price of the tick being replayed, the in-process counterpart of SimulatedBroker
+class BacktestBroker:
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._latest_prices = {}
+
+    def on_market_data(self, market_data):
+        self._latest_prices[market_data.ticker] = market_data.price
+
+    async def place_order(self, order_data, on_order_execution):
+        order_data.filled_price = self._latest_prices[order_data.ticker]
+        order_data.order_status = 'FILLED'
+        self._logger.info(f'Executed order: {order_data}')
+
+        # async callback for notifying order execution
+        await on_order_execution(order_data)
+
+
+# The evaluated ticks of one ticker; signals are (timestamp, ticker index, tick index, price, action), in time order
+@dataclass
+class TickerReplay:
+    ticker: str
+    timestamps: np.ndarray
+    prices: np.ndarray
+    signals: list
+
+
+@dataclass
+class BacktestResult:
+    blotter: pd.DataFrame  # one row per TradeData, in timestamp order
+    equity_curve: pd.Series  # portfolio value after every tick, indexed by epoch ns timestamp
+    metrics: dict
+
+
+# Replays ticks straight into the production TradingStrategy and OrderManager, without sockets or sleeps.
+# Each ticker is evaluated chunk by chunk: the strategy evaluates a whole chunk with evaluate_series(); the strategy
+# state is per ticker, so the tickers are evaluated one after the other. Only the BUY/SELL signals then go through
+# OrderManager.on_signal(), i.e. _can_place_order() and the position accounting, merged across the tickers in
+# timestamp order, so that the OrderManager and its StreamingAnalytics see the fills on one timeline.
+class Backtester:
+    def __init__(self, market_data_sources, initial_capital=None, max_ticks_per_ticker=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._market_data_sources = list(market_data_sources)
+        self._initial_capital = initial_capital or Config.Backtest.InitialCapital
+        self._max_ticks_per_ticker = max_ticks_per_ticker or Config.Backtest.MaxTicksPerTicker
+
+        self._trading_strategy = TradingStrategy.create(enable_messaging=False)
+        self._broker = BacktestBroker()
+        # backtest orders and trades must not consume the live sequence numbers
+        self._order_manager = OrderManager(broker=self._broker,
+                                           order_counter=MemoryCounter(Config.ORDER_SEQ_START),
+                                           trade_counter=MemoryCounter(Config.TRADE_SEQ_START),
+                                           enable_messaging=False)
+
+        for component in ('BacktestBroker', 'OrderGateway', 'OrderManager', self._trading_strategy.__class__.__name__):
+            logging.getLogger(component).setLevel(Config.Backtest.ComponentLogLevel)
+
+    async def run(self):
+        start_time = time.perf_counter()
+        tick_count = 0
+
+        replays = [self._evaluate(ticker_index, market_data_source)
+                   for ticker_index, market_data_source in enumerate(self._market_data_sources)]
+        unit_changes, cash_changes = await self._place_orders(replays)
+
+        pnl_curves = []
+        for replay, ticker_unit_changes, ticker_cash_changes in zip(replays, unit_changes, cash_changes):
+            tick_count += len(replay.timestamps)
+            # realized + unrealized pnl after every tick = cash + units * price
+            pnl = np.cumsum(ticker_cash_changes) + np.cumsum(ticker_unit_changes) * replay.prices
+            # ticks with the same timestamp count once, with the last pnl
+            pnl_curves.append(pd.Series(pnl, index=replay.timestamps, name=replay.ticker).groupby(level=0).last())
+
+        if pnl_curves:
+            pnl = pd.concat(pnl_curves, axis=1).ffill().fillna(0.0).sum(axis=1)
+        else:
+            pnl = pd.Series(dtype='float64')
+        equity_curve = (self._initial_capital + pnl).rename('equity')
+
+        # vars() rather than asdict(), which deep-copies every field
+        blotter = pd.DataFrame([vars(trade_data) for trade_data in self._order_manager.trades],
+                               columns=list(TradeData.__dataclass_fields__))
+        blotter = blotter.sort_values(['timestamp', 'trade_id'], ignore_index=True)
+
+        elapsed_seconds = time.perf_counter() - start_time
+        metrics = self._compute_metrics(equity_curve, tick_count, elapsed_seconds)
+        self._logger.info(f"Backtest of {tick_count} ticks done in {elapsed_seconds:.2f} seconds: {metrics}")
+        return BacktestResult(blotter=blotter, equity_curve=equity_curve, metrics=metrics)
+
+    def _evaluate(self, ticker_index, market_data_source):
+        ticker = market_data_source.ticker
+        timestamp_chunks, price_chunks = [], []
+        signals = []
+        tick_count = 0
+
+        while self._max_ticks_per_ticker is None or tick_count < self._max_ticks_per_ticker:
+            chunk = market_data_source.next_chunk()
+            if chunk is None:
+                break
+            timestamps, prices = chunk
+            if self._max_ticks_per_ticker is not None:
+                timestamps = timestamps[:self._max_ticks_per_ticker - tick_count]
+                prices = prices[:self._max_ticks_per_ticker - tick_count]
+            tick_count += len(prices)
+
+            actions = self._trading_strategy.evaluate_series(ticker, timestamps, prices)
+            offset = tick_count - len(prices)
+            signals.extend((int(timestamps[i]), ticker_index, offset + i, float(prices[i]), str(actions[i]))
+                           for i in np.flatnonzero((actions == 'BUY') | (actions == 'SELL')).tolist())
+            timestamp_chunks.append(timestamps)
+            price_chunks.append(prices)
+
+        self._logger.info(f"Evaluated {tick_count} ticks of {ticker}, {len(signals)} signals")
+        if not timestamp_chunks:
+            return TickerReplay(ticker, np.zeros(0, dtype='int64'), np.zeros(0), signals)
+        return TickerReplay(ticker, np.concatenate(timestamp_chunks), np.concatenate(price_chunks), signals)
+
+    # Sends the signals of all tickers to the OrderManager in timestamp order.
+    # Returns the units and cash changes of the trades done at each tick, per ticker.
+    async def _place_orders(self, replays):
+        unit_changes = [np.zeros(len(replay.timestamps)) for replay in replays]
+        cash_changes = [np.zeros(len(replay.timestamps)) for replay in replays]
+
+        for timestamp, ticker_index, i, price, action in heapq.merge(*(replay.signals for replay in replays)):
+            market_data = MarketData(timestamp=timestamp, ticker=replays[ticker_index].ticker, price=price)
+            self._broker.on_market_data(market_data)
+
+            trade_count = len(self._order_manager.trades)
+            await self._order_manager.on_signal(SignalData(timestamp=timestamp, ticker=market_data.ticker,
+                                                           price=price, action=action))
+            for trade_data in self._order_manager.trades[trade_count:]:
+                direction = 1 if trade_data.direction == 'LONG' else -1
+                unit_changes[ticker_index][i] += direction * trade_data.units
+                cash_changes[ticker_index][i] -= direction * trade_data.units * trade_data.unit_price
+        return unit_changes, cash_changes
+
+    def _compute_metrics(self, equity_curve, tick_count, elapsed_seconds):
+        equity = equity_curve.to_numpy()
+        # returns between consecutive ticks, which is the second-level data Analytics is scaled for
+        returns = np.diff(equity) / equity[:-1] if len(equity) > 1 else np.zeros(0)
+        trade_returns = self._order_manager.compute_returns()
+
+        final_equity = float(equity[-1]) if len(equity) else float(self._initial_capital)
+        return {
+            'ticks': tick_count,
+            'trades': len(self._order_manager.trades),
+            'final_equity': round(final_equity, 2),
+            'total_return': round(final_equity / self._initial_capital - 1, 6),
+            'sharpe_ratio': round(float(Analytics.sharpe_ratio(returns)), 4),
+            'daily_var': round(float(Analytics.historical_var(returns, portfolio_value=self._initial_capital)), 2),
+            'max_drawdown': round(Analytics.max_drawdown(equity), 6),
+            'round_trips': len(trade_returns),
+            'win_rate': round(float(np.mean(np.array(trade_returns) > 0)), 4) if trade_returns else 0.0,
+            'ticks_per_second': round(tick_count / elapsed_seconds) if elapsed_seconds else 0
+        }
+
+
+async def main():
+    LoggingConfig.setup_logging('TradeBlaze_Backtest.log')
+    logger = logging.getLogger(__name__)
+
+    market_data_sources = MarketDataSource.get_instances(Config.Backtest.Tickers, Config.Backtest.Source)
+    backtester = Backtester(market_data_sources)
+    result = await backtester.run()
+
+    os.makedirs(Config.Backtest.OutputDir, exist_ok=True)
+    blotter = result.blotter.assign(timestamp=result.blotter['timestamp'].map(format_timestamp))
+    blotter.to_csv(f"{Config.Backtest.OutputDir}/blotter.csv", index=False)
+    result.equity_curve.rename_axis('timestamp').to_csv(f"{Config.Backtest.OutputDir}/equity_curve.csv")
+    logger.info(f"Blotter and equity curve saved to {Config.Backtest.OutputDir}")
+
+    for name, value in result.metrics.items():
+        print(f"{name:<18}{value}")
+
+
+if __name__ == "__main__":
+    if sys.platform.startswith("win"):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    asyncio.run(main())
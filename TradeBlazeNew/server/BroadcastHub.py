@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+
+import zmq
+from fastapi import WebSocket, WebSocketDisconnect
+
+import Config
+from Dashboard import DashboardSubscription
+from LatencyMonitor import monotonic_ns
+from Metrics import Metrics, counter_sample, gauge_sample
+
+
+# Outgoing messages of one WebSocket client: an optional snapshot followed by deltas, as (message, encoded) pairs.
+# Bounded so that a slow client can't hold up the others.
+class ClientChannel:
+    def __init__(self, websocket, queue_size, slow_client_policy, max_updates_per_second):
+        self.websocket = websocket
+        self.queue_size = queue_size
+        self.slow_client_policy = slow_client_policy
+        self.max_updates_per_second = max_updates_per_second
+        self.pending = []
+        self.ready = asyncio.Event()
+        self.coalesced = 0  # deltas merged into another one before they were sent
+        self.dropped = asyncio.Event()
+        self.group = None
+
+    def offer_snapshot(self, snapshot_payload):
+        # a snapshot supersedes everything still pending
+        self.pending = [(None, snapshot_payload)]
+        self.ready.set()
+
+    def offer_delta(self, delta, payload, merge_deltas):
+        if len(self.pending) >= self.queue_size:
+            if self.slow_client_policy == "Drop":
+                self.dropped.set()
+                return
+            self.pending = self.coalesce(self.pending, merge_deltas)
+        self.pending.append((delta, payload))
+        self.ready.set()
+
+    def take(self):
+        pending, self.pending = self.pending, []
+        self.ready.clear()
+        return pending
+
+    # snapshot first (if any), then all pending deltas merged into one, encoded lazily
+    def coalesce(self, pending, merge_deltas):
+        head = [pending[0]] if pending[0][0] is None else []
+        deltas = [delta for delta, _ in pending[len(head):]]
+        if len(deltas) > 1:
+            self.coalesced += len(deltas) - 1
+            return head + [(merge_deltas(deltas), None)]
+        return pending
+
+
+# Clients with the same subscription share its seq and the encoding of each delta
+class SubscriptionGroup:
+    def __init__(self, subscription):
+        self.subscription = subscription
+        self.clients = set()
+        self.seq = 0
+
+
+# Fans the dashboard feed out to the WebSocket clients, see Dashboard for the snapshot/delta protocol.
+# Each client subscribes to topics and tickers (all of them by default), on connect or later with
+# {"type": "subscribe", "topics": [...], "tickers": [...]}. The Dashboard's ZeroMQ subscription is the union of
+# the clients' subscriptions, so topics nobody wants are filtered out by the MessageBroker already.
+# One reader task takes each delta from the MessageBroker feed and encodes it once per subscription group,
+# every client of the group then only gets the same encoded text from its own bounded queue.
+# A client that falls behind, or that is rate limited (Config.LiveFeed.MaxUpdatesPerSecond, or
+# {"type": "rate_limit", "max_updates_per_second": n} from the client), gets its pending deltas coalesced into one;
+# with Config.LiveFeed.SlowClientPolicy = "Drop" it is dropped instead.
+class BroadcastHub:
+    def __init__(self, dashboard):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._dashboard = dashboard
+        self._clients = set()
+        self._groups = {}  # subscription key -> SubscriptionGroup
+        self._reader_task = None
+        self._removed_clients_coalesced = 0  # deltas coalesced for the clients that are gone
+
+        self._send_latency = Metrics().summary("tradeblaze_websocket_send_seconds",
+                                               "Time to send one message to a websocket client").labels()
+        self._dropped_clients = Metrics().counter("tradeblaze_websocket_dropped_clients_total",
+                                                  "Slow websocket clients dropped").labels()
+        Metrics().register_collector(self._collect_metrics)
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    # Serves one accepted WebSocket until it disconnects or is dropped
+    async def serve(self, websocket: WebSocket, subscription=None):
+        client = ClientChannel(websocket, Config.LiveFeed.ClientQueueSize, Config.LiveFeed.SlowClientPolicy,
+                               Config.LiveFeed.MaxUpdatesPerSecond)
+        # the latest snapshot first, then every delta
+        self._join(client, subscription or DashboardSubscription())
+        self._clients.add(client)
+        self._logger.info(f"Websocket clients count: {len(self._clients)}")
+
+        # the reader runs from the first client on, so that later clients connect to a current snapshot
+        if self._reader_task is None or self._reader_task.done():
+            self._reader_task = asyncio.create_task(self._read_feed())
+
+        tasks = [asyncio.create_task(self._send_updates(client)),
+                 asyncio.create_task(self._receive_until_disconnect(client)),
+                 asyncio.create_task(client.dropped.wait())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            if client.dropped.is_set():
+                self._logger.warning(f"Dropping slow websocket client: {websocket}")
+                self._dropped_clients.inc()
+                await websocket.close()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._clients.discard(client)
+            self._leave(client)
+            self._removed_clients_coalesced += client.coalesced
+            self._logger.info(f"Removed websocket connection: {websocket}, coalesced deltas: {client.coalesced}")
+            self._logger.info(f"Websocket clients count: {len(self._clients)}")
+
+    @staticmethod
+    def _encode(data):
+        # same encoding as WebSocket.send_json
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+    # e.g. after the dashboard was reset
+    def broadcast_snapshot(self):
+        for group in self._groups.values():
+            # clients see the new snapshot as the next seq
+            group.seq += 1
+            snapshot_payload = self._encode(self._dashboard.get_snapshot(group.subscription, group.seq))
+            for client in group.clients:
+                client.offer_snapshot(snapshot_payload)
+
+    # Moves a client to the group of its new subscription and sends it that group's snapshot
+    def _join(self, client, subscription):
+        self._leave(client)
+        group = self._groups.get(subscription.key)
+        if group is None:
+            group = self._groups[subscription.key] = SubscriptionGroup(subscription)
+            self._dashboard.subscribe(subscription)
+        group.clients.add(client)
+        client.group = group
+        client.offer_snapshot(self._encode(self._dashboard.get_snapshot(subscription, group.seq)))
+
+    def _leave(self, client):
+        group, client.group = client.group, None
+        if group is not None:
+            group.clients.discard(client)
+            if not group.clients:
+                del self._groups[group.subscription.key]
+                self._dashboard.unsubscribe(group.subscription)
+
+    # Runs until cancelled or until the dashboard's socket is closed (e.g. on shutdown), the next client restarts it.
+    # One bad message must not end the feed of every client, errors are logged and retried with a growing delay,
+    # so a feed that keeps failing doesn't spin.
+    async def _read_feed(self):
+        backoff_seconds = 0.0
+        while True:
+            try:
+                delta = await self._dashboard.get_realtime_dashboard_update()
+                self._fan_out(delta)
+                backoff_seconds = 0.0
+                continue
+            except zmq.ZMQError as e:
+                if e.errno in (zmq.ENOTSOCK, zmq.ETERM):
+                    self._logger.info(f"Dashboard feed closed: {e}")
+                    return
+                self._logger.exception("Failed to receive a dashboard update")
+            except Exception:
+                self._logger.exception("Failed to broadcast a dashboard update")
+
+            backoff_seconds = min(max(2 * backoff_seconds, Config.LiveFeed.ErrorBackoffSeconds),
+                                  Config.LiveFeed.MaxErrorBackoffSeconds)
+            await asyncio.sleep(backoff_seconds)
+
+    def _fan_out(self, delta):
+        # the feed is the union of all subscriptions, each group only gets what it subscribed to
+        for group in self._groups.values():
+            if not group.subscription.matches(delta["topic"], delta["ticker"]):
+                continue
+            group.seq += 1
+            group_delta = {**self._dashboard.get_subscription_delta(delta, group.subscription),
+                           "from_seq": group.seq, "seq": group.seq}
+            payload = self._encode(group_delta)
+            for client in group.clients:
+                client.offer_delta(group_delta, payload, self._dashboard.merge_deltas)
+
+    async def _send_updates(self, client):
+        while True:
+            await client.ready.wait()
+            for delta, payload in client.coalesce(client.take(), self._dashboard.merge_deltas):
+                start_ns = monotonic_ns()
+                await client.websocket.send_text(payload if payload is not None else self._encode(delta))
+                self._send_latency.record(monotonic_ns() - start_ns)
+
+            if client.max_updates_per_second:
+                # deltas arriving meanwhile are coalesced into the next message
+                await asyncio.sleep(1 / client.max_updates_per_second)
+
+    def _collect_metrics(self):
+        return [
+            gauge_sample("tradeblaze_websocket_clients", "Connected websocket clients", len(self._clients)),
+            gauge_sample("tradeblaze_websocket_subscription_groups", "Distinct subscriptions of the websocket clients",
+                         len(self._groups)),
+            gauge_sample("tradeblaze_websocket_pending_messages", "Messages queued for the websocket clients",
+                         sum(len(client.pending) for client in self._clients)),
+            counter_sample("tradeblaze_websocket_coalesced_deltas_total", "Deltas merged into another one before "
+                           "they were sent to a slow or rate limited client",
+                           self._removed_clients_coalesced + sum(client.coalesced for client in self._clients))
+        ]
+
+    async def _receive_until_disconnect(self, client):
+        try:
+            while True:
+                try:
+                    request = json.loads(await client.websocket.receive_text())
+                except json.JSONDecodeError as e:
+                    self._logger.warning(f"Invalid request from websocket client {client.websocket}: {e}")
+                    continue
+                if not isinstance(request, dict):
+                    self._logger.warning(f"Invalid request from websocket client {client.websocket}: {request}")
+                    continue
+                if request.get("type") == "resync":
+                    self._logger.info(f"Resync requested by websocket client: {client.websocket}")
+                    group = client.group
+                    client.offer_snapshot(self._encode(self._dashboard.get_snapshot(group.subscription, group.seq)))
+                elif request.get("type") == "subscribe":
+                    try:
+                        subscription = DashboardSubscription(request.get("topics"), request.get("tickers"))
+                    except (TypeError, ValueError) as e:
+                        self._logger.warning(f"Invalid subscription from websocket client {client.websocket}: {e}")
+                        continue
+                    self._logger.info(f"Websocket client {client.websocket} subscribed to "
+                                      f"topics: {subscription.topics}, tickers: {subscription.tickers}")
+                    self._join(client, subscription)
+                elif request.get("type") == "rate_limit":
+                    max_updates_per_second = request.get("max_updates_per_second")
+                    # None or 0 = no limit
+                    if max_updates_per_second is not None and not (
+                            isinstance(max_updates_per_second, (int, float))
+                            and not isinstance(max_updates_per_second, bool)
+                            and 0 <= max_updates_per_second < float("inf")):
+                        self._logger.warning(f"Invalid rate limit from websocket client {client.websocket}: "
+                                             f"{max_updates_per_second}")
+                        continue
+                    client.max_updates_per_second = max_updates_per_second
+                    self._logger.info(f"Websocket client {client.websocket} rate limited to "
+                                      f"{client.max_updates_per_second} updates per second")
+        except WebSocketDisconnect:
+            pass
@@ -0,0 +1,208 @@
+import json
+import math
+import struct
+from dataclasses import asdict
+
+import Config
+from DataModels import *
+
+# Every message starts with a header identifying its codec, message type and layout version.
+# Binary messages: 3 byte header (magic, type id, version) followed by a fixed struct layout.
+# JSON messages: {"type": ..., "version": ..., "data": {...}}, they always start with '{' which can't be
+# a binary magic, so any receiver can decode both and the JSON codec can be switched on for debugging only.
+BINARY_MAGIC = 0xB1
+HEADER = struct.Struct('<BBB')
+VERSION = 1
+
+MESSAGE_TYPE_IDS = {MarketData: 1, SignalData: 2, OrderData: 3, TradeData: 4, PositionData: 5, AnalyticsData: 6}
+MESSAGE_TYPES_BY_ID = {type_id: message_type for message_type, type_id in MESSAGE_TYPE_IDS.items()}
+MESSAGE_TYPES_BY_NAME = {message_type.__name__: message_type for message_type in MESSAGE_TYPE_IDS}
+
+# Dashboard topics, used as the first frame of each multipart message sent to the MessageBroker.
+# Messages of a ticker are sent as b"MarketData:SPY:", so subscribers can filter by type and ticker with a
+# ZeroMQ prefix subscription (the trailing ':' keeps b"MarketData:SPY:" from matching b"MarketData:SPYG:").
+TOPICS = {message_type: f"{message_type.__name__}:".encode() for message_type in MESSAGE_TYPE_IDS}
+_TICKER_TOPICS = {}  # (message type, ticker) -> topic
+
+# Enum-like string fields are sent as one byte
+ACTIONS = ('HOLD', 'BUY', 'SELL')
+SIDES = ('BUY', 'SELL')
+ORDER_TYPES = ('MARKET', 'LIMIT')
+ORDER_STATUSES = ('NEW', 'FILLED', 'CANCELLED')
+DIRECTIONS = ('LONG', 'SHORT')
+ACTION_IDS = {value: i for i, value in enumerate(ACTIONS)}
+SIDE_IDS = {value: i for i, value in enumerate(SIDES)}
+ORDER_TYPE_IDS = {value: i for i, value in enumerate(ORDER_TYPES)}
+ORDER_STATUS_IDS = {value: i for i, value in enumerate(ORDER_STATUSES)}
+DIRECTION_IDS = {value: i for i, value in enumerate(DIRECTIONS)}
+
+# Tickers are NUL padded to a fixed width
+TICKER_SIZE = 16
+
+
+class Codec:
+    @staticmethod
+    def get_instance():
+        if Config.Messaging.Codec == 'BinaryCodec':
+            return BinaryCodec()
+        elif Config.Messaging.Codec == 'JsonCodec':
+            return JsonCodec()
+        else:
+            raise ValueError(f'Invalid Codec: {Config.Messaging.Codec}')
+
+    @staticmethod
+    def get_topic(message):
+        ticker = getattr(message, 'ticker', None)
+        if ticker is None:
+            return TOPICS[type(message)]
+        topic = _TICKER_TOPICS.get((type(message), ticker))
+        if topic is None:
+            topic = _TICKER_TOPICS[(type(message), ticker)] = TOPICS[type(message)] + f"{ticker}:".encode()
+        return topic
+
+    def encode(self, message):
+        raise NotImplementedError('Subclasses must implement encode')
+
+    # Decodes a message produced by any codec
+    @staticmethod
+    def decode(data):
+        if data[0] == BINARY_MAGIC:
+            return BinaryCodec.decode_binary(data)
+        return JsonCodec.decode_json(data)
+
+
+class JsonCodec(Codec):
+    def encode(self, message):
+        return json.dumps({'type': type(message).__name__, 'version': VERSION, 'data': asdict(message)}).encode()
+
+    @staticmethod
+    def decode_json(data):
+        envelope = json.loads(data)
+        if envelope['version'] != VERSION:
+            raise ValueError(f"Unsupported {envelope['type']} version: {envelope['version']}")
+        return MESSAGE_TYPES_BY_NAME[envelope['type']](**envelope['data'])
+
+
+def _encode_ticker(ticker):
+    encoded = ticker.encode()
+    if len(encoded) > TICKER_SIZE:
+        raise ValueError(f'Ticker longer than {TICKER_SIZE} bytes: {ticker}')
+    return encoded
+
+
+def _decode_ticker(encoded):
+    return encoded.rstrip(b'\0').decode()
+
+
+class BinaryCodec(Codec):
+    # Layouts after the header, all little-endian, timestamps are int64 epoch nanoseconds
+    _MARKET_DATA = struct.Struct(f'<BBBq{TICKER_SIZE}sd')
+    _SIGNAL_DATA = struct.Struct(f'<BBBq{TICKER_SIZE}sdB')
+    _ORDER_DATA = struct.Struct(f'<BBBqq{TICKER_SIZE}sBdBBd')
+    _TRADE_DATA = struct.Struct(f'<BBBqqq{TICKER_SIZE}sBdd')
+    _POSITION_DATA = struct.Struct(f'<BBBq{TICKER_SIZE}sdddd')
+    _ANALYTICS_DATA = struct.Struct('<BBBqdddddd')
+
+    def encode(self, message):
+        message_type = type(message)
+        if message_type is MarketData:
+            return self._MARKET_DATA.pack(BINARY_MAGIC, 1, VERSION, message.timestamp,
+                                          _encode_ticker(message.ticker), message.price)
+        elif message_type is SignalData:
+            return self._SIGNAL_DATA.pack(BINARY_MAGIC, 2, VERSION, message.timestamp,
+                                          _encode_ticker(message.ticker), message.price, ACTION_IDS[message.action])
+        elif message_type is OrderData:
+            filled_price = math.nan if message.filled_price is None else message.filled_price
+            return self._ORDER_DATA.pack(BINARY_MAGIC, 3, VERSION, message.timestamp, message.order_id,
+                                         _encode_ticker(message.ticker), SIDE_IDS[message.side], message.qty,
+                                         ORDER_TYPE_IDS[message.order_type], ORDER_STATUS_IDS[message.order_status],
+                                         filled_price)
+        elif message_type is TradeData:
+            return self._TRADE_DATA.pack(BINARY_MAGIC, 4, VERSION, message.timestamp, message.trade_id,
+                                         message.order_id, _encode_ticker(message.ticker),
+                                         DIRECTION_IDS[message.direction], message.units, message.unit_price)
+        elif message_type is PositionData:
+            return self._POSITION_DATA.pack(BINARY_MAGIC, 5, VERSION, message.timestamp,
+                                            _encode_ticker(message.ticker), message.units, message.avg_unit_price,
+                                            message.realized_pnl, message.unrealized_pnl)
+        elif message_type is AnalyticsData:
+            return self._ANALYTICS_DATA.pack(BINARY_MAGIC, 6, VERSION, message.timestamp, message.pnl_std_dev,
+                                             message.sharpe_ratio, message.drawdown, message.max_drawdown,
+                                             message.cagr, message.var_value)
+        raise ValueError(f'Unsupported message type: {message_type.__name__}')
+
+    @staticmethod
+    def decode_binary(data):
+        _, type_id, version = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f'Unsupported {MESSAGE_TYPES_BY_ID[type_id].__name__} version: {version}')
+
+        if type_id == 1:
+            _, _, _, timestamp, ticker, price = BinaryCodec._MARKET_DATA.unpack(data)
+            return MarketData(timestamp=timestamp, ticker=_decode_ticker(ticker), price=price)
+        elif type_id == 2:
+            _, _, _, timestamp, ticker, price, action = BinaryCodec._SIGNAL_DATA.unpack(data)
+            return SignalData(timestamp=timestamp, ticker=_decode_ticker(ticker), price=price, action=ACTIONS[action])
+        elif type_id == 3:
+            _, _, _, timestamp, order_id, ticker, side, qty, order_type, order_status, filled_price = \
+                BinaryCodec._ORDER_DATA.unpack(data)
+            return OrderData(timestamp=timestamp, order_id=order_id, ticker=_decode_ticker(ticker), side=SIDES[side],
+                             qty=qty, order_type=ORDER_TYPES[order_type], order_status=ORDER_STATUSES[order_status],
+                             filled_price=None if math.isnan(filled_price) else filled_price)
+        elif type_id == 4:
+            _, _, _, timestamp, trade_id, order_id, ticker, direction, units, unit_price = \
+                BinaryCodec._TRADE_DATA.unpack(data)
+            return TradeData(timestamp=timestamp, trade_id=trade_id, order_id=order_id, ticker=_decode_ticker(ticker),
+                             direction=DIRECTIONS[direction], units=units, unit_price=unit_price)
+        elif type_id == 5:
+            _, _, _, timestamp, ticker, units, avg_unit_price, realized_pnl, unrealized_pnl = \
+                BinaryCodec._POSITION_DATA.unpack(data)
+            return PositionData(timestamp=timestamp, ticker=_decode_ticker(ticker), units=units,
+                                avg_unit_price=avg_unit_price, realized_pnl=realized_pnl,
+                                unrealized_pnl=unrealized_pnl)
+        elif type_id == 6:
+            _, _, _, timestamp, pnl_std_dev, sharpe_ratio, drawdown, max_drawdown, cagr, var_value = \
+                BinaryCodec._ANALYTICS_DATA.unpack(data)
+            return AnalyticsData(timestamp=timestamp, pnl_std_dev=pnl_std_dev, sharpe_ratio=sharpe_ratio,
+                                 drawdown=drawdown, max_drawdown=max_drawdown, cagr=cagr, var_value=var_value)
+        raise ValueError(f'Unsupported message type id: {type_id}')
+
+
+# Benchmark: encode + decode round trip per message type, legacy json.dumps(asdict(...)) vs the codecs
+if __name__ == "__main__":
+    import timeit
+
+    ts = now_ns()
+    samples = [
+        MarketData(timestamp=ts, ticker='SPY', price=543.21),
+        SignalData(timestamp=ts, ticker='SPY', price=543.21, action='BUY'),
+        OrderData(timestamp=ts, order_id=30_000_001, ticker='SPY', side='BUY', qty=1, order_status='FILLED',
+                  filled_price=543.21),
+        TradeData(timestamp=ts, trade_id=50_000_001, order_id=30_000_001, ticker='SPY', direction='LONG', units=1,
+                  unit_price=543.21),
+        PositionData(timestamp=ts, ticker='SPY', units=1, avg_unit_price=543.21, realized_pnl=12.5,
+                     unrealized_pnl=-3.25),
+        AnalyticsData(timestamp=ts, pnl_std_dev=4.12, sharpe_ratio=1.35, drawdown=0.012, max_drawdown=0.034,
+                      cagr=0.0, var_value=152.3),
+    ]
+    json_codec, binary_codec = JsonCodec(), BinaryCodec()
+    n = 100_000
+
+    print(f"{'message':<14}{'legacy json':>16}{'JsonCodec':>16}{'BinaryCodec':>16}{'speedup':>10}")
+    for sample in samples:
+        message_type = type(sample)
+        assert Codec.decode(binary_codec.encode(sample)) == sample
+        assert Codec.decode(json_codec.encode(sample)) == sample
+
+        legacy = timeit.timeit(lambda: message_type(**json.loads(json.dumps(asdict(sample)))), number=n)
+        json_time = timeit.timeit(lambda: Codec.decode(json_codec.encode(sample)), number=n)
+        binary_time = timeit.timeit(lambda: Codec.decode(binary_codec.encode(sample)), number=n)
+
+        def fmt(seconds, size):
+            return f"{seconds / n * 1e6:.2f}us/{size}B"
+
+        print(f"{message_type.__name__:<14}"
+              f"{fmt(legacy, len(json.dumps(asdict(sample)))):>16}"
+              f"{fmt(json_time, len(json_codec.encode(sample))):>16}"
+              f"{fmt(binary_time, len(binary_codec.encode(sample))):>16}"
+              f"{legacy / binary_time:>9.1f}x")
@@ -10,10 +10,30 @@ FEATURES = {
 MarketData = SimpleNamespace(
     EnableServerMode=False,
 
+    # All tickers are multiplexed by one MarketDataGateway onto the same PUB socket
+    Tickers=["SPY"],
+
     Source="SimulatedDataSource",
     # Source="HistoricalDataSource",
     # Source="IBKRDataSource",
 
+    # HistoricalDataSource reads data/{ticker}_HistoricalDataRepo.csv ("Csv"), the data/{ticker}_HistoricalData.duckdb
+    # file recorded while replaying the csv ("DuckDb") or the Parquet tick archive under
+    # Persistence.ArchiveDir/HistoricalData ("Parquet"), HistoricalChunkSize ticks at a time
+    HistoricalDataFormat="Csv",
+    HistoricalChunkSize=100_000,
+
+    # Replay pacing of the gateway:
+    # 1.0 = real time, N = N times faster, 0 = as fast as possible
+    ReplaySpeed=1.0,
+    # False: one tick per ticker every TickIntervalSeconds / ReplaySpeed
+    # True: the original gaps between tick timestamps / ReplaySpeed, tickers merged in timestamp order
+    ReplayOriginalTiming=False,
+    # as fast as possible: let the other coroutines run after this many ticks
+    ReplayYieldEveryTicks=1,
+    # log the achieved ticks/s at this interval
+    ReplayReportIntervalSeconds=10,
+
     # 1/0.05 = 20 messages per second
     # TickIntervalSeconds=0.01,
     # 1/0.1 = 10 messages per second
@@ -26,22 +46,223 @@ MarketData = SimpleNamespace(
     # TickStreamDurationSeconds=30,
 
     EnableDuckDbPersistence=True,
-    EnableCsvPersistence=True,
+    # Parquet tick archive, partitioned by ticker and date, see TickArchive
+    EnableParquetPersistence=True,
 
     ServerAddr="tcp://127.0.0.1:5555",
-    EnableConflation=False
+
+    # Conflation of the ticks a subscriber has not consumed yet to the latest tick per ticker, see Conflator:
+    # "Off", "Always", or "Adaptive": on once ConflationOnBacklog ticks are waiting, off again when at most
+    # ConflationOffBacklog ticks arrived while the consumer processed its last batch.
+    # "Off" = every tick is evaluated, however far behind the consumer is (the behavior before conflation existed)
+    ConflationMode="Adaptive",
+    ConflationOnBacklog=1_000,
+    ConflationOffBacklog=100,
+
+    # Ticks are sequenced, subscribers fetch the ticks of a gap from the gateway, see MarketDataFeed
+    RetransmitAddr="tcp://127.0.0.1:5560",
+    # last ticks kept by the gateway for retransmission
+    RetransmitBufferSize=10_000,
+    RetransmitTimeoutSeconds=0.5,
+    # a subscriber joining within the first ticks of a stream fetches the ticks it missed
+    JoinRecoveryTicks=1_000
+)
+
+# SimulatedDataSource related, see PathGenerator
+SimulatedData = SimpleNamespace(
+    # per tick GBM parameters, the same for every ticker
+    StartPrice=500.0,
+    Mu=0.0001,
+    Sigma=0.01,
+    # pairwise correlation of all simulated tickers, or a full correlation matrix
+    Correlation=0.0,
+
+    # Merton jumps: expected jumps per tick and the mean/std of the log jump size, JumpIntensity=0 disables jumps
+    JumpIntensity=0.0,
+    JumpMean=0.0,
+    JumpStd=0.0,
+
+    # Sigma multipliers spread evenly over a session of StepsPerSession ticks, None = flat volatility
+    IntradayVolProfile=None,
+    # IntradayVolProfile=[1.6, 1.2, 1.0, 0.8, 0.8, 0.9, 1.1, 1.5],
+    StepsPerSession=23_400,
+
+    # ticks per ticker generated in one vectorized step, the next block is generated in the background
+    BlockSize=65_536,
+    Seed=42
+)
+
+# Backtester related
+Backtest = SimpleNamespace(
+    # ticks are read through MarketDataSource.get_instances() with this source instead of MarketData.Source
+    Source="HistoricalDataSource",
+    # None = MarketData.Tickers
+    Tickers=None,
+    # None = the whole history, needed to bound a SimulatedDataSource
+    MaxTicksPerTicker=None,
+    InitialCapital=10_000,
+    # log level of the strategy and order components while backtesting, their per-tick INFO logs are slow
+    ComponentLogLevel="WARNING",
+    # the trade blotter and equity curve are written here as csv
+    OutputDir="data/backtest"
+)
+
+# ParameterSweep related, the price history is read like the backtest (Backtest.Source, first ticker)
+ParameterSweep = SimpleNamespace(
+    Strategy="MACDStrategy",
+    # Strategy="MACrossoverStrategy",
+    # Strategy="BollingerBandsStrategy",
+
+    # "Grid" = every combination of the values below, "Random" = RandomSamples combinations drawn from them
+    Search="Grid",
+    RandomSamples=100,
+    Seed=42,
+    Grids={
+        "MACDStrategy": {"short_window": [6, 8, 10, 12, 14, 16, 20, 24],
+                         "long_window": [20, 26, 30, 40, 50, 60, 80, 100],
+                         "signal_window": [5, 7, 9, 12, 15]},
+        "MACrossoverStrategy": {"short_window": [5, 10, 20, 30, 50],
+                                "long_window": [50, 100, 150, 200, 300]},
+        "BollingerBandsStrategy": {"window": [10, 20, 30, 50, 100],
+                                   "num_std": [1.5, 2.0, 2.5, 3.0]}
+    },
+
+    # None = one worker process per CPU
+    Workers=None,
+    # number of best combinations printed
+    TopN=20
+)
+
+# Tick persistence related
+Persistence = SimpleNamespace(
+    # ticks are buffered and bulk-written in batches by a background thread,
+    # a batch is flushed when it is full or after the flush interval, whichever comes first
+    BatchSize=1000,
+    FlushIntervalSeconds=1.0,
+    # when this many ticks wait to be written, "Block" slows down the tick stream, "Drop" stops persisting ticks
+    MaxBacklogTicks=100_000,
+    BackpressurePolicy="Block",
+
+    # Parquet archive: {ArchiveDir}/{data type}/ticker=.../date=.../part-*.parquet
+    ArchiveDir="data/archive",
+    ParquetRowGroupSize=50_000,
+    # an archive file is finalized (readable, safe from a crash) once its oldest ticks are this old
+    ParquetFlushIntervalSeconds=60,
+    ParquetCompression="zstd"
 )
 
 # Strategy related
 SignalData = SimpleNamespace(
     Strategy="MACDStrategy",
+    # Max number of already queued ticks evaluated together in one vectorized step
+    MaxBatchSize=256,
     ServerAddr="tcp://127.0.0.1:5556"
 )
 
 # MessageBroker related
 MessageBroker = SimpleNamespace(
     XSubSocketAddr="tcp://127.0.0.1:5557",
-    XPubSocketAddr="tcp://127.0.0.1:5558"
+    XPubSocketAddr="tcp://127.0.0.1:5558",
+
+    # late subscribers get the cached messages of their topics from here, see MessageBroker
+    SnapshotSocketAddr="tcp://127.0.0.1:5559",
+    # recent messages kept per topic and ticker, the last one is the last value
+    HistorySize=100,
+    # a component starts without a snapshot if the broker doesn't answer in time
+    SnapshotTimeoutSeconds=1.0
+)
+
+# Pipeline related
+Pipeline = SimpleNamespace(
+    # Run MessageBroker, TradingStrategy, OrderManager and MarketDataGateway each in its own OS process
+    # under PipelineSupervisor, instead of as coroutines on the one event loop of the server
+    EnableMultiProcess=False,
+
+    HeartbeatIntervalSeconds=0.5,
+    # a component that misses its heartbeat for this long is considered hung and gets restarted
+    HeartbeatTimeoutSeconds=5.0,
+    StartupTimeoutSeconds=10.0,
+    RestartDelaySeconds=1.0,
+    MaxRestarts=5,
+    # a component that doesn't exit this long after SIGTERM, e.g. with a blocked event loop, gets killed
+    StopTimeoutSeconds=5.0,
+    # how often the strategy process picks up pause/resume requests from the server
+    ControlPollSeconds=0.1
+)
+
+# Dashboard websocket feed related, see BroadcastHub
+LiveFeed = SimpleNamespace(
+    # deltas queued per client, a client further behind than this is a slow client
+    ClientQueueSize=16,
+    # "Coalesce" = merge a slow client's unsent deltas into one, "Drop" = disconnect it
+    SlowClientPolicy="Coalesce",
+    # None = no limit, clients can also set their own limit
+    MaxUpdatesPerSecond=None,
+    # delay of the feed reader after a failed update, doubled per consecutive failure up to the max
+    ErrorBackoffSeconds=0.05,
+    MaxErrorBackoffSeconds=5.0
+)
+
+# Tick-to-fill latency of the pipeline stages, see LatencyMonitor
+Latency = SimpleNamespace(
+    # p50/p99/p99.9 of every stage are logged at this interval, 0 = never
+    LogIntervalSeconds=60
+)
+
+# Logging related, see LoggingConfig and logging_config.ini
+Logging = SimpleNamespace(
+    # "Async" = a log call only enqueues the record, a background thread formats and writes it,
+    # "Sync" = the handlers run in the logging thread
+    Mode="Async",
+    # "Text" = the format of logging_config.ini, "JsonLines" = one JSON object per record
+    Format="Text",
+    # events of HotPathLogger logged for every n-th record only, 0 = none. Only sample the market data events:
+    # signals, orders, fills and positions are logged in full, one each per tick at most
+    TickLogSampling={
+        "market_data_sent": 10,
+        "dashboard_market_data_ticks": 10
+    }
+)
+
+# Diagnostics of the event loop, see StallWatchdog and SamplingProfiler
+Diagnostics = SimpleNamespace(
+    # the stack of the event loop thread is logged when the loop is blocked for this long, 0 = no watchdog
+    StallThresholdSeconds=0.2,
+    StallCheckIntervalSeconds=0.05,
+    # sampling profiler, started and stopped at /api/admin/profiler/start and /api/admin/profiler/stop by a logged in
+    # user, only if enabled
+    EnableProfiler=False,
+    ProfilerSampleIntervalSeconds=0.005,
+    # a profiler that is not stopped stops sampling after this long
+    ProfilerMaxDurationSeconds=300
+)
+
+# Prometheus metrics at /metrics, see Metrics
+Metrics = SimpleNamespace(
+    # the event loop lag is measured by sleeping for this long
+    EventLoopLagIntervalSeconds=0.1,
+    # how often the component processes push their metrics to the server in multi-process mode
+    PushIntervalSeconds=1.0
+)
+
+# Dashboard login related, see UserStore
+Auth = SimpleNamespace(
+    UserDbPath="data/users.db",
+    # open connections to the user db, shared by the logins
+    UserStorePoolSize=2,
+    # threads checking passwords with bcrypt, off the event loop
+    CheckWorkers=1,
+    # logins beyond this many waiting for their check are refused with 429 Too Many Requests
+    MaxPendingChecks=8,
+    # a session token is valid for this long after the login
+    SessionTtlSeconds=8 * 60 * 60
+)
+
+# Messaging related
+Messaging = SimpleNamespace(
+    # Wire format of all ZeroMQ messages:
+    # "BinaryCodec" = compact fixed-layout struct, "JsonCodec" = human-readable, for debugging only
+    Codec="BinaryCodec"
 )
 
 # Order related
@@ -55,6 +276,9 @@ DB_COUNTER_PATH = "data/Counter.sqlite"
 DEFAULT_SEQ_START = 10_000_000
 ORDER_SEQ_START = 30_000_000
 TRADE_SEQ_START = 50_000_000
+# ids reserved per durable counter write. A crash skips the rest of the current block plus the next block, which is
+# reserved when 10% of the current one is left, so at most 2x this many ids
+COUNTER_BLOCK_SIZE = 1000
 
 # Others
 ENABLE_LIVE_TRADING = False
@@ -1,75 +1,282 @@
-import json
+import heapq
+import itertools
 import logging
+from collections import deque
+from dataclasses import asdict
 
 import zmq.asyncio
 
 import Config
+from Codec import *
 from DataModels import *
+from LoggingConfig import *
+from SnapshotClient import *
+
+
+# Version of the websocket dashboard protocol:
+#   {"type": "snapshot", "version": 1, "seq": n, "max_rows": 5, "data": {...the subscribed part of the dashboard...}}
+#   {"type": "delta", "version": 1, "from_seq": m, "seq": n, "topic": "MarketData", "ticker": "SPY",
+#    "prepend": {table: [rows, newest first]}, "upsert": {"positions": {ticker: row}}, "fields": {name: value}}
+# Every dashboard message a client is subscribed to gets the next seq of that client's subscription,
+# a delta covers seq from_seq..seq (more than one when coalesced, then without topic and ticker).
+# A client that sees from_seq != its last seq + 1 sends {"type": "resync"} and gets a new snapshot.
+PROTOCOL_VERSION = 1
+
+# tables that only show their latest rows
+ROLLING_TABLES = ("market_data_ticks", "signals", "orders", "trades")
+
+# dashboard entries fed by each topic
+TOPIC_ENTRIES = {
+    "MarketData": ("market_data_ticks",),
+    "SignalData": ("signals",),
+    "OrderData": ("orders",),
+    "TradeData": ("trades",),
+    "PositionData": ("positions", "realized_pnl", "unrealized_pnl"),
+    "AnalyticsData": ("pnl_std_dev", "sharp_ratio", "treynor_ratio", "information_ratio", "drawdown", "max_drawdown",
+                      "cagr", "var_value"),
+}
+
+# topics the dashboard always follows, see Dashboard.__init__
+STATE_TOPICS = ("PositionData", "AnalyticsData")
+
+
+# Topics and tickers a dashboard client wants, None = all of them.
+# AnalyticsData is portfolio-wide, so it isn't filtered by ticker; realized/unrealized pnl are the totals of the
+# subscribed tickers.
+class DashboardSubscription:
+    def __init__(self, topics=None, tickers=None):
+        if isinstance(topics, str) or isinstance(tickers, str):
+            raise TypeError("Dashboard topics and tickers must be lists")
+        if topics is not None:
+            unknown_topics = set(topics) - set(TOPIC_ENTRIES)
+            if unknown_topics:
+                raise ValueError(f"Unknown dashboard topics: {sorted(unknown_topics)}")
+        self.topics = None if topics is None else tuple(sorted(set(topics)))
+        self.tickers = None if tickers is None else tuple(sorted(set(tickers)))
+
+    # from comma-separated lists, e.g. websocket query parameters
+    @staticmethod
+    def parse(topics=None, tickers=None):
+        def split(text):
+            return None if not text else [item.strip() for item in text.split(',') if item.strip()]
+
+        return DashboardSubscription(split(topics), split(tickers))
+
+    @property
+    def key(self):
+        return self.topics, self.tickers
+
+    def matches(self, topic, ticker):
+        return (self.topics is None or topic in self.topics) and \
+            (self.tickers is None or ticker is None or ticker in self.tickers)
+
+    # ZeroMQ subscription prefixes, matching the topic frames of Codec.get_topic()
+    def get_topic_prefixes(self):
+        if self.topics is None and self.tickers is None:
+            return [b""]
+        prefixes = []
+        for topic in self.topics or TOPIC_ENTRIES:
+            if self.tickers is None or topic == "AnalyticsData":
+                prefixes.append(f"{topic}:".encode())
+            else:
+                prefixes.extend(f"{topic}:{ticker}:".encode() for ticker in self.tickers)
+        return prefixes
 
 
 class Dashboard:
     def __init__(self):
         self._logger = logging.getLogger(self.__class__.__name__)
+        self._tick_log = HotPathLogger(self._logger)
 
-        self._last_dashboard_data = Dashboard.get_sample_dashboard_data()
+        self._max_rows = 5
+        self._last_dashboard_data = self._new_dashboard_data()
+        self._positions = {}  # ticker -> latest position row
+        # the latest rows of each ticker too, as (row number, row), for the snapshots of ticker subscriptions
+        self._ticker_tables = {table: {} for table in ROLLING_TABLES}
+        self._row_numbers = itertools.count()
 
-        # ZeroMQ subscriber for dashboard data
+        # ZeroMQ subscriber for dashboard data, subscribed to the union of what the clients want (see subscribe()),
+        # so the broker never sends us a topic that no client needs
         context = zmq.asyncio.Context()
         self._xsub_socket = context.socket(zmq.SUB)
         self._xsub_socket.connect(Config.MessageBroker.XPubSocketAddr)  # Connect to broker XPUB port
-        self._xsub_socket.setsockopt_string(zmq.SUBSCRIBE, "")
+        self._topic_prefix_counts = {}
+
+        # Every newly subscribed prefix first replays the MessageBroker's cached messages of that prefix,
+        # so the dashboard starts from the current state rather than from the next message
+        self._snapshot_client = SnapshotClient(context)
+        self._pending_snapshots = deque()  # (prefix, prefixes that were already subscribed)
+        self._snapshot_messages = deque()  # (topic, payload) to apply before the live stream
+        # topic -> payloads from a snapshot that can arrive again on the live stream, until a newer one arrives
+        self._snapshot_payloads = {}
+
+        # positions and analytics are state rather than a stream, they are always followed so that a client
+        # subscribing later doesn't get stale values
+        for topic in STATE_TOPICS:
+            self._subscribe_prefix(f"{topic}:".encode())
+
+    # reference counted, so a prefix stays subscribed while any subscription still needs it
+    def subscribe(self, subscription):
+        for prefix in subscription.get_topic_prefixes():
+            self._subscribe_prefix(prefix)
+
+    def _subscribe_prefix(self, prefix):
+        self._topic_prefix_counts[prefix] = self._topic_prefix_counts.get(prefix, 0) + 1
+        if self._topic_prefix_counts[prefix] == 1:
+            self._logger.info(f"Subscribing to dashboard topic prefix: {prefix}")
+            self._xsub_socket.setsockopt(zmq.SUBSCRIBE, prefix)
+            already_subscribed = tuple(other for other in self._topic_prefix_counts if other != prefix)
+            self._pending_snapshots.append((prefix, already_subscribed))
+
+    def unsubscribe(self, subscription):
+        for prefix in subscription.get_topic_prefixes():
+            self._topic_prefix_counts[prefix] -= 1
+            if self._topic_prefix_counts[prefix] == 0:
+                del self._topic_prefix_counts[prefix]
+                self._logger.info(f"Unsubscribing from dashboard topic prefix: {prefix}")
+                self._xsub_socket.setsockopt(zmq.UNSUBSCRIBE, prefix)
+
+    def _new_dashboard_data(self):
+        dashboard_data = Dashboard.get_sample_dashboard_data()
+        # rolling tables drop their oldest row by themselves
+        for table in ROLLING_TABLES:
+            dashboard_data[table] = deque(dashboard_data[table], maxlen=self._max_rows)
+        return dashboard_data
 
     def reset_dashboard_data(self):
-        self._last_dashboard_data = Dashboard.get_sample_dashboard_data()
+        self._last_dashboard_data = self._new_dashboard_data()
+        self._positions = {}
+        self._ticker_tables = {table: {} for table in ROLLING_TABLES}
 
     def get_last_dashboard_data(self):
-        return self._last_dashboard_data
+        return {name: list(value) if isinstance(value, deque) else value
+                for name, value in self._last_dashboard_data.items()}
+
+    # the part of the dashboard a subscription covers, as of seq
+    def get_snapshot(self, subscription, seq):
+        data = {}
+        for topic in subscription.topics or TOPIC_ENTRIES:
+            for name in TOPIC_ENTRIES[topic]:
+                value = self._last_dashboard_data[name]
+                if subscription.tickers is not None and name in ROLLING_TABLES:
+                    # newest rows of the subscribed tickers
+                    ticker_rows = [self._ticker_tables[name][ticker] for ticker in subscription.tickers
+                                   if ticker in self._ticker_tables[name]]
+                    value = [row for _, row in itertools.islice(
+                        heapq.merge(*ticker_rows, key=lambda numbered_row: numbered_row[0], reverse=True),
+                        self._max_rows)]
+                elif subscription.tickers is not None and name == "positions":
+                    value = [row for row in value if row["ticker"] in subscription.tickers]
+                elif isinstance(value, deque):
+                    value = list(value)
+                data[name] = value
+        if "positions" in data and subscription.tickers is not None:
+            data.update(self._get_pnl_totals(subscription.tickers))
+        return {"type": "snapshot", "version": PROTOCOL_VERSION, "seq": seq, "max_rows": self._max_rows,
+                "data": data}
+
+    # the delta as seen by a subscription that matches it
+    def get_subscription_delta(self, delta, subscription):
+        if delta["topic"] == "PositionData" and subscription.tickers is not None:
+            return {**delta, "fields": self._get_pnl_totals(subscription.tickers)}
+        return delta
 
-    # Dashboard update logic
+    # portfolio pnl across the given tickers, all of them if None
+    def _get_pnl_totals(self, tickers=None):
+        positions = [row for ticker, row in self._positions.items() if tickers is None or ticker in tickers]
+        return {"realized_pnl": round(sum(p["realized_pnl"] for p in positions), 2),
+                "unrealized_pnl": round(sum(p["unrealized_pnl"] for p in positions), 2)}
+
+    # Dashboard update logic: applies the next dashboard message and returns what it changed as a delta,
+    # without seq, which depends on the subscription it is sent to
     async def get_realtime_dashboard_update(self):
-        msg = await self._xsub_socket.recv_string()
-
-        max_rows = 5
-        if msg.startswith("MarketData:"):
-            msg = msg.removeprefix("MarketData:")
-            self._logger.info(f"[MarketData] Dashboard update: {msg}")
-            self._last_dashboard_data["market_data_ticks"].insert(0, json.loads(msg))
-            # return only the latest max_rows records as of now
-            self._last_dashboard_data["market_data_ticks"] = self._last_dashboard_data["market_data_ticks"][:max_rows]
-
-        elif msg.startswith("SignalData:"):
-            msg = msg.removeprefix("SignalData:")
-            self._logger.info(f"[SignalData] Dashboard update: {msg}")
-            self._last_dashboard_data["signals"].insert(0, json.loads(msg))
-            self._last_dashboard_data["signals"] = self._last_dashboard_data["signals"][:max_rows]
-
-        elif msg.startswith("OrderData:"):
-            msg = msg.removeprefix("OrderData:")
-            self._logger.info(f"[OrderData] Dashboard update: {msg}")
-            self._last_dashboard_data["orders"].insert(0, json.loads(msg))
-            self._last_dashboard_data["orders"] = self._last_dashboard_data["orders"][:max_rows]
-
-        elif msg.startswith("TradeData:"):
-            msg = msg.removeprefix("TradeData:")
-            self._logger.info(f"[TradeData] Dashboard update: {msg}")
-            self._last_dashboard_data["trades"].insert(0, json.loads(msg))
-            self._last_dashboard_data["trades"] = self._last_dashboard_data["trades"][:max_rows]
-
-        elif msg.startswith("PositionData:"):
-            msg = msg.removeprefix("PositionData:")
-            self._logger.info(f"[PositionData] Dashboard update: {msg}")
-            position_data_dict = json.loads(msg)
-            self._last_dashboard_data["positions"] = [position_data_dict]
-
-            position_data = PositionData(**position_data_dict)
-            self._last_dashboard_data["realized_pnl"] = position_data.realized_pnl
-            self._last_dashboard_data["unrealized_pnl"] = position_data.unrealized_pnl
+        while True:
+            topic, payload, from_snapshot = await self._next_message()
+            message = Codec.decode(payload)
+
+            # the frontend displays formatted timestamps
+            row = asdict(message)
+            row["timestamp"] = format_timestamp(message.timestamp)
+
+            table = {MarketData: "market_data_ticks", SignalData: "signals", OrderData: "orders",
+                     TradeData: "trades"}.get(type(message))
+            ticker_table = None if table is None else self._ticker_tables[table].get(message.ticker)
+            # a prefix subscribed again replays rows that are still shown
+            if not (from_snapshot and ticker_table is not None and any(row == shown for _, shown in ticker_table)):
+                break
+
+        delta = {"type": "delta", "version": PROTOCOL_VERSION, "topic": type(message).__name__,
+                 "ticker": getattr(message, "ticker", None), "prepend": {}, "upsert": {}, "fields": {}}
+
+        if table is not None:
+            self._tick_log.info(f"dashboard_{table}", **row)
+            self._last_dashboard_data[table].appendleft(row)
+            if ticker_table is None:
+                ticker_table = self._ticker_tables[table][message.ticker] = deque(maxlen=self._max_rows)
+            ticker_table.appendleft((next(self._row_numbers), row))
+            delta["prepend"][table] = [row]
+
+        elif isinstance(message, PositionData):
+            self._tick_log.info("dashboard_positions", **row)
+            self._positions[message.ticker] = row
+            self._last_dashboard_data["positions"] = list(self._positions.values())
+            delta["upsert"]["positions"] = {message.ticker: row}
+
+            # portfolio pnl across all tickers
+            delta["fields"].update(self._get_pnl_totals())
+
+        elif isinstance(message, AnalyticsData):
+            self._logger.info(f"[AnalyticsData] Dashboard update: {row}")
+            delta["fields"] = {"pnl_std_dev": message.pnl_std_dev, "sharp_ratio": message.sharpe_ratio,
+                               "drawdown": message.drawdown, "max_drawdown": message.max_drawdown,
+                               "cagr": message.cagr, "var_value": message.var_value}
 
         else:
             # Unrecognized topic
-            self._logger.info(f"[UNKNOWN] Dashboard update: {msg}")
+            self._logger.info(f"[UNKNOWN] Dashboard update: {topic}")
+
+        self._last_dashboard_data.update(delta["fields"])
+        return delta
+
+    # Returns (topic, payload, from_snapshot): the snapshots of newly subscribed prefixes first, then the live stream
+    async def _next_message(self):
+        while True:
+            if self._snapshot_messages:
+                topic, payload = self._snapshot_messages.popleft()
+                self._snapshot_payloads.setdefault(topic, set()).add(payload)
+                return topic, payload, True
+
+            if self._pending_snapshots:
+                prefix, already_subscribed = self._pending_snapshots.popleft()
+                if prefix in self._topic_prefix_counts:
+                    snapshot = await self._snapshot_client.fetch(prefix, self._max_rows) or []
+                    # messages of the other prefixes are already applied, or come with their own snapshot
+                    self._snapshot_messages.extend(
+                        (topic, payload) for topic, payload, *_ in snapshot
+                        if not any(topic.startswith(other) for other in already_subscribed))
+                continue
+
+            topic, payload, *_ = await self._xsub_socket.recv_multipart()
+            snapshot_payloads = self._snapshot_payloads.get(topic)
+            if snapshot_payloads is not None:
+                # the messages of a topic arrive in order, so after the first one that wasn't in the snapshot
+                # none of them was
+                if payload in snapshot_payloads:
+                    continue
+                del self._snapshot_payloads[topic]
+            return topic, payload, False
 
-        return self._last_dashboard_data
+    # Combines consecutive deltas, oldest first, into one delta with the same effect
+    def merge_deltas(self, deltas):
+        merged = {"type": "delta", "version": PROTOCOL_VERSION, "from_seq": deltas[0]["from_seq"],
+                  "seq": deltas[-1]["seq"], "prepend": {}, "upsert": {}, "fields": {}}
+        for delta in deltas:
+            for table, rows in delta["prepend"].items():
+                merged["prepend"][table] = (rows + merged["prepend"].get(table, []))[:self._max_rows]
+            for table, rows in delta["upsert"].items():
+                merged["upsert"].setdefault(table, {}).update(rows)
+            merged["fields"].update(delta["fields"])
+        return merged
 
     @staticmethod
     def get_sample_dashboard_data():
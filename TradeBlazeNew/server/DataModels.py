@@ -1,18 +1,38 @@
+import time
 from dataclasses import dataclass
+from datetime import datetime
 
 from pydantic import BaseModel
 
+# Timestamps of all messages are int epoch nanoseconds,
+# they are only formatted as "%Y-%m-%d %H:%M:%S.%f" (ms precision, local time) for display and CSV files
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def now_ns():
+    return time.time_ns()
+
+
+def format_timestamp(timestamp_ns):
+    seconds, nanos = divmod(timestamp_ns, 1_000_000_000)
+    return f"{datetime.fromtimestamp(seconds).strftime('%Y-%m-%d %H:%M:%S')}.{nanos // 1_000_000:03d}"
+
+
+def parse_timestamp(text):
+    dt = datetime.strptime(text, TIMESTAMP_FORMAT)
+    return int(dt.replace(microsecond=0).timestamp()) * 1_000_000_000 + dt.microsecond * 1000
+
 
 @dataclass
 class MarketData:
-    timestamp: str
+    timestamp: int  # epoch nanoseconds
     ticker: str
     price: float
 
 
 @dataclass
 class SignalData:
-    timestamp: str
+    timestamp: int  # epoch nanoseconds
     ticker: str
     price: float
     action: str  # BUY, SELL, HOLD
@@ -20,7 +40,7 @@ class SignalData:
 
 @dataclass
 class OrderData:
-    timestamp: str
+    timestamp: int  # epoch nanoseconds
     order_id: int
     ticker: str
     side: str  # BUY, SELL
@@ -32,7 +52,7 @@ class OrderData:
 
 @dataclass
 class TradeData:
-    timestamp: str
+    timestamp: int  # epoch nanoseconds
     trade_id: int
     order_id: int
     ticker: str
@@ -43,7 +63,7 @@ class TradeData:
 
 @dataclass
 class PositionData:
-    timestamp: str
+    timestamp: int  # epoch nanoseconds
     ticker: str
     units: float  # can be negative
     avg_unit_price: float
@@ -51,6 +71,17 @@ class PositionData:
     unrealized_pnl: float
 
 
+@dataclass
+class AnalyticsData:
+    timestamp: int  # epoch nanoseconds
+    pnl_std_dev: float  # of the round trip pnl
+    sharpe_ratio: float
+    drawdown: float  # fraction of the peak equity
+    max_drawdown: float
+    cagr: float
+    var_value: float  # 1-day historical VaR
+
+
 class LoginRequest(BaseModel):
     username: str
     password: str
@@ -58,4 +89,6 @@ class LoginRequest(BaseModel):
 
 class LoginResponse(BaseModel):
     status: str
+    # session token of the admin requests, see Endpoints.login
+    token: str | None = None
     is_trading_engine_paused: bool = False
@@ -1,5 +1,7 @@
+import asyncio
 import sqlite3
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import bcrypt
 import sqlite3
@@ -9,16 +11,29 @@ import Config
 # WAL (Write-Ahead Logging) is a journal mode in SQLite
 # designed for fast, safe, concurrent writes
 # especially important in low-latency applications.
+# IDs are reserved a block at a time with one durable write and handed out from memory. The stored value is the
+# last reserved id, so after a crash the unused rest of a block is skipped (a gap) but never handed out twice.
+# The next block is reserved in the background when the current one runs low.
 class WALCounter:
-    def __init__(self, counter_name="DEFAULT_SEQ"):
+    def __init__(self, counter_name="DEFAULT_SEQ", block_size=None):
         self._counter_name = counter_name
-        self._lock = threading.Lock()
+        self._block_size = block_size or Config.COUNTER_BLOCK_SIZE
+        self._lock = threading.Lock()  # guards the in-memory block
+        self._db_lock = threading.Lock()  # guards the connection
 
         self._conn = sqlite3.connect(Config.DB_COUNTER_PATH, isolation_level=None, check_same_thread=False)
         self._conn.execute("PRAGMA journal_mode=WAL;")  # Enable WAL mode
-        self._conn.execute("PRAGMA synchronous=NORMAL;")  # Faster syncs
+        # fsync every commit, this is only one write per block and makes a reserved block survive a power loss
+        self._conn.execute("PRAGMA synchronous=FULL;")
         self._init_table()
 
+        # current block: ids next_value..block_end, empty until the first id is requested
+        self._next_value = 1
+        self._block_end = 0
+        # reservation of the next block, running on its own thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{self.__class__.__name__}_{counter_name}")
+        self._next_block = None
+
     def _init_table(self):
         self._conn.execute("""
                            CREATE TABLE IF NOT EXISTS counters
@@ -48,21 +63,72 @@ class WALCounter:
 
     def next(self):
         with self._lock:
-            self._conn.execute("""
-                               UPDATE counters
-                               SET value = value + 1
-                               WHERE name = ?;
-                               """, (self._counter_name,))
+            if self._next_value > self._block_end:
+                # only waits when a block runs out before the next one is reserved
+                self._switch_block()
+            return self._take()
+
+    # Same as next(), but waits for a block reservation in a thread instead of blocking the event loop
+    async def next_async(self):
+        while True:
+            with self._lock:
+                if self._next_value <= self._block_end:
+                    return self._take()
+                if self._next_block is None:
+                    self._next_block = self._executor.submit(self._reserve_block)
+                elif self._next_block.done():
+                    self._switch_block()
+                    return self._take()
+                next_block = self._next_block
+            try:
+                await asyncio.wrap_future(next_block)
+            except Exception:
+                pass  # raised by _switch_block() on the next turn, which also clears the failed reservation
+
+    def _take(self):
+        value = self._next_value
+        self._next_value += 1
+        # reserve the next block when 10% of the current one is left
+        if self._next_block is None and self._block_end - value < self._block_size // 10:
+            self._next_block = self._executor.submit(self._reserve_block)
+        return value
+
+    def _switch_block(self):
+        if self._next_block is None:
+            self._next_block = self._executor.submit(self._reserve_block)
+        # cleared first, so a failed reservation (e.g. "database is locked") is raised once and the next call
+        # reserves again
+        next_block, self._next_block = self._next_block, None
+        self._next_value, self._block_end = next_block.result()
+
+    def _reserve_block(self):
+        with self._db_lock:
             cursor = self._conn.execute("""
-                                        SELECT value
-                                        FROM counters
-                                        WHERE name = ?;
-                                        """, (self._counter_name,))
-            return cursor.fetchone()[0]
+                                        UPDATE counters
+                                        SET value = value + ?
+                                        WHERE name = ? RETURNING value;
+                                        """, (self._block_size, self._counter_name))
+            block_end = cursor.fetchone()[0]
+        return block_end - self._block_size + 1, block_end
+
+
+# Same counting as WALCounter, in memory only, e.g. for backtests that must not consume live sequence numbers
+class MemoryCounter:
+    def __init__(self, counter_value=Config.DEFAULT_SEQ_START):
+        self._value = counter_value
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            self._value += 1
+            return self._value
+
+    async def next_async(self):
+        return self.next()
 
 # run one time to setup users
 def set_up_users_db():
-    conn = sqlite3.connect("data/users.db")
+    conn = sqlite3.connect(Config.Auth.UserDbPath)
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -1,21 +1,46 @@
-import aiosqlite
-import bcrypt
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+from BroadcastHub import *
 from Dashboard import *
+from SamplingProfiler import *
+from Supervisor import *
 from TradingStrategy import *
+from UserStore import *
+
+_bearer_token = HTTPBearer(auto_error=False)
+
+
+# The user of the session token in the request's "Authorization: Bearer <token>" header, see /api/login.
+# async, so that FastAPI runs it on the event loop like the rest of the SessionStore access, not in its threadpool
+async def require_session(credentials: HTTPAuthorizationCredentials | None = Depends(_bearer_token)):
+    username = SessionStore().get_username(credentials.credentials) if credentials is not None else None
+    if username is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not logged in or session expired",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return username
+
+
+# The profiler endpoints expose the stacks of the server, they are only served with Config.Diagnostics.EnableProfiler
+async def require_profiler_enabled():
+    if not Config.Diagnostics.EnableProfiler:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profiler is disabled")
 
 
 class Endpoints:
     # using static vars because we need to access them from static methods
     _logger = logging.getLogger(__name__)
 
-    _trading_strategy = TradingStrategy.get_instance()
+    # in multi-process mode the strategy runs in its own process, only its pause/resume control lives here
+    _trading_strategy = PipelineSupervisor().get_trading_engine_control() if Config.Pipeline.EnableMultiProcess \
+        else TradingStrategy.get_instance()
 
     _dashboard = Dashboard()
 
-    _ws_clients = set()
+    # one reader of the dashboard feed for all websocket clients
+    _broadcast_hub = BroadcastHub(_dashboard)
 
     _router = APIRouter()
 
@@ -29,60 +54,117 @@ class Endpoints:
     # Websocket endpoints
     @staticmethod
     @_router.websocket("/ws/livefeed")
-    async def websocket_endpoint(websocket: WebSocket):
-        await websocket.accept()
-        Endpoints._ws_clients.add(websocket)
-        Endpoints._logger.info(f"Created new websocket connection: {websocket}")
-        Endpoints._logger.info(f"Websocket clients count: {len(Endpoints._ws_clients)}")
+    async def websocket_endpoint(websocket: WebSocket, topics: str | None = None, tickers: str | None = None):
+        # optional comma-separated subscription, e.g. /ws/livefeed?topics=MarketData,TradeData&tickers=SPY
         try:
-            await websocket.send_json(Endpoints._dashboard.get_last_dashboard_data())
-            while True:
-                data = await Endpoints._dashboard.get_realtime_dashboard_update()
-                await websocket.send_json(data)
-                await asyncio.sleep(0)  # because `while True`
-        except WebSocketDisconnect:
-            Endpoints._ws_clients.remove(websocket)
-            Endpoints._logger.info(f"Removed websocket connection: {websocket}")
-            Endpoints._logger.info(f"Websocket clients count: {len(Endpoints._ws_clients)}")
+            subscription = DashboardSubscription.parse(topics, tickers)
+        except ValueError as e:
+            Endpoints._logger.warning(f"Rejected websocket connection: {e}")
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
+            return
+        await websocket.accept()
+        Endpoints._logger.info(f"Created new websocket connection: {websocket}, "
+                               f"topics: {subscription.topics}, tickers: {subscription.tickers}")
+        await Endpoints._broadcast_hub.serve(websocket, subscription)
 
     # REST endpoints are here
+    @staticmethod
+    @_router.get("/api/pipeline-status")
+    async def pipeline_status():
+        if not Config.Pipeline.EnableMultiProcess:
+            return {"mode": "SingleProcess", "components": []}
+        return {"mode": "MultiProcess", "components": PipelineSupervisor().get_status()}
+
+    # market data loss counters of the subscribers in this process, see MarketDataFeed.SequencedReceiver
+    @staticmethod
+    @_router.get("/api/market-data-feed-status")
+    async def market_data_feed_status():
+        if Config.Pipeline.EnableMultiProcess:
+            return {"mode": "MultiProcess", "subscribers": {}}
+        return {"mode": "SingleProcess", "subscribers": {"TradingStrategy": Endpoints._trading_strategy.feed_stats,
+                                                         "SimulatedBroker": SimulatedBroker().feed_stats}}
+
+    # p50/p99/p99.9 of the pipeline stages that run in this process, see LatencyMonitor
+    @staticmethod
+    @_router.get("/api/latency")
+    async def latency():
+        return LatencyMonitor().get_summary()
+
+    # Prometheus scrape target, see Metrics
+    @staticmethod
+    @_router.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(Metrics().render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    # Sampling profiler of the server process, see SamplingProfiler.
+    # In multi-process mode the pipeline components run in other processes and are not sampled.
+    @staticmethod
+    @_router.post("/api/admin/profiler/start", dependencies=[Depends(require_profiler_enabled)])
+    async def start_profiler(interval_seconds: float | None = None, max_duration_seconds: float | None = None,
+                             all_threads: bool = False, username: str = Depends(require_session)):
+        Endpoints._logger.info(f"Starting profiler, requested by user: {username}")
+        try:
+            SamplingProfiler().start(interval_seconds, max_duration_seconds, all_threads)
+        except RuntimeError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+        return {"status": "Profiler Started"}
+
+    # Returns the folded stacks, e.g. for flamegraph.pl or speedscope
+    @staticmethod
+    @_router.post("/api/admin/profiler/stop", dependencies=[Depends(require_profiler_enabled)])
+    async def stop_profiler(username: str = Depends(require_session)):
+        Endpoints._logger.info(f"Stopping profiler, requested by user: {username}")
+        try:
+            folded_stacks = SamplingProfiler().stop()
+        except RuntimeError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+        return PlainTextResponse(folded_stacks)
+
     @staticmethod
     @_router.post("/api/reset-dashboard")
-    async def reset_dashboard():
-        Endpoints._logger.info("Resetting dashboard")
+    async def reset_dashboard(username: str = Depends(require_session)):
+        Endpoints._logger.info(f"Resetting dashboard, requested by user: {username}")
         Endpoints._dashboard.reset_dashboard_data()
+        Endpoints._broadcast_hub.broadcast_snapshot()
         return {"status": "Reset Success"}
 
     @staticmethod
     @_router.post("/api/pause-trading-engine")
-    async def pause_trading_engine():
-        Endpoints._logger.info(f"Pausing trading engine: {Endpoints._trading_strategy}")
+    async def pause_trading_engine(username: str = Depends(require_session)):
+        Endpoints._logger.info(f"Pausing trading engine: {Endpoints._trading_strategy}, requested by user: {username}")
         Endpoints._trading_strategy.pause_trading_engine()
         return {"status": "Pause Success"}
 
     @staticmethod
     @_router.post("/api/resume-trading-engine")
-    async def resume_trading_engine():
-        Endpoints._logger.info(f"Resuming trading engine: {Endpoints._trading_strategy}")
+    async def resume_trading_engine(username: str = Depends(require_session)):
+        Endpoints._logger.info(f"Resuming trading engine: {Endpoints._trading_strategy}, "
+                               f"requested by user: {username}")
         Endpoints._trading_strategy.resume_trading_engine()
         return {"status": "Resume Success"}
 
+    # The password is checked off the event loop, see UserStore. The returned session token authenticates the
+    # admin requests as "Authorization: Bearer <token>" until it expires or the user logs out.
     @staticmethod
     @_router.post("/api/login")
     async def login(request: LoginRequest):
         Endpoints._logger.info(f"Login request for user: {request.username}")
-        async with aiosqlite.connect("data/users.db") as db:
-            cursor = await db.execute("SELECT hashed_password FROM users WHERE username = ?", (request.username,))
-            row = await cursor.fetchone()
-            await cursor.close()
-
-            if row is None:
-                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-
-            stored_hash = row[0]
-            if not bcrypt.checkpw(request.password.encode(), stored_hash.encode()):
-                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+        try:
+            is_valid = await UserStore().check_password(request.username, request.password)
+        except TooManyLoginsError as e:
+            Endpoints._logger.warning(f"Refused login of user: {request.username}, {e}")
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many logins, try again",
+                                headers={"Retry-After": "1"})
+        if not is_valid:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+
+        Endpoints._logger.info(f"Login success for user: {request.username}")
+        return LoginResponse(status="Login Success", token=SessionStore().create(request.username),
+                             is_trading_engine_paused=Endpoints._trading_strategy.is_trading_engine_paused())
 
-            Endpoints._logger.info(f"Login success for user: {request.username}")
-            return LoginResponse(status="Login Success",
-                                 is_trading_engine_paused=Endpoints._trading_strategy.is_trading_engine_paused())
+    @staticmethod
+    @_router.post("/api/logout")
+    async def logout(credentials: HTTPAuthorizationCredentials | None = Depends(_bearer_token)):
+        if credentials is not None:
+            SessionStore().remove(credentials.credentials)
+        return {"status": "Logout Success"}
@@ -0,0 +1,186 @@
+from itertools import accumulate
+
+import numpy as np
+
+
+# Streaming MACD: short EMA, long EMA, MACD line and signal line are all updated in O(1) per tick.
+# Each EMA uses the same recursion as pandas `ewm(span=..., adjust=False).mean()`: the first value seeds
+# the average, then ema = ema + alpha * (x - ema) where alpha = 2 / (span + 1).
+# State is sharded per ticker: ticker i owns slot i of every state array, so a batch of ticks for different
+# tickers is evaluated in one vectorized NumPy step and per-tick cost does not grow with the universe size.
+# Only the last `history_size` (macd, signal) values are kept per ticker, which is all crossover detection needs.
+#
+# Tolerance vs pandas:
+#   The EMAs equal `pd.Series(prices).ewm(span, adjust=False).mean()` over the full price history to within
+#   floating-point rounding (~1e-12 relative). MACD and signal are rounded to 2 decimals exactly like the
+#   pandas path, so the emitted values (and therefore BUY/SELL crossovers) agree except when an unrounded value
+#   sits within ~1e-12 of a 0.005 rounding boundary. See `python Indicators.py` for a self-check.
+#   Note the old pandas path re-seeded the EMAs from the first price of a trailing `long_window` slice on every
+#   tick; the streaming engine keeps the full EMA history instead, which is the textbook MACD definition.
+class StreamingMACD:
+    def __init__(self, short_window=12, long_window=26, signal_window=9, history_size=2, capacity=16):
+        self._long_window = long_window
+        self._alpha_short = 2.0 / (short_window + 1)
+        self._alpha_long = 2.0 / (long_window + 1)
+        self._alpha_signal = 2.0 / (signal_window + 1)
+        self._history_size = max(history_size, 2)
+
+        self._slots = {}  # ticker -> slot index into the state arrays
+        self._capacity = 0
+        self._ema_short = np.zeros(0)
+        self._ema_long = np.zeros(0)
+        self._ema_signal = np.zeros(0)
+        self._count = np.zeros(0, dtype='int64')
+        self._macd_history = np.zeros((0, self._history_size))
+        self._signal_history = np.zeros((0, self._history_size))
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        def resize(array):
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self._capacity] = array
+            return grown
+
+        self._ema_short = resize(self._ema_short)
+        self._ema_long = resize(self._ema_long)
+        self._ema_signal = resize(self._ema_signal)
+        self._count = resize(self._count)
+        self._macd_history = resize(self._macd_history)
+        self._signal_history = resize(self._signal_history)
+        self._capacity = capacity
+
+    def slot(self, ticker):
+        slot = self._slots.get(ticker)
+        if slot is None:
+            slot = len(self._slots)
+            if slot == self._capacity:
+                self._grow(2 * self._capacity)
+            self._slots[ticker] = slot
+        return slot
+
+    def count(self, ticker):
+        slot = self._slots.get(ticker)
+        return 0 if slot is None else int(self._count[slot])
+
+    # Updates the given slots with one new price each and returns (macd, signal, ready, action) arrays.
+    # Slots must be unique within one call, ticks of the same ticker have to go in separate calls, in order.
+    def update(self, slots, prices):
+        slots = np.asarray(slots, dtype='int64')
+        prices = np.asarray(prices, dtype='float64')
+
+        count = self._count[slots]
+        first = count == 0
+
+        ema_short = self._ema_short[slots]
+        ema_short = np.where(first, prices, ema_short + self._alpha_short * (prices - ema_short))
+        ema_long = self._ema_long[slots]
+        ema_long = np.where(first, prices, ema_long + self._alpha_long * (prices - ema_long))
+        macd = np.round(ema_short - ema_long, 2)
+
+        ema_signal = self._ema_signal[slots]
+        ema_signal = np.where(first, macd, ema_signal + self._alpha_signal * (macd - ema_signal))
+        signal = np.round(ema_signal, 2)
+
+        self._ema_short[slots] = ema_short
+        self._ema_long[slots] = ema_long
+        self._ema_signal[slots] = ema_signal
+
+        # fixed-size ring of recent values per ticker
+        curr = count % self._history_size
+        prev = (count - 1) % self._history_size
+        self._macd_history[slots, curr] = macd
+        self._signal_history[slots, curr] = signal
+        prev_macd = np.where(first, macd, self._macd_history[slots, prev])
+        prev_signal = np.where(first, signal, self._signal_history[slots, prev])
+
+        count += 1
+        self._count[slots] = count
+        ready = count >= self._long_window  # same warm-up as the pandas path
+
+        buy = (macd > signal) & (prev_macd <= prev_signal)
+        sell = (macd < signal) & (prev_macd >= prev_signal)
+        action = np.where(buy, 'BUY', np.where(sell, 'SELL', 'HOLD'))
+
+        return macd, signal, ready, action
+
+    # Same as calling update() once per price, for a whole series of prices of one ticker (e.g. in a backtest).
+    # The EMAs are sequential, they run as a tight Python loop with the exact arithmetic of update();
+    # everything else is vectorized.
+    def update_series(self, slot, prices):
+        prices = np.asarray(prices, dtype='float64')
+        n = len(prices)
+        count = int(self._count[slot])
+        first = count == 0
+        if n == 0:
+            return prices, prices, np.zeros(0, dtype=bool), np.zeros(0, dtype='<U4')
+
+        ema_short = self._ema_series(prices, self._alpha_short, None if first else self._ema_short[slot])
+        ema_long = self._ema_series(prices, self._alpha_long, None if first else self._ema_long[slot])
+        macd = np.round(ema_short - ema_long, 2)
+        ema_signal = self._ema_series(macd, self._alpha_signal, None if first else self._ema_signal[slot])
+        signal = np.round(ema_signal, 2)
+
+        self._ema_short[slot] = ema_short[-1]
+        self._ema_long[slot] = ema_long[-1]
+        self._ema_signal[slot] = ema_signal[-1]
+
+        prev_macd = np.empty(n)
+        prev_signal = np.empty(n)
+        prev = (count - 1) % self._history_size
+        prev_macd[0] = macd[0] if first else self._macd_history[slot, prev]
+        prev_signal[0] = signal[0] if first else self._signal_history[slot, prev]
+        prev_macd[1:] = macd[:-1]
+        prev_signal[1:] = signal[:-1]
+
+        # only the last history_size values stay in the ring
+        kept = min(n, self._history_size)
+        positions = (count + np.arange(n - kept, n)) % self._history_size
+        self._macd_history[slot, positions] = macd[n - kept:]
+        self._signal_history[slot, positions] = signal[n - kept:]
+
+        counts = count + np.arange(1, n + 1)
+        self._count[slot] = counts[-1]
+        ready = counts >= self._long_window
+
+        buy = (macd > signal) & (prev_macd <= prev_signal)
+        sell = (macd < signal) & (prev_macd >= prev_signal)
+        action = np.where(buy, 'BUY', np.where(sell, 'SELL', 'HOLD'))
+
+        return macd, signal, ready, action
+
+    # ema = ema + alpha * (x - ema) over the values, seeded with the first value when ema is None
+    @staticmethod
+    def _ema_series(values, alpha, ema=None):
+        values = values.tolist()
+        if ema is None:
+            emas = accumulate(values, lambda e, x: e + alpha * (x - e))
+        else:
+            emas = accumulate(values, lambda e, x: e + alpha * (x - e), initial=float(ema))
+            next(emas)
+        return np.fromiter(emas, dtype='float64', count=len(values))
+
+
+# Self-check against the pandas reference implementation
+if __name__ == "__main__":
+    import pandas as pd
+
+    rng = np.random.default_rng(42)
+    prices = np.round(500 * np.exp(np.cumsum(rng.normal(0, 0.01, 20_000))), 2)
+
+    macd_engine = StreamingMACD()
+    slot = macd_engine.slot('SPY')
+    streaming = np.array([[v[0] for v in macd_engine.update([slot], [p])[:2]] for p in prices])
+
+    series = pd.Series(prices)
+    macd_line = (series.ewm(span=12, adjust=False).mean() - series.ewm(span=26, adjust=False).mean()).round(2)
+    signal_line = macd_line.ewm(span=9, adjust=False).mean().round(2)
+
+    print(f"max |MACD diff|: {np.max(np.abs(streaming[:, 0] - macd_line.values)):.2e}")
+    print(f"max |Signal diff|: {np.max(np.abs(streaming[:, 1] - signal_line.values)):.2e}")
+
+    # update_series() in uneven chunks must match update() tick by tick exactly
+    series_engine = StreamingMACD()
+    slot = series_engine.slot('SPY')
+    chunks = np.split(prices, [1, 10, 1000, 7777])
+    series = np.concatenate([np.stack(series_engine.update_series(slot, chunk)[:2], axis=1) for chunk in chunks])
+    print(f"update_series matches update: {np.array_equal(series, streaming)}")
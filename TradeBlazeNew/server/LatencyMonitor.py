@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import math
+import struct
+import time
+
+import Config
+from Decorator import *
+
+# Monotonic clock of all latency measurements. CLOCK_MONOTONIC is system-wide, so timestamps taken in different
+# processes of the multi-process pipeline on the same host can be subtracted.
+monotonic_ns = time.monotonic_ns
+
+# Second frame of the signal messages: when the gateway sent the tick of the signal and when the signal was sent
+SIGNAL_TIMES = struct.Struct('<qq')
+
+
+# HDR-style histogram of nanosecond latencies: exact below 2^significant_bits, then log-linear buckets of
+# 2^(significant_bits - 1) sub-buckets per power of 2, i.e. a relative error below 2^-(significant_bits - 1).
+# Recording is a few integer operations and the memory is fixed, whatever the range of the values.
+class LatencyHistogram:
+    def __init__(self, significant_bits=7):
+        self._significant_bits = significant_bits
+        self._sub_bucket_count = 1 << significant_bits
+        self._half_count = self._sub_bucket_count >> 1
+        # enough buckets for every int64 value
+        self._counts = [0] * (self._sub_bucket_count + (64 - significant_bits) * self._half_count)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value_ns):
+        value_ns = max(0, value_ns)
+        shift = value_ns.bit_length() - self._significant_bits
+        if shift <= 0:
+            index = value_ns
+        else:
+            index = self._sub_bucket_count + (shift - 1) * self._half_count + (value_ns >> shift) - self._half_count
+        self._counts[index] += 1
+        self.count += 1
+        self.total += value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+
+    # the highest value of the bucket of the p-th percentile, like HdrHistogram reports it
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        target = max(1, math.ceil(p / 100 * self.count))
+        cumulative = 0
+        for index, count in enumerate(self._counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+    def _highest_value(self, index):
+        if index < self._sub_bucket_count:
+            return index
+        shift = (index - self._sub_bucket_count) // self._half_count + 1
+        sub_bucket = (index - self._sub_bucket_count) % self._half_count + self._half_count
+        return ((sub_bucket + 1) << shift) - 1
+
+    def get_summary(self):
+        # in microseconds
+        return {"count": self.count,
+                "mean_us": round(self.total / self.count / 1000, 1) if self.count else 0.0,
+                "p50_us": round(self.percentile(50) / 1000, 1),
+                "p99_us": round(self.percentile(99) / 1000, 1),
+                "p99_9_us": round(self.percentile(99.9) / 1000, 1),
+                "max_us": round(self.max / 1000, 1)}
+
+
+# The latency histograms of the pipeline stages of this process, by stage name:
+#   gateway.publish          tick taken from the source -> sent to the subscribers and the MessageBroker
+#   strategy.queue           tick sent by the gateway -> its batch starts being evaluated (transport + queueing)
+#   strategy.evaluate        evaluation of one batch of ticks
+#   order_manager.queue      signal sent by the strategy -> received by the OrderManager
+#   order_manager.on_signal  signal received -> processed, including the order placement
+#   order_gateway.on_order   order received by the OrderGateway -> placed, filled and the trade processed
+#   broker.place_order       SimulatedBroker.place_order called -> fill reported
+#   tick_to_fill             tick sent by the gateway -> the order of its signal filled, end to end
+@singleton
+class LatencyMonitor:
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._histograms = {}
+
+    @property
+    def histograms(self):
+        return self._histograms
+
+    def histogram(self, stage):
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = self._histograms[stage] = LatencyHistogram()
+        return histogram
+
+    def get_summary(self):
+        return {stage: histogram.get_summary() for stage, histogram in self._histograms.items()}
+
+    async def log_periodically(self):
+        if not Config.Latency.LogIntervalSeconds:
+            return
+        while True:
+            await asyncio.sleep(Config.Latency.LogIntervalSeconds)
+            for stage, summary in self.get_summary().items():
+                self._logger.info(f"{stage}: {summary}")
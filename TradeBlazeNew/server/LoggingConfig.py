@@ -1,11 +1,114 @@
+import atexit
+import json
 import logging.config
+import logging.handlers
 import os
+import queue
+
+import Config
+
+# message arguments of these types can't change before the listener thread formats them
+_IMMUTABLE_TYPES = (str, int, float, bool, bytes, type(None))
 
 
 class LoggingConfig:
+    _listener = None
+
     @staticmethod
-    def setup_logging():
+    def setup_logging(log_file_name='TradeBlaze.log'):
+        if Config.Logging.Mode not in ("Sync", "Async"):
+            raise ValueError(f"Invalid logging Mode: {Config.Logging.Mode}")
+        if Config.Logging.Format not in ("Text", "JsonLines"):
+            raise ValueError(f"Invalid logging Format: {Config.Logging.Format}")
+
         # Ensure data and logs directories exist
         os.makedirs('data', exist_ok=True)
         os.makedirs('logs', exist_ok=True)
-        logging.config.fileConfig('logging_config.ini', disable_existing_loggers=False)
+        LoggingConfig._stop_listener()
+        # each process of the multi-process pipeline writes its own log file
+        logging.config.fileConfig('logging_config.ini', defaults={'log_file_name': log_file_name},
+                                  disable_existing_loggers=False)
+
+        root_logger = logging.getLogger()
+        if Config.Logging.Format == "JsonLines":
+            for handler in root_logger.handlers:
+                handler.setFormatter(JsonLinesFormatter())
+
+        if Config.Logging.Mode == "Async":
+            # the handlers of logging_config.ini now run on the listener thread, a log call only enqueues the record
+            handlers = list(root_logger.handlers)
+            for handler in handlers:
+                root_logger.removeHandler(handler)
+            log_queue = queue.SimpleQueue()
+            root_logger.addHandler(AsyncQueueHandler(log_queue))
+            LoggingConfig._listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            LoggingConfig._listener.start()
+
+    # writes out the records still queued
+    @staticmethod
+    def _stop_listener():
+        if LoggingConfig._listener is not None:
+            LoggingConfig._listener.stop()
+            LoggingConfig._listener = None
+
+
+atexit.register(LoggingConfig._stop_listener)
+
+
+# Enqueues the records for the QueueListener without formatting them, unlike logging.handlers.QueueHandler.
+# Only a message with mutable arguments, e.g. logger.info("%s", positions), is rendered right away,
+# because the arguments could have changed by the time the listener thread gets to it.
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        if record.args and not (isinstance(record.args, tuple) and
+                                all(isinstance(arg, _IMMUTABLE_TYPES) for arg in record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+# Message of a HotPathLogger record, serialized only when a handler formats it
+class StructuredMessage:
+    __slots__ = ('event', 'fields')
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        return f"{self.event} {json.dumps(self.fields, separators=(',', ':'), default=str)}"
+
+
+# One JSON object per record, with the fields of a HotPathLogger record at the top level
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "thread": record.threadName,
+                 "logger": record.name, "function": record.funcName}
+        if isinstance(record.msg, StructuredMessage):
+            entry["event"] = record.msg.event
+            entry.update(record.msg.fields)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+# Structured logger for the per-tick messages of a component: an event name and its fields, no f-string.
+# When INFO is disabled for the logger a call returns right away. Otherwise only every n-th record of an event
+# is logged, n = Config.Logging.TickLogSampling[event] (default 1 = all, 0 = none). The fields are serialized later,
+# on the listener thread in Async mode, so their values must not change: numbers, strings or new dicts of them.
+class HotPathLogger:
+    def __init__(self, logger):
+        self._logger = logger
+        self._counts = {}  # event -> records so far
+
+    def info(self, event, **fields):
+        sample_every = Config.Logging.TickLogSampling.get(event, 1)
+        if not sample_every or not self._logger.isEnabledFor(logging.INFO):
+            return
+        count = self._counts.get(event, 0)
+        self._counts[event] = count + 1
+        if count % sample_every == 0:
+            # stacklevel: the caller's function name in the record
+            self._logger.info(StructuredMessage(event, fields), stacklevel=2)
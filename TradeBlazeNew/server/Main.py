@@ -8,6 +8,8 @@ from MarketDataGateway import *
 from MessageBroker import *
 from OrderManager import *
 from SimulatedBroker import *
+from StallWatchdog import *
+from Supervisor import *
 from TradingStrategy import *
 
 
@@ -16,6 +18,11 @@ async def main():
     logger = logging.getLogger(__name__)
     logger.info("Starting Trade Blaze server ..")
 
+    if Config.Pipeline.EnableMultiProcess:
+        logger.info("Running one process per pipeline component")
+        await asyncio.gather(PipelineSupervisor().run(), Metrics().monitor_event_loop_lag(), StallWatchdog().run())
+        return
+
     message_broker = MessageBroker()
     trading_strategy = TradingStrategy.get_instance()
     order_manager = OrderManager()
@@ -26,7 +33,10 @@ async def main():
         message_broker.run(),
         trading_strategy.on_market_data(),
         order_manager.on_signal_data(),
-        simulated_broker.on_market_data()
+        simulated_broker.on_market_data(),
+        LatencyMonitor().log_periodically(),
+        Metrics().monitor_event_loop_lag(),
+        StallWatchdog().run()
 
         # parallel tasks
         # asyncio.to_thread(asyncio.run, message_broker.run()),
@@ -37,8 +47,8 @@ async def main():
 
     if not Config.MarketData.EnableServerMode:
         logger.info("MarketDataGateway is set to run in-process")
-        market_data_source = MarketDataSource.get_instance()
-        market_data_gateway = MarketDataGateway(market_data_source)
+        market_data_sources = MarketDataSource.get_instances()
+        market_data_gateway = MarketDataGateway(market_data_sources)
         async_tasks.append(market_data_gateway.stream_prices())
         # async_tasks.append(asyncio.to_thread(asyncio.run, market_data_gateway.stream_prices()))
 
@@ -56,6 +66,7 @@ async def lifespan(the_app: FastAPI):
         await task
     except asyncio.CancelledError:
         pass
+    await UserStore().close()
 
 
 if sys.platform.startswith("win"):
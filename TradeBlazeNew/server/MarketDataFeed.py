@@ -0,0 +1,301 @@
+import asyncio
+import itertools
+import logging
+import struct
+import time
+from collections import deque
+
+import zmq
+import zmq.asyncio
+
+import Config
+from Codec import *
+from Metrics import *
+
+# Every market data frame starts with the id of the gateway stream (its start time in epoch ns), the
+# sequence number of the tick in that stream, counting from 1, and the monotonic_ns() time the gateway sent it,
+# followed by the encoded MarketData
+SEQUENCE_HEADER = struct.Struct('<QQq')
+
+# Retransmit request: stream id, first and last missing sequence number.
+# Reply: the buffered frames of that range, in order, then an empty frame
+RETRANSMIT_REQUEST = struct.Struct('<QQQ')
+
+
+# Gateway side: stamps the ticks with their sequence number and keeps the last ones for retransmission
+class RetransmitBuffer:
+    def __init__(self, context, size=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._stream_id = time.time_ns()
+        self._seq = 0
+        self._frames = deque(maxlen=size or Config.MarketData.RetransmitBufferSize)
+
+        self._retransmit_socket = context.socket(zmq.ROUTER)
+        self._retransmit_socket.bind(Config.MarketData.RetransmitAddr)  # SequencedReceivers connect here
+
+    def stamp(self, payload, sent_ns):
+        self._seq += 1
+        frame = SEQUENCE_HEADER.pack(self._stream_id, self._seq, sent_ns) + payload
+        self._frames.append(frame)
+        return frame
+
+    async def serve(self):
+        while True:
+            message = await self._retransmit_socket.recv_multipart()
+            if len(message) != 2 or len(message[1]) != RETRANSMIT_REQUEST.size:
+                self._logger.warning(f"Invalid retransmit request: {message}")
+                continue
+            identity, request = message
+            stream_id, first_seq, last_seq = RETRANSMIT_REQUEST.unpack(request)
+            frames = self._get_frames(first_seq, last_seq) if stream_id == self._stream_id else []
+            self._logger.info(f"Retransmitting {len(frames)} of ticks {first_seq}..{last_seq}")
+            for frame in frames:
+                await self._retransmit_socket.send_multipart([identity, frame])
+            await self._retransmit_socket.send_multipart([identity, b""])
+
+    def _get_frames(self, first_seq, last_seq):
+        # the buffer holds the consecutive sequence numbers up to self._seq
+        oldest_seq = self._seq - len(self._frames) + 1
+        start = max(first_seq, oldest_seq) - oldest_seq
+        stop = min(last_seq, self._seq) - oldest_seq + 1
+        return list(itertools.islice(self._frames, start, stop)) if start < stop else []
+
+
+# Subscriber side: checks the sequence numbers of a market data SUB socket, fetches the ticks of a gap from the
+# gateway's RetransmitBuffer and counts what could not be recovered. A subscriber joining a stream within its first
+# Config.MarketData.JoinRecoveryTicks ticks (the ZeroMQ "slow joiner" case) also fetches the ticks it missed.
+class SequencedReceiver:
+    def __init__(self, market_socket, context):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._market_socket = market_socket
+        self._context = context
+        self._retransmit_socket = None
+        self._stream_id = None
+        self._expected_seq = None
+
+        self.received = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.recovered = 0
+        self.lost = 0
+
+    @property
+    def stats(self):
+        return {"received": self.received, "duplicates": self.duplicates, "gaps": self.gaps,
+                "recovered": self.recovered, "lost": self.lost}
+
+    # Treats the ticks of stream_id up to seq as received, e.g. the ticks a strategy replayed from the MessageBroker's
+    # cache; those still arriving on the socket are counted as duplicates
+    def skip_until(self, stream_id, seq):
+        if self._stream_id is None:
+            self._stream_id = stream_id
+            self._expected_seq = seq + 1
+        elif stream_id == self._stream_id:
+            self._expected_seq = max(self._expected_seq, seq + 1)
+
+    # Returns (payload, sent_ns) of the next tick and of the missed ticks before it, oldest first.
+    # With flags=zmq.NOBLOCK it raises zmq.Again when no tick is queued, and can return [] for a duplicate.
+    async def recv(self, flags=0):
+        while True:
+            frame = await self._market_socket.recv(flags=flags)
+            ticks = await self._on_frame(frame)
+            if ticks or flags & zmq.NOBLOCK:
+                return ticks
+
+    async def _on_frame(self, frame):
+        stream_id, seq, sent_ns = SEQUENCE_HEADER.unpack_from(frame)
+        payload = frame[SEQUENCE_HEADER.size:]
+
+        if stream_id != self._stream_id:
+            if self._stream_id is not None:
+                self._logger.warning(f"Market data stream restarted, continuing with stream {stream_id}")
+            self._stream_id = stream_id
+            self._expected_seq = 1 if seq <= Config.MarketData.JoinRecoveryTicks + 1 else seq
+
+        if seq < self._expected_seq:
+            self.duplicates += 1
+            return []
+
+        ticks = []
+        if seq > self._expected_seq:
+            self.gaps += 1
+            missing = seq - self._expected_seq
+            ticks = await self._retransmit(self._expected_seq, seq - 1)
+            self.recovered += len(ticks)
+            self.lost += missing - len(ticks)
+            self._logger.warning(f"Market data gap {self._expected_seq}..{seq - 1}: "
+                                 f"recovered {len(ticks)} of {missing} ticks, {self.stats}")
+
+        self._expected_seq = seq + 1
+        self.received += 1
+        ticks.append((payload, sent_ns))
+        return ticks
+
+    async def _retransmit(self, first_seq, last_seq):
+        if self._retransmit_socket is None:
+            self._retransmit_socket = self._context.socket(zmq.DEALER)
+            self._retransmit_socket.connect(Config.MarketData.RetransmitAddr)
+
+        await self._retransmit_socket.send(RETRANSMIT_REQUEST.pack(self._stream_id, first_seq, last_seq))
+        try:
+            frames = await asyncio.wait_for(self._receive_retransmission(), Config.MarketData.RetransmitTimeoutSeconds)
+        except asyncio.TimeoutError:
+            self._logger.warning(f"No retransmission of ticks {first_seq}..{last_seq} "
+                                 f"within {Config.MarketData.RetransmitTimeoutSeconds} seconds")
+            # a late reply must not be taken for the answer to the next request
+            self._retransmit_socket.close(linger=0)
+            self._retransmit_socket = None
+            return []
+
+        ticks = []
+        for frame in frames:
+            stream_id, seq, sent_ns = SEQUENCE_HEADER.unpack_from(frame)
+            if stream_id == self._stream_id and first_seq <= seq <= last_seq:
+                ticks.append((frame[SEQUENCE_HEADER.size:], sent_ns))
+        return ticks
+
+    async def _receive_retransmission(self):
+        frames = []
+        while True:
+            frame = await self._retransmit_socket.recv()
+            if not frame:
+                return frames
+            frames.append(frame)
+
+
+# Hands the ticks of a SequencedReceiver to a consumer in batches. While conflating, the ticks waiting for the
+# consumer are reduced to the latest tick per ticker, so a slow consumer sees the newest price of every ticker
+# instead of a growing backlog; the ticks replaced by a newer one are counted as skipped.
+# A reader task takes the ticks off the socket as they arrive, which is what makes the backlog visible.
+# subscriber names the component in the metrics of the feed.
+class Conflator:
+    def __init__(self, receiver, mode=None, subscriber='Unnamed'):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._receiver = receiver
+        self._subscriber = subscriber
+        self._mode = mode or Config.MarketData.ConflationMode
+        if self._mode not in ("Off", "Always", "Adaptive"):
+            raise ValueError(f"Invalid ConflationMode: {self._mode}")
+
+        self._conflating = self._mode == "Always"
+        self._backlog = deque()  # ticks in arrival order, while not conflating
+        self._latest = {}  # ticker -> latest tick, while conflating
+        self._arrived = 0  # ticks arrived since the last batch
+        self._ready = asyncio.Event()
+        self._reader_task = None
+
+        self.skipped = 0
+        self.switches = 0
+
+        self._ticks_received = Metrics().counter("tradeblaze_ticks_received_total",
+                                                 "Market data ticks received by a subscriber",
+                                                 ("subscriber", "ticker"))
+        Metrics().register_collector(self._collect_metrics)
+
+    @property
+    def stats(self):
+        return {"conflating": self._conflating, "backlog": len(self._backlog) + len(self._latest),
+                "skipped": self.skipped, "conflation_switches": self.switches}
+
+    # Returns the next ticks as (MarketData, sent_ns), up to max_size of them unless conflating (one per ticker then)
+    async def get_batch(self, max_size):
+        if self._mode == "Off":
+            return await self._receive_batch(max_size)
+
+        if self._reader_task is None:
+            self._reader_task = asyncio.create_task(self._read())
+        await self._ready.wait()
+
+        if self._conflating:
+            batch = list(self._latest.values())
+            self._latest.clear()
+            if self._mode == "Adaptive" and self._arrived <= Config.MarketData.ConflationOffBacklog:
+                self._switch(False)
+        else:
+            batch = [self._backlog.popleft() for _ in range(min(max_size, len(self._backlog)))]
+
+        self._arrived = 0
+        if not self._backlog and not self._latest:
+            self._ready.clear()
+        return batch
+
+    # without conflation the consumer reads the socket itself: one tick, then the ticks already queued
+    async def _receive_batch(self, max_size):
+        ticks = await self._receiver.recv()
+        while len(ticks) < max_size:
+            try:
+                ticks.extend(await self._receiver.recv(flags=zmq.NOBLOCK))
+            except zmq.Again:
+                break
+        return [self._decode(payload, sent_ns) for payload, sent_ns in ticks]
+
+    def _decode(self, payload, sent_ns):
+        market_data = Codec.decode(payload)
+        self._ticks_received.labels(self._subscriber, market_data.ticker).inc()
+        return market_data, sent_ns
+
+    async def _read(self):
+        while True:
+            # one tick, then all ticks already queued on the socket, so that the backlog shows here
+            ticks = await self._receiver.recv()
+            while True:
+                try:
+                    ticks.extend(await self._receiver.recv(flags=zmq.NOBLOCK))
+                except zmq.Again:
+                    break
+
+            for payload, sent_ns in ticks:
+                tick = self._decode(payload, sent_ns)
+                if self._conflating:
+                    self._conflate(tick)
+                else:
+                    self._backlog.append(tick)
+            self._arrived += len(ticks)
+
+            if not self._conflating and len(self._backlog) >= Config.MarketData.ConflationOnBacklog:
+                self._switch(True)
+            self._ready.set()
+
+            # let the consumer run before reading the next ticks
+            await asyncio.sleep(0)
+
+    def _conflate(self, tick):
+        # re-inserted, so that the batch is in the order of the latest ticks
+        ticker = tick[0].ticker
+        if self._latest.pop(ticker, None) is not None:
+            self.skipped += 1
+        self._latest[ticker] = tick
+
+    def _switch(self, conflating):
+        self._conflating = conflating
+        self.switches += 1
+        if conflating:
+            backlog = len(self._backlog)
+            while self._backlog:
+                self._conflate(self._backlog.popleft())
+            self._logger.warning(f"Conflation on, consumer is {backlog} ticks behind, {self.stats}")
+        else:
+            self._logger.info(f"Conflation off, consumer caught up, {self.stats}")
+
+    def _collect_metrics(self):
+        receiver = self._receiver
+        subscriber = self._subscriber
+        return [
+            counter_sample("tradeblaze_ticks_duplicate_total", "Market data ticks received twice",
+                           receiver.duplicates, subscriber=subscriber),
+            counter_sample("tradeblaze_ticks_gaps_total", "Gaps in the market data sequence numbers",
+                           receiver.gaps, subscriber=subscriber),
+            counter_sample("tradeblaze_ticks_recovered_total", "Market data ticks of a gap fetched from the gateway",
+                           receiver.recovered, subscriber=subscriber),
+            counter_sample("tradeblaze_ticks_lost_total", "Market data ticks of a gap that could not be recovered",
+                           receiver.lost, subscriber=subscriber),
+            counter_sample("tradeblaze_ticks_conflated_total", "Market data ticks replaced by a newer tick of "
+                           "the same ticker before the subscriber processed them", self.skipped, subscriber=subscriber),
+            gauge_sample("tradeblaze_ticks_backlog", "Market data ticks received but not processed by the subscriber "
+                         "yet", len(self._backlog) + len(self._latest), subscriber=subscriber),
+            gauge_sample("tradeblaze_conflation_active", "1 while the subscriber's ticks are conflated",
+                         self._conflating, subscriber=subscriber)
+        ]
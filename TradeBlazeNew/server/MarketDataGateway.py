@@ -1,103 +1,205 @@
 import asyncio
-import json
+import heapq
 import sys
 import time
-from dataclasses import asdict
 
-import duckdb
 import zmq.asyncio
 
+from Codec import *
+from LatencyMonitor import *
+from MarketDataFeed import *
 from MarketDataSource import *
+from TickArchive import *
+
+
+# Decides when the gateway publishes each tick, relative to the start of the stream.
+# Ticks are scheduled against absolute target times so that sleeping never accumulates drift.
+class ReplayClock:
+    def __init__(self, speed, original_timing, tick_interval_seconds):
+        if speed < 0:
+            raise ValueError(f"Invalid ReplaySpeed: {speed}")
+
+        self._speed = speed
+        self._original_timing = original_timing
+        self._tick_interval_seconds = tick_interval_seconds
+
+        self._start_time = None
+        self._first_timestamp = None
+        self._rounds = -1
+
+    @property
+    def is_as_fast_as_possible(self):
+        return self._speed == 0
+
+    # Seconds to wait before publishing this tick, new_round marks the first ticker of a round-robin round
+    def wait_seconds(self, market_data, new_round):
+        if self._start_time is None:
+            self._start_time = time.perf_counter()
+            self._first_timestamp = market_data.timestamp
+
+        if self.is_as_fast_as_possible:
+            return 0.0
+
+        if self._original_timing:
+            elapsed = (market_data.timestamp - self._first_timestamp) / 1e9 / self._speed
+        elif new_round:
+            self._rounds += 1
+            elapsed = self._rounds * self._tick_interval_seconds / self._speed
+        else:
+            return 0.0
+
+        return self._start_time + elapsed - time.perf_counter()
 
 
 class MarketDataGateway:
-    def __init__(self, market_data_source):
+    def __init__(self, market_data_sources):
         self._logger = logging.getLogger(self.__class__.__name__)
 
-        self._market_data_source = market_data_source
+        # one source per ticker, all multiplexed onto the same PUB socket
+        self._market_data_sources = list(market_data_sources)
 
-        self._data_type = market_data_source.data_type
-        self._ticker = market_data_source.ticker
+        self._data_type = self._market_data_sources[0].data_type
+        self._tickers = [market_data_source.ticker for market_data_source in self._market_data_sources]
+        # a single ticker keeps its own files, a universe of tickers shares one store
+        self._store_name = self._tickers[0] if len(self._tickers) == 1 else MULTI_TICKER_STORE
 
         self._tick_interval_seconds = Config.MarketData.TickIntervalSeconds
+        self._codec = Codec.get_instance()
 
-        db_path = f"data/{self._ticker}_{self._data_type}.duckdb"
-        self._duckdb_conn = duckdb.connect(db_path)
-        self._init_db()
-
-        csv_path = f"data/{self._ticker}_{self._data_type}.csv"
-        self._cvs_file = None
-        self._csv_writer = None
-        self._init_csv(csv_path)
+        # DuckDB and Parquet archive ticks are bulk-written by a background thread, off the publishing path
+        tick_sinks = []
+        if Config.MarketData.EnableDuckDbPersistence:
+            tick_sinks.append(DuckDbTickSink(DuckDbTickSink.get_db_path(self._store_name, self._data_type)))
+        if Config.MarketData.EnableParquetPersistence:
+            tick_sinks.append(ParquetTickSink(f"{Config.Persistence.ArchiveDir}/{self._data_type}"))
+        self._tick_persistence = TickPersistence(tick_sinks) if tick_sinks else None
 
         # ZeroMQ publisher for market data
         ctx = zmq.asyncio.Context()
         self._market_socket = ctx.socket(zmq.PUB)
         self._market_socket.bind(Config.MarketData.ServerAddr)
+        # sequence numbers and retransmission of the market data ticks
+        self._retransmit_buffer = RetransmitBuffer(ctx)
+
+        self._tick_log = HotPathLogger(self._logger)
+        self._publish_latency = LatencyMonitor().histogram("gateway.publish")
+        self._ticks_published = Metrics().counter("tradeblaze_ticks_published_total",
+                                                  "Market data ticks published by the gateway", ("ticker",))
+        Metrics().register_collector(self._collect_metrics)
 
         # ZeroMQ publisher for dashboard data
         self._xpub_socket = ctx.socket(zmq.PUB)
         self._xpub_socket.connect(Config.MessageBroker.XSubSocketAddr)  # Connect to broker XSUB port
 
-    def _init_db(self):
-        self._duckdb_conn.execute("""
-                                  CREATE TABLE IF NOT EXISTS ticks
-                                  (
-                                      Timestamp
-                                      TIMESTAMP,
-                                      Ticker
-                                      TEXT,
-                                      Price
-                                      DOUBLE
-                                  )
-                                  """)
-
-    def _init_csv(self, csv_path):
-        if not os.path.exists(csv_path):
-            self._cvs_file = open(csv_path, mode='w', newline='', buffering=1)
-            self._csv_writer = csv.writer(self._cvs_file)
-            self._csv_writer.writerow(['Timestamp', 'Ticker', 'Price'])
-        else:
-            self._cvs_file = open(csv_path, mode='a', newline='', buffering=1)
-            self._csv_writer = csv.writer(self._cvs_file)
+    def _tick_stream(self):
+        # yields (market_data, new_round) until all sources are exhausted
+        market_data_sources = list(self._market_data_sources)
+
+        if self._merge_by_timestamp():
+            # merge all tickers in timestamp order
+            heap = []
+            for i, market_data_source in enumerate(market_data_sources):
+                market_data = market_data_source.next_price()
+                if market_data is not None:
+                    heapq.heappush(heap, (market_data.timestamp, i, market_data))
+            while heap:
+                _, i, market_data = heapq.heappop(heap)
+                yield market_data, False
+                next_market_data = market_data_sources[i].next_price()
+                if next_market_data is None:
+                    self._logger.info(f"No more market data tick available for {market_data_sources[i].ticker}")
+                else:
+                    heapq.heappush(heap, (next_market_data.timestamp, i, next_market_data))
+            return
+
+        # one tick per ticker per round
+        while market_data_sources:
+            new_round = True
+            for market_data_source in list(market_data_sources):
+                market_data = market_data_source.next_price()
+                if market_data is None:
+                    self._logger.info(f"No more market data tick available for {market_data_source.ticker}")
+                    market_data_sources.remove(market_data_source)
+                    continue
+                yield market_data, new_round
+                new_round = False
+
+    def _collect_metrics(self):
+        if self._tick_persistence is None:
+            return []
+        stats = self._tick_persistence.get_stats()
+        return [
+            gauge_sample("tradeblaze_tick_persistence_backlog", "Ticks waiting for the DuckDB/Parquet writer thread",
+                         stats["backlog"]),
+            counter_sample("tradeblaze_tick_persistence_written_total", "Ticks written to DuckDB/Parquet",
+                           stats["written"]),
+            counter_sample("tradeblaze_tick_persistence_dropped_total", "Ticks not persisted because the writer "
+                           "was too far behind", stats["dropped"])
+        ]
+
+    @staticmethod
+    def _merge_by_timestamp():
+        return Config.MarketData.ReplayOriginalTiming and Config.MarketData.ReplaySpeed != 0
 
     async def stream_prices(self):
-        self._logger.info(f"Running {self._ticker} {self._data_type} stream "
-                          f"for {Config.MarketData.TickStreamDurationSeconds} seconds, "
-                          f"sending one tick every {self._tick_interval_seconds} second ..")
+        replay_clock = ReplayClock(Config.MarketData.ReplaySpeed, Config.MarketData.ReplayOriginalTiming,
+                                   self._tick_interval_seconds)
+        pacing = "as fast as possible" if replay_clock.is_as_fast_as_possible else \
+            f"{Config.MarketData.ReplaySpeed}x original timing" if Config.MarketData.ReplayOriginalTiming else \
+            f"one tick every {self._tick_interval_seconds / Config.MarketData.ReplaySpeed} second"
+        self._logger.info(f"Running {self._tickers} {self._data_type} stream "
+                          f"for {Config.MarketData.TickStreamDurationSeconds} seconds, {pacing} ..")
+
         start_time = time.time()
+        tick_count = 0
+        report_time, report_tick_count = time.perf_counter(), 0
+        retransmit_task = asyncio.create_task(self._retransmit_buffer.serve())
         try:
-            while time.time() - start_time < Config.MarketData.TickStreamDurationSeconds:
-                market_data = self._market_data_source.next_price()
-                if market_data is None:
-                    self._logger.info(f"No more market data tick available")
+            for market_data, new_round in self._tick_stream():
+                if time.time() - start_time >= Config.MarketData.TickStreamDurationSeconds:
                     break
 
-                # Send tick to MQ
-                await self._market_socket.send_string(json.dumps(asdict(market_data)))
-                await self._xpub_socket.send_string("MarketData: " + json.dumps(asdict(market_data)))
-                self._logger.info(f"Sent market data tick {self._ticker}: ${market_data.price:.2f}")
-
-                # Save to DuckDB
-                if Config.MarketData.EnableDuckDbPersistence:
-                    self._duckdb_conn.execute(
-                        "INSERT INTO ticks VALUES (?, ?, ?)",
-                        (market_data.timestamp, self._ticker, market_data.price)
-                    )
-
-                # Log to CSV
-                if Config.MarketData.EnableCsvPersistence:
-                    self._csv_writer.writerow([market_data.timestamp, self._ticker, market_data.price])
-
-                # wait until the configured interval
-                await asyncio.sleep(self._tick_interval_seconds)
-
-            self._logger.info(f"Streaming stopped after {round(time.time() - start_time, 2)} seconds")
+                # wait until the scheduled time of this tick
+                wait_seconds = replay_clock.wait_seconds(market_data, new_round)
+                if wait_seconds > 0:
+                    await asyncio.sleep(wait_seconds)
+                elif tick_count % Config.MarketData.ReplayYieldEveryTicks == 0:
+                    # Unlike await asyncio.sleep(0.01), this yields without a time cost.
+                    await asyncio.sleep(0)
+
+                # Send tick to MQ, encoded once for both sockets
+                sent_ns = monotonic_ns()
+                payload = self._codec.encode(market_data)
+                frame = self._retransmit_buffer.stamp(payload, sent_ns)
+                await self._market_socket.send(frame)
+                # with the sequence header, so that a strategy warming up from the broker's cache knows the stream
+                await self._xpub_socket.send_multipart([Codec.get_topic(market_data), payload,
+                                                        frame[:SEQUENCE_HEADER.size]])
+                self._publish_latency.record(monotonic_ns() - sent_ns)
+                self._ticks_published.labels(market_data.ticker).inc()
+                self._tick_log.info("market_data_sent", ticker=market_data.ticker, price=market_data.price)
+                tick_count += 1
+
+                # Save to DuckDB and the Parquet archive, after the tick is published.
+                # Only the "Block" backpressure policy slows down the stream, "Drop" counts the ticks it drops
+                if self._tick_persistence is not None and not self._tick_persistence.submit(market_data):
+                    self._logger.warning(f"Tick persistence is behind, backlog: {self._tick_persistence.backlog}")
+                    await self._tick_persistence.wait_for_capacity()
+
+                now = time.perf_counter()
+                if now - report_time >= Config.MarketData.ReplayReportIntervalSeconds:
+                    self._logger.info(f"Streaming {(tick_count - report_tick_count) / (now - report_time):.0f} ticks/s")
+                    report_time, report_tick_count = now, tick_count
+
+            elapsed_seconds = time.time() - start_time
+            self._logger.info(f"Streaming stopped after {round(elapsed_seconds, 2)} seconds, {tick_count} ticks sent, "
+                              f"{tick_count / elapsed_seconds if elapsed_seconds else 0:.0f} ticks/s")
         except KeyboardInterrupt:
             self._logger.info(f"Streaming stopped due to keyboard interrupt")
         finally:
-            self._duckdb_conn.close()
-            self._cvs_file.close()
+            retransmit_task.cancel()
+            if self._tick_persistence is not None:
+                await asyncio.to_thread(self._tick_persistence.close)
 
 
 # Example usage
@@ -109,8 +211,8 @@ async def main():
         logger.info('MarketDataGateway ServerMode not configured.')
         return
     else:
-        market_data_source = MarketDataSource.get_instance()
-        market_data_gateway = MarketDataGateway(market_data_source)
+        market_data_sources = MarketDataSource.get_instances()
+        market_data_gateway = MarketDataGateway(market_data_sources)
         await asyncio.gather(
             market_data_gateway.stream_prices()
         )
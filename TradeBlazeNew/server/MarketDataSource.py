@@ -1,12 +1,12 @@
-import csv
 import logging
-from datetime import datetime
 
 import numpy as np
 
 import Config
 from DataModels import *
 from LoggingConfig import *
+from PathGenerator import *
+from TickArchive import *
 
 
 class MarketDataSource:
@@ -28,65 +28,186 @@ class MarketDataSource:
         raise NotImplementedError("Subclasses must implement next_price")
 
     @staticmethod
-    def get_instance(ticker="SPY"):
-        if Config.MarketData.Source == "SimulatedDataSource":
+    def get_instance(ticker="SPY", source=None):
+        source = source or Config.MarketData.Source
+        if source == "SimulatedDataSource":
             return SimulatedDataSource(ticker)
-        elif Config.MarketData.Source == "HistoricalDataSource":
+        elif source == "HistoricalDataSource":
             return HistoricalDataSource(ticker)
-        elif Config.MarketData.Source == "IBKRDataSource":
+        elif source == "IBKRDataSource":
             return IBKRDataSource(ticker)
         else:
-            raise ValueError(f"Invalid MarketDataSource: {Config.MarketData.Source}")
-
+            raise ValueError(f"Invalid MarketDataSource: {source}")
 
+    @staticmethod
+    def get_instances(tickers=None, source=None):
+        tickers = Config.MarketData.Tickers if tickers is None else tickers
+        source = source or Config.MarketData.Source
+        if source == "SimulatedDataSource":
+            # one generator for the whole universe, so that the simulated tickers are correlated
+            path_generator = GbmPathGenerator.from_config(tickers)
+            return [SimulatedDataSource(ticker, path_generator=path_generator) for ticker in tickers]
+        return [MarketDataSource.get_instance(ticker, source) for ticker in tickers]
+
+
+# Hands out ticks of this ticker's column of the pre-generated GBM blocks, see PathGenerator.
+# Tickers sharing a path_generator are simulated together with the configured correlation.
 class SimulatedDataSource(MarketDataSource):
-    def __init__(self, ticker="SPY", start_price=500.0, mu=0.0001, sigma=0.01, seed=42):
+    def __init__(self, ticker="SPY", path_generator=None):
         super().__init__(data_type="SimulatedData", ticker=ticker)
-        self._price = start_price
-        self._mu = mu
-        self._sigma = sigma
 
-        if seed is not None:
-            np.random.seed(seed)
-            self._logger.info(f"Using random number seed: {seed}")
+        self._path_generator = path_generator or GbmPathGenerator.from_config([ticker])
+        self._column = self._path_generator.tickers.index(ticker)
+
+        # current block, as a Python list so that next_price() doesn't box NumPy scalars
+        self._block_index = -1
+        self._prices = []
+        self._index = 0
+
+        # bulk ticks are timestamped one tick interval apart from the start of the simulation
+        self._start_timestamp = now_ns()
+        self._tick_interval_ns = int(Config.MarketData.TickIntervalSeconds * 1e9)
+
+    def _next_block(self):
+        block = self._path_generator.block(self._block_index + 1)
+        if self._block_index >= 0:
+            self._path_generator.release(self._block_index)
+        self._block_index += 1
+        return block[:, self._column]
+
+    # Bulk access: the remaining (timestamps, prices) arrays of the current block, or the next block
+    def next_chunk(self):
+        if self._index < len(self._prices):
+            prices = np.array(self._prices[self._index:], dtype='float64')
+        else:
+            prices = self._next_block().copy()
+        self._prices, self._index = [], 0
+
+        first_step = (self._block_index + 1) * self._path_generator.block_size - len(prices)
+        timestamps = self._start_timestamp + (first_step + np.arange(len(prices), dtype='int64')) * self._tick_interval_ns
+        return timestamps, prices
 
     def next_price(self):
-        dt = 1.0
-        z = np.random.normal()
-        drift = (self._mu - 0.5 * self._sigma ** 2) * dt
-        diffusion = self._sigma * np.sqrt(dt) * z
-        self._price *= np.exp(drift + diffusion)
-        self._price = round(self._price, 2)
+        if self._index == len(self._prices):
+            self._prices = self._next_block().tolist()
+            self._index = 0
 
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        return MarketData(timestamp=timestamp, ticker=self._ticker, price=self._price)
+        price = self._prices[self._index]
+        self._index += 1
+        return MarketData(timestamp=now_ns(), ticker=self._ticker, price=price)
 
 
+# Replays recorded ticks, loaded in large columnar chunks instead of one csv row at a time.
+# Formats (Config.MarketData.HistoricalDataFormat):
+#   "Csv"     - data/{ticker}_HistoricalDataRepo.csv with Timestamp,Ticker,Price columns
+#   "DuckDb"  - the `ticks` table of data/{ticker}_HistoricalData.duckdb, or of data/MultiTicker_HistoricalData.duckdb,
+#               as written by the gateway's DuckDbTickSink while it replays the Csv history
+#   "Parquet" - the tick archive under Persistence.ArchiveDir/HistoricalData, as written by ParquetTickSink
 class HistoricalDataSource(MarketDataSource):
-    def __init__(self, ticker="SPY"):
+    def __init__(self, ticker="SPY", data_format=None, chunk_size=None):
         super().__init__(data_type="HistoricalData", ticker=ticker)
 
-        csv_path = f"data/{self._ticker}_{self._data_type}Repo.csv"
-        if not os.path.exists(csv_path):
-            msg = f"File {csv_path} does not exist"
-            self._logger.error(f"File {csv_path} does not exist")
-            raise RuntimeError(msg)
+        self._data_format = data_format or Config.MarketData.HistoricalDataFormat
+        self._chunk_size = chunk_size or Config.MarketData.HistoricalChunkSize
 
-        self._cvs_file = open(csv_path, newline='')
-        self._csv_reader = csv.reader(self._cvs_file)
-        row = next(self._csv_reader)  # Skip header: Timestamp,Ticker,Price
-        if len(row) < 3:
-            raise ValueError(f"Invalid row: {row}")
-
-    def next_price(self):
+        if self._data_format == "Csv":
+            self._chunks = self._load_csv_chunks(self._get_repo_path("csv"))
+        elif self._data_format == "DuckDb":
+            self._chunks = self._load_duckdb_chunks(self._get_duckdb_path())
+        elif self._data_format == "Parquet":
+            # import a csv repo file first with: python TickArchive.py data/SPY_HistoricalDataRepo.csv
+            self._chunks = self._load_parquet_chunks(TickArchive(f"{Config.Persistence.ArchiveDir}/{self._data_type}"))
+        else:
+            raise ValueError(f"Invalid HistoricalDataFormat: {self._data_format}")
+
+        # current chunk, as Python lists so that next_price() doesn't box NumPy scalars
+        self._timestamps = []
+        self._prices = []
+        self._index = 0
+
+    def _get_repo_path(self, extension):
+        path = f"data/{self._ticker}_{self._data_type}Repo.{extension}"
+        if not os.path.exists(path):
+            msg = f"File {path} does not exist"
+            self._logger.error(msg)
+            raise RuntimeError(msg)
+        return path
+
+    # the ticker's own file, else the file of a multi-ticker replay
+    def _get_duckdb_path(self):
+        paths = [DuckDbTickSink.get_db_path(self._ticker, self._data_type),
+                 DuckDbTickSink.get_db_path(MULTI_TICKER_STORE, self._data_type)]
+        for path in paths:
+            if os.path.exists(path):
+                return path
+        msg = f"None of the files {paths} exists, replay the Csv history with EnableDuckDbPersistence first"
+        self._logger.error(msg)
+        raise RuntimeError(msg)
+
+    def _load_csv_chunks(self, csv_path):
+        for chunk in pd.read_csv(csv_path, chunksize=self._chunk_size):
+            if len(chunk.columns) < 3:
+                raise ValueError(f"Invalid columns: {list(chunk.columns)}")
+            timestamps = pd.to_datetime(chunk['Timestamp'], format=TIMESTAMP_FORMAT).to_numpy(dtype='datetime64[ns]')
+            yield TickSink.from_local_datetime(timestamps), chunk['Price'].to_numpy(dtype='float64')
+
+    def _load_duckdb_chunks(self, db_path):
+        conn = duckdb.connect(db_path, read_only=True)
         try:
-            row = next(self._csv_reader)
-            timestamp, ticker, price = row
-            return MarketData(timestamp=timestamp, ticker=ticker, price=float(price))
-        except StopIteration:
-            self._logger.warning(f"File {self._cvs_file.name} exhausted")
+            reader = conn.execute("SELECT Timestamp, Price FROM ticks WHERE Ticker = ? ORDER BY Timestamp",
+                                  [self._ticker]).fetch_record_batch(self._chunk_size)
+            for batch in reader:
+                timestamps = batch.column('Timestamp').cast('timestamp[ns]').to_numpy()
+                yield TickSink.from_local_datetime(timestamps), batch.column('Price').to_numpy()
+        finally:
+            conn.close()
+
+    # The archive returns the ticks of a ticker in time order (see TickArchive.iter_batches). Ticks out of order are
+    # sorted within a chunk; a chunk starting before the end of the previous one can't be replayed in order, so it
+    # fails instead of handing the ReplayClock and the strategies a series that goes back in time.
+    def _load_parquet_chunks(self, archive):
+        last_timestamp = None
+        for batch in archive.iter_batches(tickers=[self._ticker], columns=['timestamp', 'price'],
+                                          batch_size=self._chunk_size):
+            timestamps = batch.column('timestamp').cast('int64').to_numpy()
+            prices = batch.column('price').to_numpy()
+            if len(timestamps) == 0:
+                continue
+
+            if np.any(timestamps[1:] < timestamps[:-1]):
+                self._logger.warning(f"Parquet history of {self._ticker} is out of time order, sorting the chunk")
+                order = np.argsort(timestamps, kind='stable')
+                timestamps, prices = timestamps[order], prices[order]
+            if last_timestamp is not None and timestamps[0] < last_timestamp:
+                raise RuntimeError(f"Parquet history of {self._ticker} goes back in time, from "
+                                   f"{format_timestamp(int(last_timestamp))} to {format_timestamp(int(timestamps[0]))}")
+            last_timestamp = timestamps[-1]
+            yield timestamps, prices
+
+    # Bulk access: the remaining (timestamps, prices) arrays of the current chunk, or the next chunk
+    def next_chunk(self):
+        if self._index < len(self._timestamps):
+            chunk = (np.array(self._timestamps[self._index:], dtype='int64'),
+                     np.array(self._prices[self._index:], dtype='float64'))
+            self._timestamps, self._prices, self._index = [], [], 0
+            return chunk
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._logger.warning(f"{self._data_format} history of {self._ticker} exhausted")
+        return chunk
 
-        return None
+    def next_price(self):
+        if self._index == len(self._timestamps):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._logger.warning(f"{self._data_format} history of {self._ticker} exhausted")
+                return None
+            self._timestamps, self._prices = chunk[0].tolist(), chunk[1].tolist()
+            self._index = 0
+
+        i = self._index
+        self._index += 1
+        return MarketData(timestamp=self._timestamps[i], ticker=self._ticker, price=self._prices[i])
 
 
 class IBKRDataSource(MarketDataSource):
@@ -1,12 +1,33 @@
+import itertools
+from collections import deque
+
 import zmq.asyncio
 
 from MarketDataSource import *
+from Metrics import *
 
 
+# Forwards the dashboard messages from the publishers (XSUB) to the subscribers (XPUB), and keeps the recent
+# messages of every topic frame, i.e. per message type and ticker (see Codec.get_topic), the last one being the
+# last value. A subscriber that connects late asks the ROUTER snapshot socket for them (see SnapshotClient),
+# so it starts from the current state instead of waiting for the next message:
+#   request:  [topic prefix, depth]  (depth = most recent messages per topic, b"0" = all that are kept)
+#   reply:    [topic, payload, ...] per message in the order they were forwarded, then [b"", message count]
+# A message can have more frames than topic and payload, e.g. the sequence header of a market data tick.
 class MessageBroker:
     def __init__(self):
         self._logger = logging.getLogger(self.__class__.__name__)
 
+        self._history_size = Config.MessageBroker.HistorySize
+        self._history = {}  # topic -> deque of (message number, frames after the topic)
+        self._message_count = 0
+
+        self._messages_forwarded = Metrics().counter("tradeblaze_broker_messages_total",
+                                                     "Dashboard messages forwarded by the MessageBroker").labels()
+        self._snapshots_sent = Metrics().counter("tradeblaze_broker_snapshots_total",
+                                                 "Snapshots sent by the MessageBroker").labels()
+        Metrics().register_collector(self._collect_metrics)
+
         # ZeroMQ sockets
         context = zmq.asyncio.Context()
         self._xsub_socket = context.socket(zmq.XSUB)
@@ -15,17 +36,60 @@ class MessageBroker:
         self._xpub_socket = context.socket(zmq.XPUB)
         self._xpub_socket.bind(Config.MessageBroker.XPubSocketAddr)  # SUBs connect here
 
+        self._snapshot_socket = context.socket(zmq.ROUTER)
+        self._snapshot_socket.bind(Config.MessageBroker.SnapshotSocketAddr)  # SnapshotClients connect here
+
     async def run(self):
 
         poller = zmq.asyncio.Poller()
         poller.register(self._xsub_socket, zmq.POLLIN)
         poller.register(self._xpub_socket, zmq.POLLIN)
+        poller.register(self._snapshot_socket, zmq.POLLIN)
 
         while True:
             events = dict(await poller.poll())
             if self._xsub_socket in events:
                 msg = await self._xsub_socket.recv_multipart()
+                self._cache(msg)
                 await self._xpub_socket.send_multipart(msg)
+                self._messages_forwarded.inc()
             if self._xpub_socket in events:
                 msg = await self._xpub_socket.recv_multipart()
                 await self._xsub_socket.send_multipart(msg)
+            if self._snapshot_socket in events:
+                await self._send_snapshot(await self._snapshot_socket.recv_multipart())
+
+    def _cache(self, msg):
+        if len(msg) < 2:
+            return
+        topic, *frames = msg
+        history = self._history.get(topic)
+        if history is None:
+            history = self._history[topic] = deque(maxlen=self._history_size)
+        self._message_count += 1
+        history.append((self._message_count, frames))
+
+    def _collect_metrics(self):
+        return [gauge_sample("tradeblaze_broker_cached_topics", "Topic frames in the MessageBroker's last value cache",
+                             len(self._history))]
+
+    def get_snapshot(self, prefix=b"", depth=0):
+        entries = []
+        for topic, history in self._history.items():
+            if topic.startswith(prefix):
+                start = max(0, len(history) - depth) if depth else 0
+                entries.extend((number, topic, frames) for number, frames in itertools.islice(history, start, None))
+        entries.sort(key=lambda entry: entry[0])
+        return [(topic, *frames) for _, topic, frames in entries]
+
+    async def _send_snapshot(self, request):
+        if len(request) != 3 or not request[2].isdigit():
+            self._logger.warning(f"Invalid snapshot request: {request}")
+            return
+        identity, prefix, depth = request
+        snapshot = self.get_snapshot(prefix, int(depth))
+        self._snapshots_sent.inc()
+        self._logger.info(f"Sending snapshot of {len(snapshot)} messages for topic prefix: {prefix}")
+        for message in snapshot:
+            await self._snapshot_socket.send_multipart([identity, *message])
+        await self._snapshot_socket.send_multipart([identity, b"", str(len(snapshot)).encode()])
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+from collections import namedtuple
+
+import Config
+from Decorator import *
+from LatencyMonitor import *
+
+# One line of the Prometheus text format: name{labels} value, labels being a tuple of (label name, value) pairs.
+# family/type/help are those of the metric the line belongs to, e.g. name = family + "_count" of a summary
+MetricSample = namedtuple('MetricSample', 'family type help name labels value')
+
+# Quantiles of the summaries, see LatencyHistogram
+SUMMARY_QUANTILES = (0.5, 0.99, 0.999)
+
+
+def counter_sample(name, help_text, value, **labels):
+    return MetricSample(name, 'counter', help_text, name, tuple(labels.items()), value)
+
+
+def gauge_sample(name, help_text, value, **labels):
+    return MetricSample(name, 'gauge', help_text, name, tuple(labels.items()), value)
+
+
+# The nanosecond values of a LatencyHistogram as a summary in seconds
+def summary_samples(name, help_text, histogram, labels=()):
+    samples = [MetricSample(name, 'summary', help_text, name, labels + (("quantile", str(quantile)),),
+                            histogram.percentile(quantile * 100) / 1e9) for quantile in SUMMARY_QUANTILES]
+    samples.append(MetricSample(name, 'summary', help_text, f"{name}_sum", labels, histogram.total / 1e9))
+    samples.append(MetricSample(name, 'summary', help_text, f"{name}_count", labels, histogram.count))
+    return samples
+
+
+class MetricCounter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class MetricGauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+# A metric and its time series, one per combination of label values
+class MetricFamily:
+    def __init__(self, name, type_name, help_text, label_names, new_child):
+        self.name = name
+        self.type = type_name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._new_child = new_child
+        self._children = {}  # label values -> MetricCounter, MetricGauge or LatencyHistogram
+
+    def labels(self, *label_values):
+        child = self._children.get(label_values)
+        if child is None:
+            if len(label_values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {label_values}")
+            child = self._children[label_values] = self._new_child()
+        return child
+
+    def get_samples(self):
+        samples = []
+        for label_values, child in self._children.items():
+            labels = tuple(zip(self.label_names, label_values))
+            if self.type == 'summary':
+                samples.extend(summary_samples(self.name, self.help, child, labels))
+            else:
+                samples.append(MetricSample(self.name, self.type, self.help, self.name, labels, child.value))
+        return samples
+
+
+# The metrics of this process in the Prometheus text exposition format, served at /metrics.
+# Hot paths count into their own MetricCounter, a plain int increment: every metric is only ever written by the
+# thread of the component that owns it and only read by a scrape, so nothing needs a lock. Stats the components
+# keep anyway (feed loss, backlogs, client counts) are read by collectors at scrape time only, at no cost
+# in between. In multi-process mode every component process pushes its samples to the PipelineSupervisor,
+# which adds them to the metrics of the server process with a process label.
+@singleton
+class Metrics:
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._families = {}  # name -> MetricFamily
+        self._collectors = []  # callables returning a list of MetricSample
+        self._process_samples = {}  # component process name -> its last pushed samples
+
+        self.register_collector(self._collect_stage_latencies)
+
+    def counter(self, name, help_text, label_names=()):
+        return self._get_family(name, 'counter', help_text, label_names, MetricCounter)
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._get_family(name, 'gauge', help_text, label_names, MetricGauge)
+
+    # nanosecond latencies, exposed in seconds
+    def summary(self, name, help_text, label_names=()):
+        return self._get_family(name, 'summary', help_text, label_names, LatencyHistogram)
+
+    def _get_family(self, name, type_name, help_text, label_names, new_child):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = MetricFamily(name, type_name, help_text, label_names, new_child)
+        elif family.type != type_name or family.label_names != tuple(label_names):
+            raise ValueError(f"Metric {name} is already registered as {family.type} with labels {family.label_names}")
+        return family
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def collect(self):
+        samples = []
+        for family in self._families.values():
+            samples.extend(family.get_samples())
+        for collector in self._collectors:
+            samples.extend(collector())
+        return samples
+
+    def set_process_samples(self, process_name, samples):
+        self._process_samples[process_name] = samples
+
+    def render(self):
+        samples = self.collect()
+        for process_name, process_samples in self._process_samples.items():
+            samples.extend(sample._replace(labels=(("process", process_name),) + sample.labels)
+                           for sample in process_samples)
+
+        # all lines of a metric must follow its HELP and TYPE lines
+        families = {}
+        for sample in samples:
+            families.setdefault(sample.family, []).append(sample)
+
+        lines = []
+        for family, family_samples in families.items():
+            lines.append(f"# HELP {family} {family_samples[0].help}")
+            lines.append(f"# TYPE {family} {family_samples[0].type}")
+            for sample in family_samples:
+                lines.append(f"{sample.name}{self._format_labels(sample.labels)} {self._format_value(sample.value)}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+    @staticmethod
+    def _format_value(value):
+        if isinstance(value, bool):
+            return "1" if value else "0"
+        if isinstance(value, int):
+            return str(value)
+        return repr(float(value)).replace("inf", "Inf")
+
+    @staticmethod
+    def _collect_stage_latencies():
+        samples = []
+        for stage, histogram in LatencyMonitor().histograms.items():
+            samples.extend(summary_samples("tradeblaze_stage_latency_seconds",
+                                           "Latency of the pipeline stages, see LatencyMonitor",
+                                           histogram, (("stage", stage),)))
+        return samples
+
+    # How late the event loop of this process wakes up a sleeping coroutine, i.e. how long other callbacks hold it
+    async def monitor_event_loop_lag(self):
+        lag = self.summary("tradeblaze_event_loop_lag_seconds",
+                           "Delay of the event loop in waking up a sleeping coroutine").labels()
+        interval_ns = int(Config.Metrics.EventLoopLagIntervalSeconds * 1e9)
+        while True:
+            start_ns = monotonic_ns()
+            await asyncio.sleep(Config.Metrics.EventLoopLagIntervalSeconds)
+            lag.record(monotonic_ns() - start_ns - interval_ns)
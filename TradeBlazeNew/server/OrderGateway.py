@@ -1,26 +1,42 @@
 from DbUtils import *
+from LatencyMonitor import *
+from Metrics import *
 from SimulatedBroker import *
 
 
 class OrderGateway:
-    def __init__(self, on_trade_data):
+    def __init__(self, on_trade_data, broker=None, trade_counter=None):
         self._logger = logging.getLogger(self.__class__.__name__)
 
-        self._simulated_broker = SimulatedBroker()
+        self._simulated_broker = broker or SimulatedBroker()
         self._on_trade_data = on_trade_data
 
-        self._trade_counter = WALCounter("TRADE_SEQ")
+        self._trade_counter = trade_counter or WALCounter("TRADE_SEQ")
 
         self._orders = []
+        self._tick_sent_times = {}  # order_id -> when the gateway sent the tick the order was placed on
 
-    async def on_order_data(self, order_data: OrderData):
+        self._on_order_latency = LatencyMonitor().histogram("order_gateway.on_order")
+        self._tick_to_fill_latency = LatencyMonitor().histogram("tick_to_fill")
+        self._fills = Metrics().counter("tradeblaze_fills_total", "Orders filled by the broker", ("ticker", "side"))
+
+    async def on_order_data(self, order_data: OrderData, tick_sent_ns=None):
+        start_ns = monotonic_ns()
         self._logger.info(f'Received order data: {order_data}')
         self._orders.append(order_data)
 
+        if tick_sent_ns is not None:
+            self._tick_sent_times[order_data.order_id] = tick_sent_ns
         await self._simulated_broker.place_order(order_data, self._on_order_execution)
+        self._on_order_latency.record(monotonic_ns() - start_ns)
 
     async def _on_order_execution(self, order_data):
-        trade_id = self._trade_counter.next()
+        self._fills.labels(order_data.ticker, order_data.side).inc()
+        tick_sent_ns = self._tick_sent_times.pop(order_data.order_id, None)
+        if tick_sent_ns is not None:
+            self._tick_to_fill_latency.record(monotonic_ns() - tick_sent_ns)
+
+        trade_id = await self._trade_counter.next_async()
         trade_data = TradeData(timestamp=order_data.timestamp, trade_id=trade_id,
                                order_id=order_data.order_id, ticker=order_data.ticker,
                                units=order_data.qty, unit_price=order_data.filled_price,
@@ -1,18 +1,22 @@
 import asyncio
-from dataclasses import asdict
 
 import zmq.asyncio
 
 from Analytics import *
+from Codec import *
+from LoggingConfig import *
 from OrderGateway import *
 
 
 class OrderManager:
-    def __init__(self):
+    # broker and counters default to the live SimulatedBroker and the persistent WALCounters,
+    # a backtest passes in its own and disables messaging
+    def __init__(self, broker=None, order_counter=None, trade_counter=None, enable_messaging=True):
         self._logger = logging.getLogger(self.__class__.__name__)
 
-        self._order_gateway = OrderGateway(self._on_trade_data)
-        self._order_counter = WALCounter("ORDER_SEQ")
+        self._order_gateway = OrderGateway(self._on_trade_data, broker, trade_counter)
+        self._order_counter = order_counter or WALCounter("ORDER_SEQ")
+        self._codec = Codec.get_instance()
 
         self._signals = []
         self._trades = []
@@ -21,6 +25,29 @@ class OrderManager:
         self._lot_size = 1
         self._position_limit = 1
 
+        # Sharpe, VaR, drawdown etc. updated in O(1) per fill
+        self._analytics = StreamingAnalytics(portfolio_value=10000, confidence_level=0.95)
+
+        self._queue_latency = LatencyMonitor().histogram("order_manager.queue")
+        self._tick_log = HotPathLogger(self._logger)
+        self._on_signal_latency = LatencyMonitor().histogram("order_manager.on_signal")
+        self._orders_placed = Metrics().counter("tradeblaze_orders_total", "Orders placed by the OrderManager",
+                                                ("ticker", "side"))
+
+        self._signal_socket = None
+        self._xpub_socket = None
+        if enable_messaging:
+            self._connect()
+
+    @property
+    def trades(self):
+        return self._trades
+
+    @property
+    def positions(self):
+        return self._positions
+
+    def _connect(self):
         # ZeroMQ subscriber for signal data
         ctx = zmq.asyncio.Context()
         self._signal_socket = ctx.socket(zmq.PULL)
@@ -32,38 +59,56 @@ class OrderManager:
 
     async def on_signal_data(self):
         while True:
-            msg = await self._signal_socket.recv_string()
-            signal_data = SignalData(**json.loads(msg))
-            self._logger.info(f'Received signal data: {signal_data}')
-            self._signals.append(signal_data)
-
-            if signal_data.ticker not in self._positions:
-                position_data = PositionData(timestamp=signal_data.timestamp, ticker=signal_data.ticker,
-                                             units=0, avg_unit_price=0, realized_pnl=0, unrealized_pnl=0)
-                # In preparation that there may be a deal later
-                self._positions[signal_data.ticker] = position_data
-            position_data = self._positions[signal_data.ticker]
-
-            # update the pnl stats in position_data
-            position_data.unrealized_pnl = (signal_data.price - position_data.avg_unit_price) * position_data.units
-            position_data.unrealized_pnl = round(position_data.unrealized_pnl, 2)
-            position_data.timestamp = signal_data.timestamp
-            self._logger.info(f'Positions in portfolio: {self._positions}')
-
-            # send to dashboard
-            await self._xpub_socket.send_string("PositionData: " + json.dumps(asdict(position_data)))
-
-            if self._can_place_order(signal_data, position_data):
-                order_id = self._order_counter.next()
-                order_data = OrderData(timestamp=signal_data.timestamp, order_id=order_id,
-                                       ticker=signal_data.ticker,
-                                       side=signal_data.action, qty=self._lot_size)
-                await self._order_gateway.on_order_data(order_data)
-                await self._xpub_socket.send_string("OrderData: " + json.dumps(asdict(order_data)))
+            payload, signal_times = await self._signal_socket.recv_multipart()
+            tick_sent_ns, signal_sent_ns = SIGNAL_TIMES.unpack(signal_times)
+            self._queue_latency.record(monotonic_ns() - signal_sent_ns)
+            await self.on_signal(Codec.decode(payload), tick_sent_ns)
 
             # Because this is `while True` loop, so need to prevent starvation!
             await asyncio.sleep(0)
 
+    # tick_sent_ns: when the gateway sent the tick of this signal, None offline
+    async def on_signal(self, signal_data, tick_sent_ns=None):
+        start_ns = monotonic_ns()
+        self._tick_log.info("signal_received", ticker=signal_data.ticker, action=signal_data.action,
+                            price=signal_data.price)
+        self._signals.append(signal_data)
+
+        if signal_data.ticker not in self._positions:
+            position_data = PositionData(timestamp=signal_data.timestamp, ticker=signal_data.ticker,
+                                         units=0, avg_unit_price=0, realized_pnl=0, unrealized_pnl=0)
+            # In preparation that there may be a deal later
+            self._positions[signal_data.ticker] = position_data
+        position_data = self._positions[signal_data.ticker]
+
+        # update the pnl stats in position_data
+        position_data.unrealized_pnl = (signal_data.price - position_data.avg_unit_price) * position_data.units
+        position_data.unrealized_pnl = round(position_data.unrealized_pnl, 2)
+        position_data.timestamp = signal_data.timestamp
+        self._tick_log.info("position", ticker=position_data.ticker, units=position_data.units,
+                            avg_unit_price=position_data.avg_unit_price, realized_pnl=position_data.realized_pnl,
+                            unrealized_pnl=position_data.unrealized_pnl)
+
+        # send to dashboard
+        await self._publish(position_data)
+
+        if self._can_place_order(signal_data, position_data):
+            order_id = await self._order_counter.next_async()
+            order_data = OrderData(timestamp=signal_data.timestamp, order_id=order_id,
+                                   ticker=signal_data.ticker,
+                                   side=signal_data.action, qty=self._lot_size)
+            self._orders_placed.labels(order_data.ticker, order_data.side).inc()
+            await self._order_gateway.on_order_data(order_data, tick_sent_ns)
+            await self._publish(order_data)
+
+        self._on_signal_latency.record(monotonic_ns() - start_ns)
+
+    # send to dashboard, through the MessageBroker
+    async def _publish(self, message):
+        if self._xpub_socket is None:
+            return
+        await self._xpub_socket.send_multipart([Codec.get_topic(message), self._codec.encode(message)])
+
     # is it fine to place an order?
     def _can_place_order(self, signal_data, position_data):
         insufficient_inventory = False
@@ -86,7 +131,7 @@ class OrderManager:
         self._logger.info(f'Trade count in portfolio: {len(self._trades)}')
 
         # send to dashboard
-        await self._xpub_socket.send_string("TradeData: " + json.dumps(asdict(trade_data)))
+        await self._publish(trade_data)
 
         # update current position and stats
         position_data = self._positions[trade_data.ticker]
@@ -108,24 +153,26 @@ class OrderManager:
         self._logger.info(f'Positions in portfolio: {self._positions}')
 
         # send to dashboard
-        await self._xpub_socket.send_string("PositionData: " + json.dumps(asdict(position_data)))
+        await self._publish(position_data)
+
+        analytics_data = self._analytics.on_trade(trade_data)
+        self._logger.info(f'Sharpe Ratio: {analytics_data.sharpe_ratio:.2f}, '
+                          f'1-Day VaR: ${analytics_data.var_value:.2f}\n')
 
-        returns = self.compute_returns()
-        sharpe = Analytics.sharpe_ratio(returns)
-        daily_var = Analytics.historical_var(returns, portfolio_value=10000, confidence_level=0.95)
-        self._logger.info(f'Sharpe Ratio: {sharpe:.2f}, 1-Day VaR: ${daily_var:.2f}\n')
+        # send to dashboard
+        await self._publish(analytics_data)
 
     def compute_returns(self):
         returns = []
-        position = None  # store (buy_price, timestamp)
+        positions = {}  # ticker -> buy price, the trades of the tickers are interleaved
 
         for trade_data in self._trades:
             price = float(trade_data.unit_price)
             if trade_data.direction == 'LONG':
-                position = price
-            elif trade_data.direction == 'SHORT' and position is not None:
+                positions[trade_data.ticker] = price
+            elif trade_data.direction == 'SHORT' and trade_data.ticker in positions:
+                position = positions.pop(trade_data.ticker)  # close position
                 ret = (price - position) / position
                 returns.append(ret)
-                position = None  # close position
 
         return returns
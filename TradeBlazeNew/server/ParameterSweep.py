@@ -0,0 +1,202 @@
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from Analytics import *
+from MarketDataSource import *
+
+
+# Vectorized signal series of each strategy over a whole price array: +1 = BUY, -1 = SELL, 0 = HOLD or warming up.
+# They follow the same rules as the live strategies, but evaluate the full history in a few NumPy/pandas calls.
+def macd_signals(prices, short_window=12, long_window=26, signal_window=9):
+    # same EMAs and 2 decimal rounding as StreamingMACD, pandas only differs in the last bits of the EMAs,
+    # which can flip a value sitting exactly on a rounding boundary
+    series = pd.Series(prices, copy=False)
+    macd = (series.ewm(span=short_window, adjust=False).mean()
+            - series.ewm(span=long_window, adjust=False).mean()).round(2).to_numpy()
+    signal = pd.Series(macd, copy=False).ewm(span=signal_window, adjust=False).mean().round(2).to_numpy()
+    return _crossover_signals(macd, signal, long_window)
+
+
+def ma_crossover_signals(prices, short_window=20, long_window=50):
+    return _crossover_signals(_rolling_mean(prices, short_window), _rolling_mean(prices, long_window), long_window)
+
+
+def bollinger_bands_signals(prices, window=20, num_std=2.0):
+    rolling = pd.Series(prices, copy=False).rolling(window)
+    ma = rolling.mean().to_numpy()
+    band = num_std * rolling.std().to_numpy()
+    signals = np.where(prices > ma + band, -1, np.where(prices < ma - band, 1, 0))
+    signals[:window - 1] = 0
+    return signals
+
+
+def _rolling_mean(prices, window):
+    # no full window yet
+    if len(prices) < window:
+        return np.full(len(prices), np.nan)
+    sums = np.cumsum(prices)
+    means = np.empty(len(prices))
+    means[:window - 1] = np.nan
+    means[window - 1] = sums[window - 1] / window
+    means[window:] = (sums[window:] - sums[:-window]) / window
+    return means
+
+
+def _crossover_signals(fast, slow, warm_up):
+    if len(fast) == 0:
+        return np.zeros(0, dtype='int64')
+    prev_fast = np.concatenate(([fast[0]], fast[:-1]))
+    prev_slow = np.concatenate(([slow[0]], slow[:-1]))
+    buy = (fast > slow) & (prev_fast <= prev_slow)
+    sell = (fast < slow) & (prev_fast >= prev_slow)
+    signals = np.where(buy, 1, np.where(sell, -1, 0))
+    signals[:warm_up - 1] = 0
+    return signals
+
+
+# strategy name -> (signal function, rule rejecting invalid parameter combinations)
+STRATEGIES = {
+    'MACDStrategy': (macd_signals, lambda params: params['short_window'] < params['long_window']),
+    'MACrossoverStrategy': (ma_crossover_signals, lambda params: params['short_window'] < params['long_window']),
+    'BollingerBandsStrategy': (bollinger_bands_signals, lambda params: True),
+}
+
+
+# Metrics of trading the signals like OrderManager does with lot size 1 and position limit 1:
+# a BUY opens a position when flat, a SELL closes it when long, every other signal is ignored,
+# so after each tick we are long exactly when the last BUY/SELL signal so far was a BUY.
+def evaluate_signals(prices, signals, initial_capital):
+    last_signal = np.maximum.accumulate(np.where(signals != 0, np.arange(len(signals)), 0))
+    position = (signals[last_signal] == 1).astype('float64')
+
+    pnl = np.zeros(len(prices))
+    pnl[1:] = position[:-1] * np.diff(prices)
+    equity = initial_capital + np.cumsum(pnl)
+    returns = np.diff(equity) / equity[:-1]
+
+    return {
+        'sharpe_ratio': float(Analytics.sharpe_ratio(returns)),
+        'max_drawdown': Analytics.max_drawdown(equity),
+        'total_return': float(equity[-1] / initial_capital - 1),
+        'trades': int(np.count_nonzero(np.diff(position))) + int(position[0])
+    }
+
+
+# Each worker process attaches once to the shared price array, only the parameters are sent per task
+_shared_memory = None
+_shared_prices = None
+
+
+def _attach_shared_prices(name, size):
+    global _shared_memory, _shared_prices
+    _shared_memory = shared_memory.SharedMemory(name=name)
+    _shared_prices = np.ndarray((size,), dtype='float64', buffer=_shared_memory.buf)
+
+
+def _evaluate(task):
+    strategy, params, initial_capital = task
+    signals = STRATEGIES[strategy][0](_shared_prices, **params)
+    return {**params, **evaluate_signals(_shared_prices, signals, initial_capital)}
+
+
+# Runs one strategy over many parameter combinations of the same price history, spread across a process pool.
+# The prices live in shared memory, so workers read them without a copy being pickled for each task.
+class ParameterSweep:
+    def __init__(self, strategy, prices, initial_capital=None, workers=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Invalid strategy for ParameterSweep: {strategy}")
+        self._strategy = strategy
+        self._prices = np.ascontiguousarray(prices, dtype='float64')
+        if len(self._prices) == 0:
+            raise ValueError("No prices to sweep")
+        self._initial_capital = initial_capital or Config.Backtest.InitialCapital
+        self._workers = workers or Config.ParameterSweep.Workers or os.cpu_count()
+
+    # every combination of the parameter value lists
+    def grid(self, param_grid):
+        names = list(param_grid)
+        combinations = [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+        return [params for params in combinations if STRATEGIES[self._strategy][1](params)]
+
+    # n combinations drawn from the grid without replacement
+    def random(self, param_grid, n, seed=None):
+        combinations = self.grid(param_grid)
+        rng = np.random.default_rng(seed)
+        return [combinations[i] for i in rng.choice(len(combinations), min(n, len(combinations)), replace=False)]
+
+    # Returns one row per parameter combination, best first: highest Sharpe ratio, then lowest max drawdown
+    def run(self, combinations):
+        start_time = time.perf_counter()
+        self._logger.info(f"Sweeping {len(combinations)} {self._strategy} parameter combinations "
+                          f"over {len(self._prices)} ticks with {self._workers} workers ..")
+
+        shm = shared_memory.SharedMemory(create=True, size=self._prices.nbytes)
+        try:
+            np.ndarray(self._prices.shape, dtype='float64', buffer=shm.buf)[:] = self._prices
+            tasks = [(self._strategy, params, self._initial_capital) for params in combinations]
+            # spawn, like PipelineSupervisor, so workers don't inherit the parent's sockets and threads
+            with ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_attach_shared_prices, initargs=(shm.name, len(self._prices))) as pool:
+                rows = list(pool.map(_evaluate, tasks, chunksize=max(1, len(tasks) // (4 * self._workers))))
+        finally:
+            shm.close()
+            shm.unlink()
+
+        results = pd.DataFrame(rows)
+        if not results.empty:
+            results = results.sort_values(['sharpe_ratio', 'max_drawdown'], ascending=[False, True], ignore_index=True)
+        self._logger.info(f"Sweep done in {time.perf_counter() - start_time:.1f} seconds")
+        return results
+
+    # the whole history of one ticker as a single price array, max_ticks is required for the endless simulated data
+    @staticmethod
+    def load_prices(ticker, source=None, max_ticks=None):
+        market_data_source = MarketDataSource.get_instance(ticker, source)
+        if max_ticks is None and not isinstance(market_data_source, HistoricalDataSource):
+            raise ValueError(f"{market_data_source.__class__.__name__} never ends, set max_ticks "
+                             f"(Config.Backtest.MaxTicksPerTicker) to sweep it")
+        chunks = []
+        tick_count = 0
+        while max_ticks is None or tick_count < max_ticks:
+            chunk = market_data_source.next_chunk()
+            if chunk is None:
+                break
+            prices = chunk[1] if max_ticks is None else chunk[1][:max_ticks - tick_count]
+            chunks.append(prices)
+            tick_count += len(prices)
+        return np.concatenate(chunks) if chunks else np.zeros(0)
+
+
+def main():
+    LoggingConfig.setup_logging('TradeBlaze_ParameterSweep.log')
+    logger = logging.getLogger(__name__)
+
+    ticker = (Config.Backtest.Tickers or Config.MarketData.Tickers)[0]
+    prices = ParameterSweep.load_prices(ticker, Config.Backtest.Source, Config.Backtest.MaxTicksPerTicker)
+    parameter_sweep = ParameterSweep(Config.ParameterSweep.Strategy, prices)
+
+    param_grid = Config.ParameterSweep.Grids[Config.ParameterSweep.Strategy]
+    if Config.ParameterSweep.Search == "Grid":
+        combinations = parameter_sweep.grid(param_grid)
+    elif Config.ParameterSweep.Search == "Random":
+        combinations = parameter_sweep.random(param_grid, Config.ParameterSweep.RandomSamples,
+                                              Config.ParameterSweep.Seed)
+    else:
+        raise ValueError(f"Invalid ParameterSweep search: {Config.ParameterSweep.Search}")
+    results = parameter_sweep.run(combinations)
+
+    os.makedirs(Config.Backtest.OutputDir, exist_ok=True)
+    path = f"{Config.Backtest.OutputDir}/sweep_{Config.ParameterSweep.Strategy}_{ticker}.csv"
+    results.to_csv(path, index=False)
+    logger.info(f"Sweep results saved to {path}")
+    print(results.head(Config.ParameterSweep.TopN).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import Config
+
+
+# Correlated multi-asset GBM price paths, generated a whole block at a time in one vectorized NumPy step.
+# One step per tick, mu and sigma are per step (scalars, or one value per ticker):
+#   log S[t+1] = log S[t] + (mu - lambda * k - 0.5 * vol[t]^2) + vol[t] * Z[t] + J[t]
+# where Z ~ N(0, correlation), vol[t] = sigma * intraday_vol_profile[t] and J is an optional Merton jump:
+#   N ~ Poisson(jump_intensity) jumps per step, each of log size ~ N(jump_mean, jump_std^2), k = E[e^jump] - 1.
+# Blocks are generated in order by one background worker using this instance's own numpy.random.Generator,
+# the next block is always being generated while the current one is consumed.
+# Each consumer (one per ticker) reads its column of every block and releases it when done, a block is
+# dropped once all consumers have released it.
+class GbmPathGenerator:
+    def __init__(self, tickers, start_price=500.0, mu=0.0001, sigma=0.01, correlation=0.0,
+                 jump_intensity=0.0, jump_mean=0.0, jump_std=0.0,
+                 intraday_vol_profile=None, steps_per_session=23_400, block_size=65_536, seed=42):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._tickers = list(tickers)
+        n_tickers = len(self._tickers)
+        self._block_size = block_size
+
+        self._log_prices = np.log(np.broadcast_to(np.asarray(start_price, dtype='float64'), (n_tickers,))).copy()
+        self._mu = np.broadcast_to(np.asarray(mu, dtype='float64'), (n_tickers,))
+        self._sigma = np.broadcast_to(np.asarray(sigma, dtype='float64'), (n_tickers,))
+
+        # a single number is the pairwise correlation of all tickers, otherwise a full correlation matrix
+        correlation = np.asarray(correlation, dtype='float64')
+        if correlation.ndim == 0:
+            correlation = np.full((n_tickers, n_tickers), float(correlation))
+            np.fill_diagonal(correlation, 1.0)
+        # raises LinAlgError if the matrix is not positive definite
+        self._cholesky = None if n_tickers == 1 or np.allclose(correlation, np.eye(n_tickers)) \
+            else np.linalg.cholesky(correlation)
+
+        self._jump_intensity = jump_intensity
+        self._jump_mean = jump_mean
+        self._jump_std = jump_std
+        # the jump compensator keeps the expected return equal to mu
+        self._jump_compensator = jump_intensity * (np.exp(jump_mean + 0.5 * jump_std ** 2) - 1.0)
+
+        # vol multiplier of every step of a session, the profile buckets are spread evenly over the session
+        if intraday_vol_profile:
+            profile = np.asarray(intraday_vol_profile, dtype='float64')
+            buckets = np.arange(steps_per_session) * len(profile) // steps_per_session
+            self._session_vol_profile = profile[buckets]
+        else:
+            self._session_vol_profile = None
+        self._step = 0
+
+        if seed is not None:
+            self._logger.info(f"Using random number seed: {seed}")
+        self._rng = np.random.default_rng(seed)
+
+        # generation runs on one worker thread, which keeps the blocks in order and the Generator single-threaded
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._blocks = {}  # block index -> [future, consumers still reading it]
+        self._next_block_index = 0
+
+    @staticmethod
+    def from_config(tickers):
+        return GbmPathGenerator(tickers,
+                                start_price=Config.SimulatedData.StartPrice,
+                                mu=Config.SimulatedData.Mu,
+                                sigma=Config.SimulatedData.Sigma,
+                                correlation=Config.SimulatedData.Correlation,
+                                jump_intensity=Config.SimulatedData.JumpIntensity,
+                                jump_mean=Config.SimulatedData.JumpMean,
+                                jump_std=Config.SimulatedData.JumpStd,
+                                intraday_vol_profile=Config.SimulatedData.IntradayVolProfile,
+                                steps_per_session=Config.SimulatedData.StepsPerSession,
+                                block_size=Config.SimulatedData.BlockSize,
+                                seed=Config.SimulatedData.Seed)
+
+    @property
+    def tickers(self):
+        return self._tickers
+
+    @property
+    def block_size(self):
+        return self._block_size
+
+    # Returns block `index` as a (block_size, tickers) array of prices rounded to 2 decimals,
+    # waiting for it only if the background worker has not finished it yet
+    def block(self, index):
+        with self._lock:
+            # keep one block ahead of the furthest consumer
+            while self._next_block_index <= index + 1:
+                self._blocks[self._next_block_index] = [self._executor.submit(self._generate_block),
+                                                        len(self._tickers)]
+                self._next_block_index += 1
+            future = self._blocks[index][0]
+        return future.result()
+
+    # Called by each consumer once it has read all of its column of block `index`
+    def release(self, index):
+        with self._lock:
+            entry = self._blocks.get(index)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._blocks[index]
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _generate_block(self):
+        n_steps, n_tickers = self._block_size, len(self._tickers)
+
+        increments = self._rng.standard_normal((n_steps, n_tickers))
+        if self._cholesky is not None:
+            increments = increments @ self._cholesky.T
+
+        if self._session_vol_profile is None:
+            vol = self._sigma
+        else:
+            steps = np.arange(self._step, self._step + n_steps) % len(self._session_vol_profile)
+            vol = self._session_vol_profile[steps, None] * self._sigma
+        increments *= vol
+        increments += self._mu - self._jump_compensator - 0.5 * vol ** 2
+
+        if self._jump_intensity > 0:
+            jump_counts = self._rng.poisson(self._jump_intensity, (n_steps, n_tickers))
+            jumped = jump_counts > 0
+            counts = jump_counts[jumped]
+            increments[jumped] += counts * self._jump_mean + \
+                np.sqrt(counts) * self._jump_std * self._rng.standard_normal(len(counts))
+
+        # log price paths continue from the last step of the previous block
+        increments[0] += self._log_prices
+        np.cumsum(increments, axis=0, out=increments)
+        self._log_prices = increments[-1].copy()
+        self._step += n_steps
+
+        np.exp(increments, out=increments)
+        return np.round(increments, 2, out=increments)
+
+
+# Throughput check of the bulk block API
+if __name__ == "__main__":
+    import time
+
+    for n_tickers in (1, 10, 100):
+        path_generator = GbmPathGenerator([f"T{i}" for i in range(n_tickers)], correlation=0.3, jump_intensity=0.001,
+                                          jump_mean=-0.01, jump_std=0.02, intraday_vol_profile=[1.5, 1.0, 0.8, 1.0, 1.4])
+        path_generator.block(0)
+        n_blocks = 20
+        start_time = time.perf_counter()
+        for index in range(n_blocks):
+            path_generator.block(index)
+            for _ in path_generator.tickers:
+                path_generator.release(index)
+        elapsed_seconds = time.perf_counter() - start_time
+        path_generator.close()
+
+        n_ticks = n_blocks * path_generator.block_size * n_tickers
+        print(f"{n_tickers:>4} tickers: {n_ticks / elapsed_seconds / 1e6:.1f}M ticks/s")
@@ -0,0 +1,91 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import Config
+from Decorator import *
+
+
+# Statistical profiler of the running server: a background thread samples the Python stack of the event loop
+# thread (or of all threads) every Config.Diagnostics.ProfilerSampleIntervalSeconds. Nothing is instrumented,
+# the sampled code only pays for the GIL the sampler holds while it walks the stacks.
+# The samples are returned as folded stacks, one "thread;outermost frame;...;innermost frame count" line per
+# distinct stack, the input of flamegraph.pl, speedscope and similar flame graph tools.
+@singleton
+class SamplingProfiler:
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._thread = None
+        self._stopped = threading.Event()
+        self._stacks = Counter()  # folded stack -> samples
+        self._frame_names = {}  # code object -> "file:function"
+        self._sample_count = 0
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # Samples the calling thread, or every thread if all_threads. Stops by itself after max_duration_seconds.
+    def start(self, interval_seconds=None, max_duration_seconds=None, all_threads=False):
+        if self.is_running:
+            raise RuntimeError("Profiler is already running")
+
+        interval_seconds = interval_seconds or Config.Diagnostics.ProfilerSampleIntervalSeconds
+        max_duration_seconds = min(max_duration_seconds or Config.Diagnostics.ProfilerMaxDurationSeconds,
+                                   Config.Diagnostics.ProfilerMaxDurationSeconds)
+        thread_id = None if all_threads else threading.get_ident()
+
+        self._stacks = Counter()
+        self._sample_count = 0
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, args=(thread_id, interval_seconds, max_duration_seconds),
+                                        name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+        self._logger.info(f"Profiler started, sampling {'all threads' if all_threads else 'the event loop thread'} "
+                          f"every {interval_seconds} seconds for at most {max_duration_seconds} seconds")
+
+    # Returns the folded stacks sampled since start()
+    def stop(self):
+        if self._thread is None:
+            raise RuntimeError("Profiler is not running")
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self._logger.info(f"Profiler stopped, {self._sample_count} samples of {len(self._stacks)} distinct stacks")
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def _run(self, thread_id, interval_seconds, max_duration_seconds):
+        profiler_thread_id = threading.get_ident()
+        deadline = time.monotonic() + max_duration_seconds
+        while not self._stopped.wait(interval_seconds):
+            if time.monotonic() > deadline:
+                self._logger.warning(f"Profiler stopped sampling after {max_duration_seconds} seconds")
+                return
+
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for frame_thread_id, frame in sys._current_frames().items():
+                if frame_thread_id == profiler_thread_id or (thread_id is not None and frame_thread_id != thread_id):
+                    continue
+                self._stacks[self._fold(thread_names.get(frame_thread_id, str(frame_thread_id)), frame)] += 1
+            self._sample_count += 1
+
+    def _fold(self, thread_name, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            name = self._frame_names.get(code)
+            if name is None:
+                name = self._frame_names[code] = self._escape(
+                    f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+            names.append(name)
+            frame = frame.f_back
+        names.append(self._escape(thread_name))
+        return ";".join(reversed(names))
+
+    @staticmethod
+    def _escape(name):
+        # ";" separates the frames and " " the count
+        return name.replace(";", "_").replace(" ", "_")
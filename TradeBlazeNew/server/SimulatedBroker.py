@@ -1,12 +1,14 @@
-import json
 import logging
 
 import zmq
 import zmq.asyncio
 
 import Config
+from Codec import *
 from DataModels import *
 from Decorator import *
+from LatencyMonitor import *
+from MarketDataFeed import *
 
 
 @singleton
@@ -19,21 +21,29 @@ class SimulatedBroker:
         # ZeroMQ subscriber for market data
         ctx = zmq.asyncio.Context()
         self._market_socket = ctx.socket(zmq.SUB)
-        if Config.MarketData.EnableConflation:
-            self._market_socket.setsockopt(zmq.CONFLATE, 1)
         self._market_socket.setsockopt_string(zmq.SUBSCRIBE, '')
         self._market_socket.connect(Config.MarketData.ServerAddr)
+        self._market_receiver = SequencedReceiver(self._market_socket, ctx)
+        # orders fill at the latest price, so the ticks in between never matter here
+        self._conflator = Conflator(self._market_receiver, mode="Always", subscriber='SimulatedBroker')
+
+        self._place_order_latency = LatencyMonitor().histogram("broker.place_order")
+
+    @property
+    def feed_stats(self):
+        return {**self._market_receiver.stats, **self._conflator.stats}
 
     async def on_market_data(self):
         while True:
-            msg = await self._market_socket.recv_string()
-            market_data = MarketData(**json.loads(msg))
-            self._latest_prices[market_data.ticker] = market_data.price
+            for market_data, _ in await self._conflator.get_batch(Config.SignalData.MaxBatchSize):
+                self._latest_prices[market_data.ticker] = market_data.price
 
     async def place_order(self, order_data, on_order_execution):
+        start_ns = monotonic_ns()
         order_data.filled_price = self._latest_prices[order_data.ticker]
         order_data.order_status = 'FILLED'
         self._logger.info(f'Executed order: {order_data}')
+        self._place_order_latency.record(monotonic_ns() - start_ns)
 
         # async callback for notifying order execution
         await on_order_execution(order_data)
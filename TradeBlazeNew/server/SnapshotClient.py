@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+import zmq
+import zmq.asyncio
+
+import Config
+
+
+# Asks the MessageBroker for the cached messages of a topic prefix, see MessageBroker for the protocol.
+# Subscribe to the prefix before fetching it, so that nothing published in between is missed; messages that were
+# already in the snapshot can then arrive again on the live stream.
+class SnapshotClient:
+    def __init__(self, context=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._context = context or zmq.asyncio.Context.instance()
+        self._socket = None
+        self._lock = asyncio.Lock()
+
+    # Returns [(topic, payload, ...)] oldest first, or None if the broker didn't answer within timeout_seconds
+    async def fetch(self, prefix=b"", depth=0, timeout_seconds=None):
+        timeout_seconds = timeout_seconds or Config.MessageBroker.SnapshotTimeoutSeconds
+        async with self._lock:
+            if self._socket is None:
+                self._socket = self._context.socket(zmq.DEALER)
+                self._socket.connect(Config.MessageBroker.SnapshotSocketAddr)
+
+            await self._socket.send_multipart([prefix, str(depth).encode()])
+            try:
+                snapshot = await asyncio.wait_for(self._receive_snapshot(), timeout_seconds)
+            except asyncio.TimeoutError:
+                self._logger.warning(f"No snapshot from MessageBroker for topic prefix {prefix} "
+                                     f"within {timeout_seconds} seconds")
+                # a late reply must not be taken for the answer to the next request
+                self._socket.close(linger=0)
+                self._socket = None
+                return None
+
+        self._logger.info(f"Received snapshot of {len(snapshot)} messages for topic prefix: {prefix}")
+        return snapshot
+
+    async def _receive_snapshot(self):
+        snapshot = []
+        while True:
+            message = await self._socket.recv_multipart()
+            if not message[0]:
+                return snapshot
+            snapshot.append(tuple(message))
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close(linger=0)
+            self._socket = None
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+import Config
+from Decorator import *
+from Metrics import *
+
+
+# Detects synchronous work blocking the event loop of this process, e.g. a slow SQLite or DuckDB call.
+# A heartbeat coroutine on the loop beats every Config.Diagnostics.StallCheckIntervalSeconds; a watchdog thread
+# that sees no beat for Config.Diagnostics.StallThresholdSeconds logs the stack of the loop thread while it is
+# still blocked, i.e. the code that blocks it, and the task that was running. Once the loop runs again the
+# heartbeat logs how long it was stalled.
+@singleton
+class StallWatchdog:
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._last_beat = 0.0
+        self._stopped = threading.Event()
+
+        self._stalls = Metrics().counter("tradeblaze_event_loop_stalls_total",
+                                         "Event loop stalls longer than the StallThresholdSeconds").labels()
+
+    async def run(self):
+        if not Config.Diagnostics.StallThresholdSeconds:
+            return
+
+        self._stopped.clear()
+        self._last_beat = time.monotonic()
+        loop = asyncio.get_running_loop()
+        thread = threading.Thread(target=self._watch, args=(threading.get_ident(), loop),
+                                  name=self.__class__.__name__, daemon=True)
+        thread.start()
+        try:
+            await self._beat()
+        finally:
+            self._stopped.set()
+
+    async def _beat(self):
+        interval = Config.Diagnostics.StallCheckIntervalSeconds
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            stall_seconds = now - self._last_beat - interval
+            self._last_beat = now
+            if stall_seconds >= Config.Diagnostics.StallThresholdSeconds:
+                self._stalls.inc()
+                self._logger.warning(f"Event loop was stalled for {stall_seconds:.3f} seconds")
+
+    # runs in the watchdog thread
+    def _watch(self, loop_thread_id, loop):
+        reported_beat = None
+        while not self._stopped.wait(Config.Diagnostics.StallCheckIntervalSeconds):
+            last_beat = self._last_beat
+            stall_seconds = time.monotonic() - last_beat
+            # one stack per stall
+            if stall_seconds < Config.Diagnostics.StallThresholdSeconds or last_beat == reported_beat:
+                continue
+            reported_beat = last_beat
+
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is None:
+                return
+            task = asyncio.current_task(loop)
+            stack = "".join(traceback.format_stack(frame))
+            self._logger.warning(f"Event loop blocked for {stall_seconds:.3f} seconds so far, "
+                                 f"task: {task.get_name() if task else None}, stack:\n{stack}")
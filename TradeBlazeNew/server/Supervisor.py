@@ -0,0 +1,254 @@
+import multiprocessing
+import queue
+import signal
+import time
+
+from MarketDataGateway import *
+from MessageBroker import *
+from OrderManager import *
+from SimulatedBroker import *
+from StallWatchdog import *
+from TradingStrategy import *
+
+
+# Pause/resume of a TradingStrategy that runs in another process.
+# The flag lives in shared memory, so it also survives a restart of the strategy process.
+class TradingEngineControl:
+    def __init__(self, paused_flag):
+        self._paused_flag = paused_flag
+
+    def is_trading_engine_paused(self):
+        return bool(self._paused_flag.value)
+
+    def pause_trading_engine(self):
+        self._paused_flag.value = 1
+
+    def resume_trading_engine(self):
+        self._paused_flag.value = 0
+
+
+class ManagedProcess:
+    def __init__(self, name, heartbeat):
+        self.name = name
+        self.heartbeat = heartbeat  # monotonic time of the last heartbeat, 0 until the component is up
+        self.process = None
+        self.restarts = 0
+        self.finished = False
+
+
+# Runs each pipeline component in its own OS process so that they are no longer serialized by the GIL.
+# Components still talk to each other over ZeroMQ exactly as in single-process mode.
+# The supervisor starts them in dependency order, watches their heartbeats and restarts a crashed or hung one.
+@singleton
+class PipelineSupervisor:
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        # spawn (not fork) so that no ZeroMQ context or event loop state leaks into the children
+        self._mp_context = multiprocessing.get_context('spawn')
+        self._paused_flag = self._mp_context.RawValue('b', 0)
+        # (component name, samples) pushed by the component processes, see Metrics
+        self._metrics_queue = self._mp_context.Queue()
+        self._components = {name: ManagedProcess(name, self._mp_context.RawValue('d', 0.0))
+                            for name in self.get_component_names()}
+
+    @staticmethod
+    def get_component_names():
+        # startup order: the broker first, the market data gateway last so that subscribers are already connected
+        names = ['MessageBroker', 'TradingStrategy', 'OrderManager']
+        if not Config.MarketData.EnableServerMode:
+            names.append('MarketDataGateway')
+        return names
+
+    def get_trading_engine_control(self):
+        return TradingEngineControl(self._paused_flag)
+
+    def get_status(self):
+        now = time.monotonic()
+        return [{
+            "name": component.name,
+            "pid": component.process.pid if component.process else None,
+            "alive": component.process is not None and component.process.is_alive(),
+            "finished": component.finished,
+            "restarts": component.restarts,
+            "heartbeat_age_seconds": round(now - component.heartbeat.value, 3) if component.heartbeat.value else None
+        } for component in self._components.values()]
+
+    async def run(self):
+        try:
+            for component in self._components.values():
+                await self._start(component)
+                await self._wait_until_ready(component)
+
+            while True:
+                await asyncio.sleep(Config.Pipeline.HeartbeatIntervalSeconds)
+                self._receive_metrics()
+                for component in self._components.values():
+                    await self._check_health(component)
+        finally:
+            await asyncio.to_thread(self._stop_all)
+
+    async def _start(self, component):
+        component.heartbeat.value = 0.0
+        component.process = self._mp_context.Process(
+            target=run_component, name=component.name, daemon=True,
+            args=(component.name, component.heartbeat, self._paused_flag, self._metrics_queue))
+        await asyncio.to_thread(component.process.start)
+        self._logger.info(f"Started {component.name} process, pid: {component.process.pid}")
+
+    async def _wait_until_ready(self, component):
+        deadline = time.monotonic() + Config.Pipeline.StartupTimeoutSeconds
+        while component.heartbeat.value == 0.0:
+            if not component.process.is_alive() or time.monotonic() > deadline:
+                self._logger.error(f"{component.name} process failed to start")
+                return
+            await asyncio.sleep(0.05)
+        self._logger.info(f"{component.name} process is ready")
+
+    async def _check_health(self, component):
+        if component.finished:
+            return
+
+        process = component.process
+        if not process.is_alive():
+            if process.exitcode == 0:
+                # e.g. the market data gateway after its configured stream duration
+                self._logger.info(f"{component.name} process finished")
+                component.finished = True
+                return
+            self._logger.error(f"{component.name} process crashed, exit code: {process.exitcode}")
+        elif component.heartbeat.value and \
+                time.monotonic() - component.heartbeat.value > Config.Pipeline.HeartbeatTimeoutSeconds:
+            # the event loop of that process is blocked, the heartbeat coroutine can't run
+            self._logger.error(f"{component.name} process missed its heartbeat, terminating it")
+            await asyncio.to_thread(self._terminate, process)
+        else:
+            return
+
+        if component.restarts >= Config.Pipeline.MaxRestarts:
+            self._logger.error(f"{component.name} process restarted {component.restarts} times already, giving up")
+            component.finished = True
+            return
+
+        component.restarts += 1
+        await asyncio.sleep(Config.Pipeline.RestartDelaySeconds)
+        self._logger.info(f"Restarting {component.name} process, restart count: {component.restarts}")
+        await self._start(component)
+        await self._wait_until_ready(component)
+
+    def _receive_metrics(self):
+        while True:
+            try:
+                name, samples = self._metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+            Metrics().set_process_samples(name, samples)
+
+    def _stop_all(self):
+        # stop in reverse startup order
+        for component in reversed(list(self._components.values())):
+            if component.process is not None and component.process.is_alive():
+                self._logger.info(f"Stopping {component.name} process")
+                self._terminate(component.process)
+
+    # SIGTERM lets the component clean up (see run_component), a process that doesn't exit in time is killed
+    @staticmethod
+    def _terminate(process):
+        process.terminate()
+        process.join(timeout=Config.Pipeline.StopTimeoutSeconds)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+# Entry point of each component process
+def run_component(name, heartbeat, paused_flag, metrics_queue):
+    if sys.platform.startswith("win"):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    LoggingConfig.setup_logging(log_file_name=f"TradeBlaze_{name}.log")
+    try:
+        asyncio.run(_run_component(name, heartbeat, paused_flag, metrics_queue))
+    except asyncio.CancelledError:
+        logging.getLogger(name).info(f"{name} process stopped")
+        # the exit code of a process killed by SIGTERM, so the supervisor doesn't take it for a finished component
+        sys.exit(128 + signal.SIGTERM)
+
+
+async def _run_component(name, heartbeat, paused_flag, metrics_queue):
+    logger = logging.getLogger(name)
+
+    # The supervisor stops a component with SIGTERM, whose default action ends the process right away.
+    # Cancel the component instead, so that its cleanup runs: the finally blocks (e.g. TickPersistence.close),
+    # the final metrics push below and the flush of the async log queue at exit.
+    # (On Windows terminate() can't be handled, it always ends the process right away.)
+    if not sys.platform.startswith("win"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    if name == 'MessageBroker':
+        async_tasks = [MessageBroker().run()]
+    elif name == 'TradingStrategy':
+        trading_strategy = TradingStrategy.get_instance()
+        async_tasks = [trading_strategy.on_market_data(), _sync_pause_flag(trading_strategy, paused_flag)]
+    elif name == 'OrderManager':
+        # the order gateway fills against the SimulatedBroker of its own process, which needs the market data
+        order_manager = OrderManager()
+        async_tasks = [order_manager.on_signal_data(), SimulatedBroker().on_market_data()]
+    elif name == 'MarketDataGateway':
+        market_data_gateway = MarketDataGateway(MarketDataSource.get_instances())
+        async_tasks = [market_data_gateway.stream_prices()]
+    else:
+        raise ValueError(f"Invalid pipeline component: {name}")
+
+    logger.info(f"Running {name} in process {os.getpid()}")
+
+    # the first heartbeat tells the supervisor this component is up, so start it only after the setup above
+    heartbeat_task = asyncio.create_task(_heartbeat(heartbeat))
+    latency_log_task = asyncio.create_task(LatencyMonitor().log_periodically())
+    event_loop_lag_task = asyncio.create_task(Metrics().monitor_event_loop_lag())
+    stall_watchdog_task = asyncio.create_task(StallWatchdog().run())
+    push_metrics_task = asyncio.create_task(_push_metrics(name, metrics_queue))
+    try:
+        await asyncio.gather(*async_tasks)
+    finally:
+        heartbeat_task.cancel()
+        latency_log_task.cancel()
+        event_loop_lag_task.cancel()
+        stall_watchdog_task.cancel()
+        push_metrics_task.cancel()
+        # the final counts, e.g. of a gateway that finished its stream
+        metrics_queue.put((name, Metrics().collect()))
+
+
+async def _heartbeat(heartbeat):
+    while True:
+        heartbeat.value = time.monotonic()
+        await asyncio.sleep(Config.Pipeline.HeartbeatIntervalSeconds)
+
+
+async def _push_metrics(name, metrics_queue):
+    while True:
+        await asyncio.sleep(Config.Metrics.PushIntervalSeconds)
+        metrics_queue.put((name, Metrics().collect()))
+
+
+async def _sync_pause_flag(trading_strategy, paused_flag):
+    while True:
+        if paused_flag.value and not trading_strategy.is_trading_engine_paused():
+            trading_strategy.pause_trading_engine()
+        elif not paused_flag.value and trading_strategy.is_trading_engine_paused():
+            trading_strategy.resume_trading_engine()
+        await asyncio.sleep(Config.Pipeline.ControlPollSeconds)
+
+
+# Example usage: run the pipeline without the REST/WebSocket server
+async def main():
+    LoggingConfig.setup_logging()
+    await PipelineSupervisor().run()
+
+
+if __name__ == "__main__":
+    if sys.platform.startswith("win"):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    asyncio.run(main())
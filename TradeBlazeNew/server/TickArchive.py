@@ -0,0 +1,188 @@
+import logging
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import Config
+from DataModels import *
+from LoggingConfig import *
+from TickPersistence import *
+
+# Parquet tick archive, hive-partitioned by ticker and (UTC) date:
+#   {root}/ticker=SPY/date=2025-06-12/part-<writer session>-<file number, 8 digits>.parquet
+# The files only hold the timestamp (UTC, ns) and price columns, ticker and date come from the path.
+# The session (start time in epoch ns) and the zero-padded file number make the file names of a partition sort in
+# the order they were written, which is the order the dataset scanner reads them in.
+ARCHIVE_FILE_SCHEMA = pa.schema([('timestamp', pa.timestamp('ns', tz='UTC')), ('price', pa.float64())])
+ARCHIVE_PARTITIONING = ds.partitioning(pa.schema([('ticker', pa.string()), ('date', pa.string())]),
+                                       flavor='hive')
+
+
+# Writes tick batches coming from TickPersistence into the archive.
+# Rows are collected per partition and written as one compressed row group every `row_group_size` rows.
+# A Parquet file is only readable once its footer is written, so a file is finalized when a ticker rolls over
+# to a new date, when its oldest rows are `flush_interval_seconds` old and on close(); the next rows of the
+# partition go to a new file. At most that many seconds of ticks are lost if the process dies.
+class ParquetTickSink(TickSink):
+    def __init__(self, root=None, row_group_size=None, compression=None, flush_interval_seconds=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._root = root or Config.Persistence.ArchiveDir
+        self._row_group_size = row_group_size or Config.Persistence.ParquetRowGroupSize
+        self._compression = compression or Config.Persistence.ParquetCompression
+        self._flush_interval_seconds = flush_interval_seconds or Config.Persistence.ParquetFlushIntervalSeconds
+
+        # files are named by writer session and file number, so neither a restart nor a partition that is
+        # written again after a flush ever overwrites an earlier file
+        self._session = time.time_ns()
+        self._file_count = 0
+        self._pending = {}  # (ticker, date) -> list of (timestamps, prices) arrays not yet written
+        self._pending_rows = {}
+        self._unflushed_since = {}  # (ticker, date) -> time.monotonic() of its oldest rows not in a closed file
+        self._writers = {}  # (ticker, date) -> open pq.ParquetWriter
+        self._current_dates = {}  # ticker -> latest date seen
+
+    def write_batch(self, batch):
+        timestamps = batch['timestamp']
+        dates = timestamps.astype('datetime64[ns]').astype('datetime64[D]').astype(str)
+        tickers = batch['ticker']
+
+        keys = np.char.add(np.char.add(tickers.astype(str), '|'), dates)
+        for key in np.unique(keys):
+            ticker, date = str(key).split('|')
+            mask = keys == key
+            partition = (ticker, date)
+            self._pending.setdefault(partition, []).append((timestamps[mask], batch['price'][mask]))
+            self._unflushed_since.setdefault(partition, time.monotonic())
+            self._pending_rows[partition] = self._pending_rows.get(partition, 0) + int(mask.sum())
+
+            if self._current_dates.get(ticker, date) < date:
+                # the ticker rolled over to a new day, the previous day's file is complete
+                self._close_partition((ticker, self._current_dates[ticker]))
+            self._current_dates[ticker] = max(self._current_dates.get(ticker, date), date)
+
+            if self._pending_rows[partition] >= self._row_group_size:
+                self._write_row_group(partition)
+
+        self.poll()
+
+    def poll(self):
+        deadline = time.monotonic() - self._flush_interval_seconds
+        for partition, unflushed_since in list(self._unflushed_since.items()):
+            if unflushed_since <= deadline:
+                self._close_partition(partition)
+
+    def close(self):
+        for partition in list(self._pending) + list(self._writers):
+            self._close_partition(partition)
+
+    def _write_row_group(self, partition):
+        chunks = self._pending.pop(partition, None)
+        self._pending_rows.pop(partition, None)
+        if not chunks:
+            return
+
+        table = pa.table({
+            'timestamp': pa.array(np.concatenate([chunk[0] for chunk in chunks]), type=pa.timestamp('ns', tz='UTC')),
+            'price': pa.array(np.concatenate([chunk[1] for chunk in chunks]), type=pa.float64())
+        }, schema=ARCHIVE_FILE_SCHEMA)
+
+        writer = self._writers.get(partition)
+        if writer is None:
+            ticker, date = partition
+            directory = os.path.join(self._root, f"ticker={ticker}", f"date={date}")
+            os.makedirs(directory, exist_ok=True)
+            self._file_count += 1
+            writer = pq.ParquetWriter(os.path.join(directory, f"part-{self._session}-{self._file_count:08d}.parquet"),
+                                      ARCHIVE_FILE_SCHEMA, compression=self._compression)
+            self._writers[partition] = writer
+        writer.write_table(table, row_group_size=len(table))
+
+    def _close_partition(self, partition):
+        self._write_row_group(partition)
+        self._unflushed_since.pop(partition, None)
+        writer = self._writers.pop(partition, None)
+        if writer is not None:
+            writer.close()
+            self._logger.info(f"Archived ticks of {partition[0]} on {partition[1]}")
+
+
+# Read side of the archive. Filters on ticker and date only open the matching partitions,
+# and only the requested columns are read from the files.
+class TickArchive:
+    def __init__(self, root=None):
+        self._root = root or Config.Persistence.ArchiveDir
+
+    @property
+    def root(self):
+        return self._root
+
+    def _dataset(self):
+        return ds.dataset(self._root, format='parquet', partitioning=ARCHIVE_PARTITIONING)
+
+    @staticmethod
+    def _filter(tickers=None, start=None, end=None):
+        # start/end are epoch ns (inclusive/exclusive), the date conditions prune whole partitions
+        conditions = []
+        if tickers is not None:
+            conditions.append(pc.field('ticker').isin(list(tickers)))
+        if start is not None:
+            conditions.append(pc.field('date') >= str(np.datetime64(start, 'ns').astype('datetime64[D]')))
+            conditions.append(pc.field('timestamp') >= pa.scalar(start, type=pa.timestamp('ns', tz='UTC')))
+        if end is not None:
+            conditions.append(pc.field('date') <= str(np.datetime64(end, 'ns').astype('datetime64[D]')))
+            conditions.append(pc.field('timestamp') < pa.scalar(end, type=pa.timestamp('ns', tz='UTC')))
+
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def read(self, tickers=None, start=None, end=None, columns=None):
+        table = self._dataset().to_table(columns=columns, filter=TickArchive._filter(tickers, start, end))
+        return table.sort_by('timestamp') if 'timestamp' in table.column_names else table
+
+    # Record batches of at most batch_size rows, in file order: the ticks of each ticker in time order (the order
+    # the gateway wrote them), one ticker after the other. read() sorts across tickers.
+    def iter_batches(self, tickers=None, start=None, end=None, columns=None, batch_size=100_000):
+        scanner = self._dataset().scanner(columns=columns, filter=TickArchive._filter(tickers, start, end),
+                                          batch_size=batch_size)
+        yield from scanner.to_batches()
+
+    # Exposes the archive as a DuckDB view, so it can be queried with SQL without loading it first
+    def register_duckdb_view(self, conn, view_name='archive_ticks'):
+        glob = os.path.join(self._root, '**', '*.parquet').replace('\\', '/')
+        conn.execute(f"""
+                     CREATE OR REPLACE VIEW {view_name} AS
+                     SELECT timestamp, ticker, date, price
+                     FROM read_parquet('{glob}', hive_partitioning = true)
+                     """)
+        return view_name
+
+    # Imports a Timestamp,Ticker,Price CSV file (e.g. a HistoricalDataRepo file) into the archive
+    def import_csv(self, csv_path):
+        df = pd.read_csv(csv_path)
+        sink = ParquetTickSink(root=self._root)
+        sink.write_batch({
+            'timestamp': np.array([parse_timestamp(ts) for ts in df['Timestamp']], dtype='int64'),
+            'ticker': df['Ticker'].to_numpy(dtype='object'),
+            'price': df['Price'].to_numpy(dtype='float64')
+        })
+        sink.close()
+        return len(df)
+
+
+# Example usage, import csv repo files for HistoricalDataSource:
+# python TickArchive.py data/SPY_HistoricalDataRepo.csv
+if __name__ == "__main__":
+    import sys
+
+    LoggingConfig.setup_logging()
+    archive = TickArchive(f"{Config.Persistence.ArchiveDir}/HistoricalData")
+    for path in sys.argv[1:]:
+        print(f"Imported {archive.import_csv(path)} ticks from {path} into {archive.root}")
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+import Config
+
+
+# A destination of tick batches, called on the persistence thread only.
+# A batch is a dict of columns: 'timestamp' (int64 epoch ns), 'ticker' (object) and 'price' (float64) arrays.
+class TickSink:
+    def write_batch(self, batch):
+        raise NotImplementedError('Subclasses must implement write_batch')
+
+    # called on the persistence thread at every flush interval, also when no ticks arrived
+    def poll(self):
+        pass
+
+    def close(self):
+        pass
+
+    # Epoch ns -> naive local datetime64, same wall-clock time as the formatted timestamps.
+    # One UTC offset is used for the whole batch.
+    @staticmethod
+    def to_local_datetime(timestamps):
+        utc_offset_ns = time.localtime(int(timestamps[0]) // 1_000_000_000).tm_gmtoff * 1_000_000_000
+        return (timestamps + utc_offset_ns).astype('datetime64[ns]')
+
+    # Naive local datetime64 -> epoch ns, the reverse of to_local_datetime
+    @staticmethod
+    def from_local_datetime(local_datetimes):
+        naive_ns = local_datetimes.astype('datetime64[ns]').astype('int64')
+        if len(naive_ns) == 0:
+            return naive_ns
+        utc_offset_ns = time.localtime(int(naive_ns[0]) // 1_000_000_000).tm_gmtoff * 1_000_000_000
+        return naive_ns - utc_offset_ns
+
+
+# DuckDB file name of the ticks of a universe of tickers streamed together
+MULTI_TICKER_STORE = "MultiTicker"
+
+
+class DuckDbTickSink(TickSink):
+    # The one place that names the DuckDB tick files, written by the gateway and read by HistoricalDataSource:
+    # store_name is the ticker when one ticker is streamed, MULTI_TICKER_STORE for several
+    @staticmethod
+    def get_db_path(store_name, data_type):
+        return f"data/{store_name}_{data_type}.duckdb"
+
+    def __init__(self, db_path):
+        self._conn = duckdb.connect(db_path)
+        self._conn.execute("""
+                           CREATE TABLE IF NOT EXISTS ticks
+                           (
+                               Timestamp
+                               TIMESTAMP,
+                               Ticker
+                               TEXT,
+                               Price
+                               DOUBLE
+                           )
+                           """)
+
+    def write_batch(self, batch):
+        # one columnar append per batch instead of one INSERT per tick
+        tick_batch = pd.DataFrame({
+            'Timestamp': TickSink.to_local_datetime(batch['timestamp']),
+            'Ticker': batch['ticker'],
+            'Price': batch['price']
+        })
+        self._conn.register('tick_batch', tick_batch)
+        try:
+            self._conn.execute("INSERT INTO ticks SELECT Timestamp, Ticker, Price FROM tick_batch")
+        finally:
+            self._conn.unregister('tick_batch')
+
+    def close(self):
+        self._conn.close()
+
+
+# Background persistence stage for market data ticks.
+# The event loop only appends ticks to an in-memory buffer, a writer thread bulk-writes full batches
+# (or whatever is buffered after the flush interval) to the sinks. Publishing never waits on disk I/O.
+# If the writer falls behind by more than `max_backlog_ticks`:
+#   "Block" - submit() returns False and the producer should `await wait_for_capacity()` before the next tick
+#   "Drop"  - further ticks are not persisted until the writer catches up, they are counted as dropped and
+#             submit() keeps returning True, so the producer never waits
+class TickPersistence:
+    def __init__(self, sinks, batch_size=None, flush_interval_seconds=None, max_backlog_ticks=None,
+                 backpressure_policy=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._sinks = sinks
+        self._batch_size = batch_size or Config.Persistence.BatchSize
+        self._flush_interval_seconds = flush_interval_seconds or Config.Persistence.FlushIntervalSeconds
+        self._max_backlog_ticks = max_backlog_ticks or Config.Persistence.MaxBacklogTicks
+        self._backpressure_policy = backpressure_policy or Config.Persistence.BackpressurePolicy
+        if self._backpressure_policy not in ('Block', 'Drop'):
+            raise ValueError(f'Invalid backpressure policy: {self._backpressure_policy}')
+
+        # the buffer being filled, guarded by the lock, which is never held during I/O
+        self._lock = threading.Lock()
+        self._timestamps, self._tickers, self._prices = [], [], []
+        self._backlog = 0  # ticks submitted but not written yet
+        self._written = 0
+        self._dropped = 0
+        self._dropping = False  # dropping since the backlog got full
+        self._failed = 0
+
+        self._batches = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+
+    @property
+    def backlog(self):
+        return self._backlog
+
+    def get_stats(self):
+        return {
+            "backlog": self._backlog,
+            "queued_batches": self._batches.qsize(),
+            "written": self._written,
+            "dropped": self._dropped,
+            "failed": self._failed
+        }
+
+    # Returns False when the writer is behind and the producer should back off, with the "Block" policy only
+    def submit(self, market_data):
+        with self._lock:
+            dropping = self._backlog >= self._max_backlog_ticks and self._backpressure_policy == 'Drop'
+            started_dropping = dropping and not self._dropping
+            self._dropping = dropping
+            if dropping:
+                self._dropped += 1
+            else:
+                self._append(market_data)
+            blocked = self._backpressure_policy == 'Block' and self._backlog >= self._max_backlog_ticks
+
+        if started_dropping:
+            self._logger.warning(f"Tick persistence is {self._backlog} ticks behind, dropping ticks until it "
+                                 f"catches up, {self._dropped} dropped so far")
+        return not blocked
+
+    # with the lock held
+    def _append(self, market_data):
+        self._timestamps.append(market_data.timestamp)
+        self._tickers.append(market_data.ticker)
+        self._prices.append(market_data.price)
+        self._backlog += 1
+        if len(self._timestamps) >= self._batch_size:
+            self._hand_over()
+
+    async def wait_for_capacity(self):
+        # resume once the writer has worked off half of the allowed backlog
+        while self._backlog >= self._max_backlog_ticks // 2 and not self._closed:
+            await asyncio.sleep(0.001)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._hand_over()
+        self._batches.put(None)
+        self._thread.join()
+        for sink in self._sinks:
+            sink.close()
+        self._logger.info(f"Tick persistence closed: {self.get_stats()}")
+
+    def _hand_over(self):
+        # called with the lock held
+        if self._timestamps:
+            self._batches.put({
+                'timestamp': np.array(self._timestamps, dtype='int64'),
+                'ticker': np.array(self._tickers, dtype='object'),
+                'price': np.array(self._prices, dtype='float64')
+            })
+            self._timestamps, self._tickers, self._prices = [], [], []
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._batches.get(timeout=self._flush_interval_seconds)
+            except queue.Empty:
+                # time based flush of a partially filled buffer
+                with self._lock:
+                    self._hand_over()
+                for sink in self._sinks:
+                    try:
+                        sink.poll()
+                    except Exception:
+                        self._logger.exception(f"Failed to poll {sink.__class__.__name__}")
+                continue
+
+            if batch is None:
+                break
+            self._write(batch)
+
+        # drain what was handed over before close()
+        while not self._batches.empty():
+            batch = self._batches.get_nowait()
+            if batch is not None:
+                self._write(batch)
+
+    def _write(self, batch):
+        size = len(batch['timestamp'])
+        start_time = time.perf_counter()
+        for sink in self._sinks:
+            try:
+                sink.write_batch(batch)
+            except Exception:
+                self._failed += size
+                self._logger.exception(f"Failed to write {size} ticks to {sink.__class__.__name__}")
+
+        with self._lock:
+            self._backlog -= size
+            self._written += size
+        self._logger.debug(f"Wrote {size} ticks in {(time.perf_counter() - start_time) * 1000:.1f} ms, "
+                           f"backlog: {self._backlog}")
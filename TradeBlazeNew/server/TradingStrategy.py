@@ -1,42 +1,64 @@
 import asyncio
-import json
 import logging
-from dataclasses import asdict
 
-import pandas as pd
+import numpy as np
 import zmq
 import zmq.asyncio
 
 import Config
+from Codec import *
 from DataModels import *
 from Decorator import *
+from Indicators import *
+from LatencyMonitor import *
+from LoggingConfig import *
+from MarketDataFeed import *
+from RingBuffer import *
+from SnapshotClient import *
 
 
 class TradingStrategy:
-    def __init__(self, name='Unnamed Strategy'):
+    def __init__(self, name='Unnamed Strategy', history_size=1, enable_messaging=True):
         self._logger = logging.getLogger(self.__class__.__name__)
+        self._tick_log = HotPathLogger(self._logger)
 
         self._name = name
-        self._prices = []
+
+        # per-ticker price history, bounded to what the strategy needs to compute its signal, 0 = not kept
+        self._history_size = history_size
+        self._prices = {}
+
+        # max number of already queued ticks evaluated together in one vectorized step
+        self._max_batch_size = Config.SignalData.MaxBatchSize
+
+        self._codec = Codec.get_instance()
 
         # streaming pause/resume
         self._streaming_event = asyncio.Event()
         self._streaming_event.set()
 
+        self._queue_latency = LatencyMonitor().histogram("strategy.queue")
+        self._evaluate_latency = LatencyMonitor().histogram("strategy.evaluate")
+
+        # ZeroMQ sockets, not needed offline (e.g. by Backtester) where ticks are passed in directly
+        if enable_messaging:
+            self._connect()
+
+    def _connect(self):
         # ZeroMQ subscriber for market data
         ctx = zmq.asyncio.Context()
         self._market_socket = ctx.socket(zmq.SUB)
 
-        # Enable conflation
-        if Config.MarketData.EnableConflation:
-            self._market_socket.setsockopt(zmq.CONFLATE, 1)
-            self._logger.info('Conflation enabled for incoming market data ticks')
-
         # Set subscription filter (empty string = receive all messages)
         self._market_socket.setsockopt_string(zmq.SUBSCRIBE, '')
 
         # Connect to market data publisher
         self._market_socket.connect(Config.MarketData.ServerAddr)
+        self._market_receiver = SequencedReceiver(self._market_socket, ctx)
+        # a strategy falling behind evaluates the latest tick of every ticker instead of the backlog
+        self._conflator = Conflator(self._market_receiver, subscriber='TradingStrategy')
+        self._signals_sent = Metrics().counter("tradeblaze_signals_total", "Signals sent by the strategy",
+                                               ("ticker", "action"))
 
         # ZeroMQ publisher for signal data
         self._signal_socket = ctx.socket(zmq.PUSH)
@@ -46,13 +68,27 @@ class TradingStrategy:
         self._xpub_socket = ctx.socket(zmq.PUB)
         self._xpub_socket.connect(Config.MessageBroker.XSubSocketAddr)  # Connect to broker XSUB port
 
+        # the recent ticks cached by the MessageBroker, to warm up on start
+        self._snapshot_client = SnapshotClient(ctx)
+
+    # The live strategy, shared by the pipeline and the REST endpoints
     @staticmethod
     def get_instance():
+        return _get_live_trading_strategy()
+
+    # A new strategy instance, e.g. a backtest creates its own with enable_messaging=False
+    @staticmethod
+    def create(enable_messaging=True):
         if Config.SignalData.Strategy == 'MACDStrategy':
-            return MACDStrategy()
+            return MACDStrategy(enable_messaging=enable_messaging)
         else:
             raise ValueError(f'Invalid TradingStrategy: {Config.SignalData.Strategy}')
 
+    # sequence gap and loss counters of the market data feed
+    @property
+    def feed_stats(self):
+        return {**self._market_receiver.stats, **self._conflator.stats}
+
     def is_trading_engine_paused(self):
         return not self._streaming_event.is_set()
 
@@ -63,78 +99,151 @@ class TradingStrategy:
         self._streaming_event.set()
 
     async def on_market_data(self):
+        await self._warm_up()
+
         while True:
-            msg = await self._market_socket.recv_string()
+            ticks = await self._conflator.get_batch(self._max_batch_size)
 
             # process this received market data only if trading engine is not paused
             if not self.is_trading_engine_paused():
-                market_data = MarketData(**json.loads(msg))
-                self._prices.append(market_data.price)
+                start_ns = monotonic_ns()
+                for _, sent_ns in ticks:
+                    self._queue_latency.record(start_ns - sent_ns)
+                signals = self.evaluate([market_data for market_data, _ in ticks])
+                self._evaluate_latency.record(monotonic_ns() - start_ns)
+
+                if signals:
+                    # a signal has the timestamp and ticker of its tick
+                    sent_times = {(market_data.ticker, market_data.timestamp): sent_ns
+                                  for market_data, sent_ns in ticks}
+                    for signal_data, reason_dict in signals:
+                        await self._send_signal(signal_data, reason_dict,
+                                                sent_times[(signal_data.ticker, signal_data.timestamp)])
 
-                signal, reason_dict = self._generate_signal()
+            # Unlike await asyncio.sleep(0.01), this yields without a time cost.
+            await asyncio.sleep(0)
+
+    # Adds a batch of ticks to the price history and returns (signal_data, reason_dict) for every tick with a signal
+    def evaluate(self, batch):
+        signals = []
+        for batch_round in self._split_rounds(batch):
+            if self._history_size:
+                for market_data in batch_round:
+                    self._append_prices(market_data.ticker, [market_data.price])
+
+            results = self._generate_signals(batch_round)
+            for market_data, (signal, reason_dict) in zip(batch_round, results):
                 if signal:
                     signal_data = SignalData(timestamp=market_data.timestamp, ticker=market_data.ticker,
                                              price=market_data.price, action=signal)
-                    self._logger.info(f'Sending: {signal_data}, {reason_dict}')
-
-                    # send signal_data to MQ
-                    await self._signal_socket.send_string(json.dumps(asdict(signal_data)))
-                    await self._xpub_socket.send_string("SignalData: " + json.dumps(asdict(signal_data)))
-
-            # Unlike await asyncio.sleep(0.01), this yields without a time cost.
-            await asyncio.sleep(0)
+                    signals.append((signal_data, reason_dict))
+        return signals
+
+    # Offline evaluation of consecutive ticks of one ticker, returns the action of every tick ('' = no signal).
+    # This goes through evaluate() one tick at a time, subclasses can override it with a vectorized version.
+    def evaluate_series(self, ticker, timestamps, prices):
+        actions = np.full(len(prices), '', dtype='<U4')
+        for i, (timestamp, price) in enumerate(zip(timestamps.tolist(), prices.tolist())):
+            signals = self.evaluate([MarketData(timestamp=timestamp, ticker=ticker, price=price)])
+            if signals:
+                actions[i] = signals[0][0].action
+        return actions
+
+    # A restarted strategy replays the recent ticks cached by the MessageBroker, without sending signals,
+    # so it can signal from its first live tick instead of waiting for a full window of new ticks.
+    # Only the ticks of the latest gateway stream count, the cache can still hold those of an earlier gateway run.
+    # The live ticks that were already replayed are skipped by their sequence number, see SequencedReceiver.
+    async def _warm_up(self):
+        snapshot = await self._snapshot_client.fetch(TOPICS[MarketData])
+        if not snapshot:
+            return
+
+        # (stream id, seq) of every tick, the stream id being the gateway's start time
+        headers = [SEQUENCE_HEADER.unpack(header)[:2] for _, _, header in snapshot]
+        stream_id, last_seq = max(headers)
+
+        ticks = {}
+        for (_, payload, _), (tick_stream_id, _) in zip(snapshot, headers):
+            if tick_stream_id == stream_id:
+                market_data = Codec.decode(payload)
+                ticks.setdefault(market_data.ticker, []).append(market_data)
+        for ticker, market_data_list in ticks.items():
+            self.evaluate_series(ticker, np.array([market_data.timestamp for market_data in market_data_list]),
+                                 np.array([market_data.price for market_data in market_data_list]))
+        self._market_receiver.skip_until(stream_id, last_seq)
+        self._logger.info(f"Warmed up with {sum(map(len, ticks.values()))} cached ticks of {len(ticks)} tickers, "
+                          f"up to tick {last_seq} of stream {stream_id}")
+
+    def _append_prices(self, ticker, prices):
+        if ticker not in self._prices:
+            self._prices[ticker] = RingBuffer(self._history_size)
+        for price in prices[-self._history_size:]:
+            self._prices[ticker].append(price)
 
-    def _generate_signal(self):
-        raise NotImplementedError('Subclasses must implement generate_signal')
+    @staticmethod
+    def _split_rounds(batch):
+        # a vectorized step takes at most one tick per ticker, so the n-th tick of every ticker goes to round n
+        rounds = []
+        tick_counts = {}
+        for market_data in batch:
+            n = tick_counts.get(market_data.ticker, 0)
+            tick_counts[market_data.ticker] = n + 1
+            if n == len(rounds):
+                rounds.append([])
+            rounds[n].append(market_data)
+        return rounds
+
+    # tick_sent_ns: when the gateway sent the tick of this signal, carried along for the tick-to-fill latency
+    async def _send_signal(self, signal_data, reason_dict, tick_sent_ns):
+        self._tick_log.info("signal_sent", ticker=signal_data.ticker, action=signal_data.action,
+                            price=signal_data.price, reason=reason_dict)
+
+        # send signal_data to MQ
+        payload = self._codec.encode(signal_data)
+        self._signals_sent.labels(signal_data.ticker, signal_data.action).inc()
+        await self._signal_socket.send_multipart([payload, SIGNAL_TIMES.pack(tick_sent_ns, monotonic_ns())])
+        await self._xpub_socket.send_multipart([Codec.get_topic(signal_data), payload])
+
+    # Returns one (signal, reason_dict) per tick, the batch holds at most one tick per ticker
+    def _generate_signals(self, batch):
+        raise NotImplementedError('Subclasses must implement generate_signals')
 
 
-@singleton
 class MACDStrategy(TradingStrategy):
-    def __init__(self, short_window=12, long_window=26, signal_window=9):
-        super().__init__(name='MACD Strategy')
+    def __init__(self, short_window=12, long_window=26, signal_window=9, enable_messaging=True):
+        # the streaming MACD keeps its own state, no price history is needed
+        super().__init__(name='MACD Strategy', history_size=0, enable_messaging=enable_messaging)
         self._short_window = short_window
         self._long_window = long_window
         self._signal_window = signal_window
 
-        self._macd_df = None
-
-    def _generate_signal(self):
-        # Computes MACD, signal line, and histogram using pandas.
-        if len(self._prices) < self._long_window:
-            self._logger.info(
-                f'Not enough data to compute MACD, available: {len(self._prices)}, required: {self._long_window}')
-            return None, None
+        # O(1) per tick streaming MACD with per-ticker state,
+        # see Indicators.StreamingMACD for the tolerance vs the pandas version
+        self._macd = StreamingMACD(short_window, long_window, signal_window)
 
-        prices = pd.Series(self._prices[-self._long_window:], dtype='float64')
+    def _generate_signals(self, batch):
+        slots = [self._macd.slot(market_data.ticker) for market_data in batch]
+        prices = [market_data.price for market_data in batch]
+        macd, signal, ready, action = self._macd.update(slots, prices)
 
-        ema_short = prices.ewm(span=self._short_window, adjust=False).mean()
-        ema_long = prices.ewm(span=self._long_window, adjust=False).mean()
-        macd_line = ema_short - ema_long
-        macd_line = round(macd_line, 2)
-        signal_line = macd_line.ewm(span=self._signal_window, adjust=False).mean()
-        signal_line = round(signal_line, 2)
-        # histogram = macd_line - signal_line
+        results = []
+        for i, market_data in enumerate(batch):
+            if not ready[i]:
+                self._logger.info(f'Not enough data to compute MACD for {market_data.ticker}, '
+                                  f'available: {self._macd.count(market_data.ticker)}, required: {self._long_window}')
+                results.append((None, None))
+                continue
 
-        macd_df = pd.DataFrame({
-            'Price': prices,
-            'MACD': macd_line,
-            'Signal': signal_line,
-            # 'Histogram': histogram
-        })
+            # add more items in reason dict as needed for debugging
+            reason_dict = {'Price': market_data.price, 'MACD': float(macd[i]), 'Signal': float(signal[i])}
+            results.append((str(action[i]), reason_dict))
+        return results
 
-        if self._macd_df is None:
-            self._macd_df = macd_df
+    def evaluate_series(self, ticker, timestamps, prices):
+        _, _, ready, action = self._macd.update_series(self._macd.slot(ticker), prices)
+        return np.where(ready, action, '')
 
-        self._macd_df.loc[len(self._macd_df)] = macd_df.iloc[-1]
 
-        prev = self._macd_df.iloc[-2]
-        curr = self._macd_df.iloc[-1]
-
-        signal = 'HOLD'
-        if curr['MACD'] > curr['Signal'] and prev['MACD'] <= prev['Signal']:
-            signal = 'BUY'
-        elif curr['MACD'] < curr['Signal'] and prev['MACD'] >= prev['Signal']:
-            signal = 'SELL'
-
-        reason_dict = curr.to_dict()  # add more items in dict as needed for debugging
-        return signal, curr.to_dict()
+@singleton
+def _get_live_trading_strategy():
+    return TradingStrategy.create()
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import aiosqlite
+import bcrypt
+
+import Config
+from Decorator import *
+
+
+# A login refused because too many password checks are waiting already
+class TooManyLoginsError(RuntimeError):
+    pass
+
+
+# Credentials of the dashboard users, see DbUtils.set_up_users_db.
+# A bcrypt check takes 100-300 ms of CPU, so it runs in a bounded thread pool (bcrypt releases the GIL while
+# hashing) instead of on the event loop, and a login beyond Config.Auth.MaxPendingChecks waiting checks is refused
+# right away instead of queueing. The user db is read through a pool of connections that stay open.
+@singleton
+class UserStore:
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._executor = ThreadPoolExecutor(max_workers=Config.Auth.CheckWorkers,
+                                            thread_name_prefix=self.__class__.__name__)
+        self._pending_checks = 0
+
+        self._idle_connections = asyncio.Queue()
+        self._connection_count = 0
+
+    # Returns whether the password is the user's, raises TooManyLoginsError when overloaded
+    async def check_password(self, username, password):
+        if self._pending_checks >= Config.Auth.MaxPendingChecks:
+            raise TooManyLoginsError(f"{self._pending_checks} logins are being checked already")
+
+        self._pending_checks += 1
+        try:
+            stored_hash = await self.get_password_hash(username)
+            if stored_hash is None:
+                return False
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, bcrypt.checkpw, password.encode(), stored_hash.encode())
+        finally:
+            self._pending_checks -= 1
+
+    async def get_password_hash(self, username):
+        async with self._connection() as db:
+            async with db.execute("SELECT hashed_password FROM users WHERE username = ?", (username,)) as cursor:
+                row = await cursor.fetchone()
+        return None if row is None else row[0]
+
+    # up to Config.Auth.UserStorePoolSize connections, opened on demand
+    @asynccontextmanager
+    async def _connection(self):
+        if self._idle_connections.empty() and self._connection_count < Config.Auth.UserStorePoolSize:
+            self._connection_count += 1
+            try:
+                db = await aiosqlite.connect(Config.Auth.UserDbPath)
+            except Exception:
+                self._connection_count -= 1
+                raise
+            self._logger.info(f"Opened user db connection {self._connection_count}")
+        else:
+            db = await self._idle_connections.get()
+        try:
+            yield db
+        finally:
+            self._idle_connections.put_nowait(db)
+
+    async def close(self):
+        while not self._idle_connections.empty():
+            await self._idle_connections.get_nowait().close()
+            self._connection_count -= 1
+        self._executor.shutdown(wait=False)
+
+
+# Logged in users by session token, so that a request is authenticated by a dict lookup instead of bcrypt.
+# A token expires Config.Auth.SessionTtlSeconds after the login. Sessions are kept in memory only,
+# a restart of the server logs everyone out.
+@singleton
+class SessionStore:
+    def __init__(self):
+        self._sessions = {}  # token -> (username, expiry time.monotonic())
+
+    def create(self, username):
+        self._remove_expired()
+        token = secrets.token_urlsafe(32)
+        self._sessions[token] = (username, time.monotonic() + Config.Auth.SessionTtlSeconds)
+        return token
+
+    # Returns the username of a valid token, None if the token is unknown or expired
+    def get_username(self, token):
+        session = self._sessions.get(token)
+        if session is None:
+            return None
+        username, expires_at = session
+        if time.monotonic() >= expires_at:
+            del self._sessions[token]
+            return None
+        return username
+
+    def remove(self, token):
+        self._sessions.pop(token, None)
+
+    def _remove_expired(self):
+        now = time.monotonic()
+        for token in [token for token, (_, expires_at) in self._sessions.items() if now >= expires_at]:
+            del self._sessions[token]